@@ -0,0 +1,87 @@
+"""
+One-off: chapter segments for videos processed before video_segments existed.
+
+    python backfill_segments.py --batch 50
+    python backfill_segments.py --dry-run
+
+Those videos only have the 'chapters' JSON: /search can only match them as a
+whole (legacy_hits in search.py) and GET /videos/{id}/chapters finds nothing.
+Each one gets its segments exactly as the worker builds them (build_segments),
+embedded by the same service, and its owner's cached /search results are
+invalidated. Videos that already have segments are skipped, so it can be
+stopped and run again.
+"""
+import argparse
+from sqlalchemy import exists
+from sqlalchemy.orm import load_only
+import models
+from database import engine, SessionLocal
+from decoupling import build_segments
+from embedding_service import get_embedding_service
+from search_cache import bump_library_version
+
+
+def pending(db, limit):
+    """
+    Processed videos without a single segment, oldest first.
+    """
+    return db.query(models.Video).options(
+        load_only(
+            models.Video.id, models.Video.user_id, models.Video.chapters,
+            models.Video.transcript_summary, models.Video.embedding
+        )
+    ).filter(
+        models.Video.processed.is_(True),
+        ~exists().where(models.VideoSegment.video_id == models.Video.id)
+    ).order_by(models.Video.id).limit(limit).all()
+
+
+def backfill(db, videos):
+    segments = {video.id: build_segments(video.chapters, video.transcript_summary) for video in videos}
+    vectors = iter(get_embedding_service().embed_documents_pooled(
+        [s["content"] for video in videos for s in segments[video.id]]
+    ))
+    for video in videos:
+        for seg in segments[video.id]:
+            vector = next(vectors)
+            if vector is None: # Nothing to embed (no label, summary or notes): the video's own vector
+                vector = video.embedding
+            db.add(models.VideoSegment(video_id=video.id, user_id=video.user_id, embedding=vector, **seg))
+    for user_id in {video.user_id for video in videos}:
+        bump_library_version(db, user_id)
+    db.commit()
+    return sum(len(s) for s in segments.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build video_segments for videos processed before they existed")
+    parser.add_argument("--batch", type=int, default=50, help="Videos embedded and committed together")
+    parser.add_argument("--dry-run", action="store_true", help="Only count the videos to backfill")
+    args = parser.parse_args()
+
+    models.init_db(engine)
+    db = SessionLocal()
+    try:
+        if args.dry_run:
+            count = db.query(models.Video.id).filter(
+                models.Video.processed.is_(True),
+                ~exists().where(models.VideoSegment.video_id == models.Video.id)
+            ).count()
+            print(f"🔎 {count} processed video(s) without segments.")
+            return
+
+        videos_done = segments_done = 0
+        while True:
+            videos = pending(db, args.batch)
+            if not videos:
+                break
+            segments_done += backfill(db, videos)
+            videos_done += len(videos)
+            print(f"🧩 {videos_done} video(s) backfilled ({segments_done} segments)...")
+        print(f"✅ Done: {videos_done} video(s), {segments_done} segments.")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
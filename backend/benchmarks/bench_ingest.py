@@ -0,0 +1,175 @@
+"""
+Offline ingestion benchmark: throughput and per-stage latency of process_video_task.
+
+    python benchmarks/bench_ingest.py --videos 8 --duration 120 --concurrency 2
+    python benchmarks/bench_ingest.py --videos 8 --rate-limit-429 0.2 --bad-json 0.1
+
+Synthetic lecture-like videos (ffmpeg test pattern + tone) go through the real
+pipeline: job queue -> S3 ranged download -> FFmpeg -> fake Gemini -> fake
+embeddings -> Postgres. Only the remote services are faked (see fakes.py);
+their latency and failure rates are flags, so a run measures OUR code under
+a known, repeatable service behaviour. Setup: see harness.py.
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import harness
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark video ingestion offline")
+    parser.add_argument("--videos", type=int, default=4)
+    parser.add_argument("--duration", type=int, default=120, help="Seconds per synthetic video")
+    parser.add_argument("--resolution", default="1280x720")
+    parser.add_argument("--concurrency", type=int, default=2, help="Worker slots")
+    parser.add_argument("--real-quotas", action="store_true", help="Keep the Gemini rate limits (default: unlimited)")
+    # Fake service behaviour (see fakes.FakeConfig)
+    parser.add_argument("--latency-scale", type=float)
+    parser.add_argument("--upload-mb-per-sec", type=float)
+    parser.add_argument("--processing-sec", type=float)
+    parser.add_argument("--generate-base-sec", type=float)
+    parser.add_argument("--rate-limit-429", type=float)
+    parser.add_argument("--bad-json", type=float)
+    parser.add_argument("--seed", type=int)
+    return parser.parse_args()
+
+
+def synthetic_video(ffmpeg_exe, duration, resolution):
+    """
+    A cached test video: moving test pattern (so scene detection has work) + a tone.
+    """
+    media_dir = os.path.join(harness.BENCH_DIR, ".media")
+    os.makedirs(media_dir, exist_ok=True)
+    path = os.path.join(media_dir, f"lecture-{duration}s-{resolution}.mp4")
+    if not os.path.exists(path):
+        print(f"🎥 Generating {path}...")
+        subprocess.run([
+            ffmpeg_exe, "-y",
+            "-f", "lavfi", "-i", f"testsrc2=size={resolution}:rate=25:duration={duration}",
+            "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}",
+            "-c:v", "libx264", "-preset", "ultrafast", "-c:a", "aac",
+            "-movflags", "+faststart", path
+        ], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return path
+
+
+def unique_copy(ffmpeg_exe, source, index):
+    # Same frames, different bytes: otherwise the content-hash dedup would skip every video but one
+    path = os.path.join(harness.BENCH_DIR, ".media", f"upload-{index}.mp4")
+    subprocess.run([
+        ffmpeg_exe, "-y", "-i", source, "-c", "copy", "-metadata", f"comment=bench-{index}", path
+    ], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return path
+
+
+def main():
+    args = parse_args()
+    harness.configure_environment()
+    if not args.real_quotas:
+        os.environ["GEMINI_QUOTAS"] = (
+            '{"gemini-flash-latest": {"rpm": 100000, "tpm": 1000000000},'
+            ' "gemini-robotics-er-1.5-preview": {"rpm": 100000, "tpm": 1000000000}}'
+        )
+    os.environ.setdefault("JOB_RETRY_BASE_SECONDS", "1")
+
+    import imageio_ffmpeg
+    import models
+    import metrics
+    import scratch
+    import worker
+    import decoupling
+    from database import SessionLocal
+    from job_queue import enqueue_job
+    from embedding_service import get_embedding_service
+    from fakes import FakeConfig, FakeGenai, FakeEmbeddings, configure_embeddings
+
+    # Swap the remote services for the fakes
+    config = FakeConfig.from_args(args)
+    fake_genai = FakeGenai(config)
+    decoupling.genai = fake_genai
+    configure_embeddings(config)
+    get_embedding_service().client = FakeEmbeddings()
+    s3_client, stop_s3 = harness.start_s3()
+    decoupling.s3_client = s3_client
+
+    harness.reset_database()
+    scratch.sweep()
+
+    # Collect every span the pipeline reports
+    spans = {}
+    jobs = []
+    lock = threading.Lock()
+    def collect(record):
+        with lock:
+            if record["event"] == "stage":
+                spans.setdefault(record["stage"], []).append(record["seconds"])
+            elif record["event"] == "ingest_done":
+                jobs.append(record)
+    metrics.add_listener(collect)
+
+    # Library to ingest
+    ffmpeg_exe = imageio_ffmpeg.get_ffmpeg_exe()
+    source = synthetic_video(ffmpeg_exe, args.duration, args.resolution)
+    db = SessionLocal()
+    try:
+        for i in range(args.videos):
+            key = f"uploads/bench-{i}.mp4"
+            s3_client.upload_file(unique_copy(ffmpeg_exe, source, i), harness.BUCKET, key)
+            video = models.Video(title=f"Bench {i}", s3_key=key, user_id="bench", processed=False)
+            db.add(video)
+            db.flush()
+            enqueue_job(db, video.id, key)
+        db.commit()
+    finally:
+        db.close()
+
+    # Drain the queue with N slots, exactly like worker.py does
+    print(f"🏁 Ingesting {args.videos} x {args.duration}s videos with {args.concurrency} slot(s)...")
+    def slot(worker_id):
+        while worker.run_one(worker_id):
+            pass
+    started = time.perf_counter()
+    threads = [threading.Thread(target=slot, args=(f"bench/{i}",)) for i in range(args.concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+    stop_s3()
+
+    db = SessionLocal()
+    try:
+        processed = db.query(models.Video).filter(models.Video.processed == True).count()
+        not_done = db.query(models.IngestionJob).filter(models.IngestionJob.status != "done").count()
+    finally:
+        db.close()
+
+    results = {
+        "wall_seconds": round(wall, 2),
+        "videos_processed": processed,
+        "jobs_not_done": not_done,
+        "videos_per_minute": round(processed / wall * 60, 3) if wall else 0,
+        "media_hours_per_hour": round(processed * args.duration / wall, 3) if wall else 0,
+        "job_seconds": harness.summarize([j["seconds"] for j in jobs if j["outcome"] == "processed"]),
+        "gemini_tokens_per_video": harness.summarize([j["gemini_tokens"] for j in jobs if j["outcome"] == "processed"], scale=1),
+        "stages_ms": {name: harness.summarize(values) for name, values in sorted(spans.items())},
+        "fake_service_calls": fake_genai.calls
+    }
+
+    print(f"\n{'STAGE':<20} | {'N':>4} | {'P50 ms':>10} | {'P99 ms':>10} | {'MAX ms':>10}")
+    print("-" * 66)
+    for name, stats in results["stages_ms"].items():
+        print(f"{name:<20} | {stats['count']:>4} | {stats['p50']:>10.1f} | {stats['p99']:>10.1f} | {stats['max']:>10.1f}")
+    print(f"\n{processed}/{args.videos} videos in {wall:.1f}s -> {results['videos_per_minute']} videos/min")
+
+    params = {**vars(args), "fake_config": vars(config)}
+    harness.write_results("ingest", params, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+GET /videos/ benchmark: offset vs keyset paging, full vs compact rows.
+
+    python benchmarks/bench_listing.py --api http://127.0.0.1:8000 --pages 20 --limit 100 --user bench-0
+
+--user needs the API's TRUSTED_PROXY_SECRET in the environment.
+
+Walks the library page by page with each strategy and prints, per strategy,
+the payload size and latency (p50 / p99 / deepest page). Run it against a
+library large enough to show the deep-offset cost (bench_search.py leaves
+one behind: --user bench-0). The run is saved like the other benchmarks, so
+compare.py can diff two of them.
+"""
+import os
+import sys
+import time
+import json
+import argparse
+import statistics
+import urllib.request
+from urllib.parse import urlencode
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import harness
+
+
+def fetch(api, params, user):
+    started = time.perf_counter()
+    # Listings are per user: act as the auth proxy (TRUSTED_PROXY_SECRET); without --user the API's default user
+    headers = {"X-User-Id": user, "X-Proxy-Secret": os.getenv("TRUSTED_PROXY_SECRET", "")} if user else {}
+    request = urllib.request.Request(f"{api}/videos/?{urlencode(params)}", headers=headers)
+    with urllib.request.urlopen(request) as response:
+        body = response.read()
+        cursor = response.headers.get("X-Next-Cursor")
+    return time.perf_counter() - started, len(body), json.loads(body), cursor
+
+
+def walk(api, pages, limit, view, keyset, user=None):
+    latencies, sizes = [], []
+    cursor = None
+    for page in range(pages):
+        params = {"limit": limit, "view": view}
+        if keyset:
+            if page and not cursor:
+                break
+            if cursor:
+                params["cursor"] = cursor
+        else:
+            params["skip"] = page * limit
+        seconds, size, rows, cursor = fetch(api, params, user)
+        latencies.append(seconds * 1000)
+        sizes.append(size)
+        if not rows:
+            break
+    return latencies, sizes
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark GET /videos/ paging")
+    parser.add_argument("--api", default="http://127.0.0.1:8000")
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--user", help="X-User-Id of the library to walk")
+    args = parser.parse_args()
+
+    print(f"{'STRATEGY':<18} | {'PAGES':>5} | {'AVG KB':>8} | {'P50 ms':>8} | {'P99 ms':>8} | {'LAST ms':>8}")
+    print("-" * 70)
+    results = {}
+    for view in ("full", "compact"):
+        for keyset in (False, True):
+            latencies, sizes = walk(args.api, args.pages, args.limit, view, keyset, args.user)
+            if not latencies:
+                continue
+            name = f"{'keyset' if keyset else 'offset'}/{view}"
+            results[name] = {
+                "pages": len(latencies),
+                "avg_kb": round(statistics.mean(sizes) / 1024, 1),
+                "p50": round(percentile(latencies, 50), 2),
+                "p99": round(percentile(latencies, 99), 2),
+                "last": round(latencies[-1], 2)
+            }
+            stats = results[name]
+            print(
+                f"{name:<18} | {stats['pages']:>5} | {stats['avg_kb']:>8.1f} | "
+                f"{stats['p50']:>8.1f} | {stats['p99']:>8.1f} | {stats['last']:>8.1f}"
+            )
+    harness.write_results("listing", vars(args), {"strategies": results})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Offline /search benchmark: p50/p99 latency as the library grows.
+
+    python benchmarks/bench_search.py --sizes 100,1000,10000 --queries 200 --concurrency 8
+    python benchmarks/bench_search.py --sizes 10000,100000 --tenants 100
+
+For every library size the tables are filled (incrementally) with synthetic
+processed videos and chapter segments, then /search is called in-process
+(ASGI, no network) through the real FastAPI app and the real SQL.
+The query embedding comes from fakes.FakeEmbeddings; --embed-ms sets its latency.
+With --tenants N the videos are spread over N users and every query runs as
+the first one, so latency should follow size / N, not size.
+
+Each size is measured twice: 'cold' (every query new) and 'warm' (the same
+queries again, so caches in front of the database can show their effect:
+with the /search result cache, 'warm' measures cache hits).
+Setup: see harness.py.
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import harness
+
+SEGMENTS_PER_VIDEO = 5
+INSERT_BATCH = 500
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark /search offline")
+    parser.add_argument("--sizes", default="100,1000,10000", help="Library sizes (videos), ascending")
+    parser.add_argument("--queries", type=int, default=200, help="Queries per size and pass")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--embed-ms", type=float, default=0.0, help="Fake query-embedding latency")
+    parser.add_argument("--tenants", type=int, default=1, help="Users the library is spread over")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
+
+
+def tenant(video_id, tenants):
+    return f"bench-{video_id % tenants}"
+
+
+def seed_library(engine, models, fakes, start, end, rng, tenants):
+    """
+    Inserts processed videos [start, end) with their segments, in batches.
+    Bumps the library version like the worker does, so cached results of the previous size are not reused.
+    """
+    from search_cache import bump_library_version
+    topics = fakes.TOPICS
+    videos, segments = [], []
+
+    def flush():
+        with engine.begin() as conn:
+            if videos:
+                conn.execute(models.Video.__table__.insert(), videos)
+            if segments:
+                conn.execute(models.VideoSegment.__table__.insert(), segments)
+        videos.clear()
+        segments.clear()
+
+    for video_id in range(start + 1, end + 1):
+        picked = rng.sample(topics, 3)
+        transcript = f"A lecture about {', '.join(picked)}."
+        chapters = [
+            {"timestamp": f"{k * 4:02d}:00", "label": f"{topic.title()} basics", "summary": f"Explains {topic}."}
+            for k, topic in enumerate(picked)
+        ]
+        videos.append({
+            "id": video_id,
+            "title": f"{picked[0].title()} lecture {video_id}",
+            "s3_key": f"uploads/bench-{video_id}.mp4",
+            "user_id": tenant(video_id, tenants),
+            "processed": True,
+            "transcript_summary": transcript,
+            "visual_summary": f"Slides about {picked[0]}.",
+            "chapters": chapters,
+            "tags": picked,
+            "embedding": fakes.text_vector(transcript)
+        })
+        for k in range(SEGMENTS_PER_VIDEO):
+            topic = picked[k % len(picked)]
+            content = f"{topic.title()} basics\nExplains {topic} in part {k}."
+            segments.append({
+                "video_id": video_id,
+                "user_id": tenant(video_id, tenants),
+                "start_sec": k * 240,
+                "end_sec": (k + 1) * 240,
+                "label": f"{topic.title()} basics",
+                "content": content,
+                "embedding": fakes.text_vector(content)
+            })
+        if len(videos) >= INSERT_BATCH:
+            flush()
+    flush()
+
+    with engine.begin() as conn:
+        conn.exec_driver_sql("SELECT setval(pg_get_serial_sequence('videos', 'id'), (SELECT max(id) FROM videos))")
+        for i in range(tenants):
+            bump_library_version(conn, f"bench-{i}")
+        conn.exec_driver_sql("ANALYZE videos")
+        conn.exec_driver_sql("ANALYZE video_segments")
+
+
+def make_queries(fakes, count, rng):
+    # Mix of natural-language questions and exact terms, so both retrievers work
+    templates = ["how does {} work", "{}", "explain {} and {}", "{} tutorial", "what is {}"]
+    queries = []
+    for i in range(count):
+        template = rng.choice(templates)
+        topics = rng.sample(fakes.TOPICS, template.count("{}"))
+        queries.append(f"{template.format(*topics)} #{i}") # '#i': every query is distinct
+    return queries
+
+
+async def run_queries(client, queries, concurrency, limit, user):
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(query):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.post("/search", json={"query": query, "limit": limit}, headers=harness.user_headers(user))
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(q) for q in queries))
+    wall = time.perf_counter() - started
+    return latencies, errors, wall
+
+
+async def bench(args):
+    import httpx
+    import models
+    import main
+    import fakes
+    from database import engine, async_engine
+
+    fakes.configure_embeddings(fakes.FakeConfig(
+        embed_base_sec=args.embed_ms / 1000, embed_sec_per_text=0.0, seed=args.seed
+    ))
+    main.embeddings = fakes.FakeEmbeddings()
+
+    rng = random.Random(args.seed)
+    sizes = sorted(int(s) for s in args.sizes.split(","))
+    results = {}
+    seeded = 0
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        user = tenant(0, args.tenants)
+        await client.post("/search", json={"query": "warm up", "limit": args.limit}, headers=harness.user_headers(user)) # Pools, codecs
+        for size in sizes:
+            print(f"📚 Library: {size} videos ({size * SEGMENTS_PER_VIDEO} segments), {args.tenants} user(s)...")
+            await asyncio.to_thread(seed_library, engine, models, fakes, seeded, size, rng, args.tenants)
+            seeded = size
+
+            queries = make_queries(fakes, args.queries, rng)
+            size_results = {}
+            for phase in ("cold", "warm"):
+                latencies, errors, wall = await run_queries(client, queries, args.concurrency, args.limit, user)
+                size_results[phase] = {
+                    **harness.summarize(latencies),
+                    "errors": errors,
+                    "qps": round(len(queries) / wall, 2) if wall else 0
+                }
+                stats = size_results[phase]
+                print(
+                    f"   {phase:<5} p50 {stats['p50']:>8.1f} ms | p99 {stats['p99']:>8.1f} ms | "
+                    f"{stats['qps']:>7.1f} q/s | {errors} errors"
+                )
+            results[str(size)] = size_results
+    await async_engine.dispose()
+    return results
+
+
+def main():
+    args = parse_args()
+    harness.configure_environment()
+    harness.reset_database()
+    results = asyncio.run(bench(args))
+    harness.write_results("search", vars(args), {"sizes": results})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+Compares two benchmark runs (files written by bench_ingest.py / bench_search.py / bench_listing.py).
+
+    python benchmarks/compare.py benchmarks/results/search-abc123-....json benchmarks/results/search-def456-....json
+
+Prints every numeric result of the first run next to the second one with the
+relative change. Lower is better for latencies; check the sign accordingly.
+Warns when the two runs used different parameters or machines.
+"""
+import sys
+import json
+
+
+def flatten(value, prefix=""):
+    if isinstance(value, dict):
+        items = {}
+        for key, child in value.items():
+            items.update(flatten(child, f"{prefix}.{key}" if prefix else str(key)))
+        return items
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix: value}
+    return {}
+
+
+def main():
+    if len(sys.argv) != 3:
+        sys.exit(__doc__)
+    with open(sys.argv[1]) as f:
+        before = json.load(f)
+    with open(sys.argv[2]) as f:
+        after = json.load(f)
+
+    if before["bench"] != after["bench"]:
+        sys.exit(f"Different benchmarks: {before['bench']} vs {after['bench']}")
+    for section in ("params", "machine"):
+        if before[section] != after[section]:
+            print(f"⚠️ The runs have different {section}: the comparison may not be meaningful.")
+
+    a, b = flatten(before["results"]), flatten(after["results"])
+    print(f"{'METRIC':<45} | {before['revision']:>14} | {after['revision']:>14} | {'CHANGE':>8}")
+    print("-" * 92)
+    for key in sorted(a.keys() & b.keys()):
+        change = f"{(b[key] - a[key]) / a[key] * 100:+.1f}%" if a[key] else "-"
+        print(f"{key:<45} | {a[key]:>14} | {b[key]:>14} | {change:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""
+Offline stand-ins for Gemini (google.generativeai) and the embedding client.
+
+They implement only what the backend calls, with configurable latency and
+failure injection, so ingestion and search can be benchmarked without
+network, keys or quota:
+
+    FakeGenai        upload_file / get_file / delete_file / GenerativeModel
+                     (count_tokens, generate_content with usage_metadata)
+    FakeEmbeddings   embed_query / embed_documents / aembed_query
+                     (deterministic bag-of-words vectors: similar text -> similar vector)
+
+All randomness comes from one seeded random.Random, so two runs with the
+same FakeConfig make the same decisions.
+"""
+import os
+import json
+import time
+import asyncio
+import hashlib
+import random
+import threading
+from functools import lru_cache
+from dataclasses import dataclass
+from types import SimpleNamespace
+
+DIMENSIONS = 768
+
+
+@dataclass
+class FakeConfig:
+    upload_mb_per_sec: float = 50.0 # Upload bandwidth to the fake Files API
+    processing_sec: float = 2.0 # Time a file stays PROCESSING
+    generate_base_sec: float = 3.0 # Fixed cost of one generate_content call
+    generate_sec_per_1k_tokens: float = 0.01
+    count_tokens_sec: float = 0.2
+    embed_base_sec: float = 0.1 # Fixed cost of one embedding request
+    embed_sec_per_text: float = 0.005
+    rate_limit_429: float = 0.0 # Probability that a generate/embed call fails with a 429
+    bad_json: float = 0.0 # Probability that an answer is malformed JSON
+    latency_scale: float = 1.0 # Multiplies every latency (0 = no sleeps at all)
+    seed: int = 42
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(**{k: v for k, v in vars(args).items() if k in cls.__dataclass_fields__ and v is not None})
+
+
+class FakeRandom:
+    def __init__(self, seed):
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def chance(self, probability):
+        if probability <= 0:
+            return False
+        with self._lock:
+            return self._rng.random() < probability
+
+
+class ResourceExhausted(Exception):
+    # Same wording as the real error: the backend looks for "429" / "ResourceExhausted"
+    def __init__(self):
+        super().__init__("429 ResourceExhausted: Resource has been exhausted (e.g. check quota).")
+
+
+# --- GEMINI ---
+
+class FakeGenai:
+    def __init__(self, config=None):
+        self.config = config or FakeConfig()
+        self.random = FakeRandom(self.config.seed)
+        self._files = {}
+        self._lock = threading.Lock()
+        self.calls = {"upload": 0, "generate": 0, "count_tokens": 0, "rate_limited": 0, "bad_json": 0}
+
+    def _sleep(self, seconds):
+        if self.config.latency_scale > 0 and seconds > 0:
+            time.sleep(seconds * self.config.latency_scale)
+
+    def _count(self, name):
+        with self._lock:
+            self.calls[name] += 1
+
+    def configure(self, **kwargs):
+        pass
+
+    # Files API
+    def upload_file(self, path, **kwargs):
+        size = os.path.getsize(path)
+        self._sleep(size / (self.config.upload_mb_per_sec * 1024 * 1024))
+        self._count("upload")
+        name = f"files/fake-{hashlib.md5(f'{path}{time.time()}'.encode()).hexdigest()[:12]}"
+        with self._lock:
+            self._files[name] = {"path": path, "size": size, "ready_at": time.monotonic() + self.config.processing_sec * self.config.latency_scale}
+        return self.get_file(name)
+
+    def get_file(self, name):
+        with self._lock:
+            entry = self._files.get(name)
+        if entry is None:
+            raise KeyError(f"404 File {name} not found")
+        state = "ACTIVE" if time.monotonic() >= entry["ready_at"] else "PROCESSING"
+        return SimpleNamespace(name=name, state=SimpleNamespace(name=state), size_bytes=entry["size"])
+
+    def delete_file(self, name):
+        with self._lock:
+            self._files.pop(name, None)
+
+    def GenerativeModel(self, model_name=None, **kwargs):
+        return FakeModel(self, model_name)
+
+    def request_tokens(self, contents):
+        tokens = 0
+        for part in contents if isinstance(contents, list) else [contents]:
+            if isinstance(part, str):
+                tokens += len(part) // 4
+            elif getattr(part, "size_bytes", None):
+                tokens += part.size_bytes // 1000 # Media tokens grow with the file
+        return max(tokens, 1)
+
+
+class FakeModel:
+    def __init__(self, genai, model_name):
+        self.genai = genai
+        self.model_name = model_name
+
+    def count_tokens(self, contents):
+        self.genai._sleep(self.genai.config.count_tokens_sec)
+        self.genai._count("count_tokens")
+        return SimpleNamespace(total_tokens=self.genai.request_tokens(contents))
+
+    def generate_content(self, contents, generation_config=None, **kwargs):
+        config = self.genai.config
+        if self.genai.random.chance(config.rate_limit_429):
+            self.genai._count("rate_limited")
+            raise ResourceExhausted()
+
+        prompt_tokens = self.genai.request_tokens(contents)
+        self.genai._sleep(config.generate_base_sec + prompt_tokens / 1000 * config.generate_sec_per_1k_tokens)
+        self.genai._count("generate")
+
+        text = json.dumps(fake_analysis(prompt_tokens))
+        if self.genai.random.chance(config.bad_json):
+            self.genai._count("bad_json")
+            # The classic failure: an unescaped quote inside a string
+            text = text.replace("overview of", 'overview of "the', 1)
+        output_tokens = len(text) // 4
+        return SimpleNamespace(
+            text=text,
+            usage_metadata=SimpleNamespace(
+                prompt_token_count=prompt_tokens,
+                candidates_token_count=output_tokens,
+                total_token_count=prompt_tokens + output_tokens
+            )
+        )
+
+
+TOPICS = [
+    "event loop", "react hooks", "binary search", "garbage collection", "tcp handshake",
+    "neural networks", "sql joins", "docker images", "rust ownership", "css grid",
+    "hash tables", "git rebase", "oauth tokens", "kubernetes pods", "linear regression",
+    "graph traversal", "memory leaks", "unit testing", "load balancing", "vector databases",
+]
+
+
+def fake_analysis(seed, chapters=6):
+    """
+    A plausible analysis answer (same shape as ANALYSIS_SCHEMA).
+    """
+    rng = random.Random(seed)
+    topics = rng.sample(TOPICS, 4)
+    return {
+        "transcript_summary": f"An overview of {', '.join(topics)}. " * 5,
+        "visual_summary": f"Slides and diagrams about {topics[0]} and {topics[1]}.",
+        "chapters": [
+            {
+                "timestamp": f"{i:02d}:00",
+                "label": f"{topics[i % len(topics)].title()} part {i + 1}",
+                "summary": f"Explains {topics[i % len(topics)]} with examples."
+            }
+            for i in range(chapters)
+        ],
+        "tags": topics
+    }
+
+
+# --- EMBEDDINGS ---
+
+_word_vectors = {}
+_word_lock = threading.Lock()
+
+
+def word_vector(word):
+    with _word_lock:
+        vector = _word_vectors.get(word)
+        if vector is None:
+            rng = random.Random(hashlib.md5(word.encode()).digest())
+            vector = [rng.uniform(-1, 1) for _ in range(DIMENSIONS)]
+            _word_vectors[word] = vector
+    return vector
+
+
+@lru_cache(maxsize=65536)
+def text_vector(text):
+    """
+    Deterministic bag-of-words embedding, L2-normalized.
+    Texts that share words get close vectors, so hybrid search behaves sensibly.
+    The returned list is shared (cached): do not modify it.
+    """
+    total = [0.0] * DIMENSIONS
+    for word in set(text.lower().split()[:64]):
+        vector = word_vector(word)
+        total = [a + b for a, b in zip(total, vector)]
+    norm = sum(x * x for x in total) ** 0.5 or 1.0
+    return [x / norm for x in total]
+
+
+class FakeEmbeddings:
+    """
+    Drop-in for GoogleGenerativeAIEmbeddings. Shares a FakeConfig with FakeGenai via configure_embeddings().
+    """
+    config = FakeConfig()
+    random = FakeRandom(FakeConfig.seed)
+
+    def __init__(self, model=None, **kwargs):
+        self.model = model
+
+    def _call(self, texts):
+        config = self.config
+        if self.random.chance(config.rate_limit_429):
+            raise ResourceExhausted()
+        if config.latency_scale > 0:
+            time.sleep((config.embed_base_sec + config.embed_sec_per_text * len(texts)) * config.latency_scale)
+        return [text_vector(t) for t in texts]
+
+    def embed_query(self, text):
+        return self._call([text])[0]
+
+    def embed_documents(self, texts):
+        return self._call(list(texts))
+
+    async def aembed_query(self, text):
+        return await asyncio.to_thread(self.embed_query, text)
+
+
+def configure_embeddings(config):
+    FakeEmbeddings.config = config
+    FakeEmbeddings.random = FakeRandom(config.seed + 1)
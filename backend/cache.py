@@ -0,0 +1,171 @@
+import os
+import json
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+
+# Optional shared backend (pip install redis). Without it every API replica keeps its own cache.
+try:
+    import redis
+except ImportError:
+    redis = None
+
+REDIS_URL = os.getenv("CACHE_REDIS_URL")
+
+
+class TTLCache:
+    """
+    In-process LRU cache with a per-entry time-to-live.
+    Thread-safe: sync FastAPI routes run on a threadpool.
+    """
+    def __init__(self, maxsize=1024, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict() # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key) # Mark as recently used
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (time.monotonic() + (ttl or self.ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False) # Drop least recently used
+                self.evictions += 1
+
+    # Async API (same as get/set: nothing here blocks)
+    async def aget(self, key):
+        return self.get(key)
+
+    async def aset(self, key, value, ttl=None):
+        self.set(key, value, ttl)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "backend": "memory",
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+
+class RedisCache:
+    """
+    Shared cache for several API replicas. A small in-process LRU sits in front of
+    Redis so hot keys do not even pay the Redis round-trip.
+    Values must be JSON-serializable. Redis handles TTL and eviction (maxmemory-policy).
+    """
+    def __init__(self, namespace, url, maxsize=1024, ttl=3600):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5)
+        self.local = TTLCache(maxsize=maxsize, ttl=min(ttl, 60))
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _key(self, key):
+        return f"codex:{self.namespace}:{key}"
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        try:
+            raw = self.client.get(self._key(key))
+        except Exception as e:
+            # A Redis outage must not break search, just make it slower
+            print(f"⚠️ Cache backend error: {e}")
+            self.errors += 1
+            raw = None
+        if raw is None:
+            self.misses += 1
+            return None
+        try:
+            value = json.loads(raw)
+        except ValueError as e:
+            # Corrupt or foreign value under our prefix: a miss, and gone for the next caller
+            print(f"⚠️ Dropping undecodable cache entry {self._key(key)}: {e}")
+            self.errors += 1
+            self.misses += 1
+            try:
+                self.client.delete(self._key(key))
+            except Exception:
+                pass
+            return None
+        self.local.set(key, value)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        self.local.set(key, value)
+        try:
+            self.client.set(self._key(key), json.dumps(value), ex=ttl or self.ttl)
+        except Exception as e:
+            print(f"⚠️ Cache backend error: {e}")
+            self.errors += 1
+
+    # Async API: the local LRU answers inline, Redis round-trips run in a thread
+    async def aget(self, key):
+        value = self.local.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key, value, ttl=None):
+        await asyncio.to_thread(self.set, key, value, ttl)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "backend": "redis",
+            "local": self.local.stats(),
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+
+def make_cache(namespace, maxsize=1024, ttl=3600):
+    """
+    Redis-backed if CACHE_REDIS_URL is set (and redis is installed), in-process otherwise.
+    """
+    if REDIS_URL and redis is not None:
+        return RedisCache(namespace, REDIS_URL, maxsize=maxsize, ttl=ttl)
+    if REDIS_URL:
+        print("⚠️ CACHE_REDIS_URL is set but 'redis' is not installed. Using in-process cache.")
+    return TTLCache(maxsize=maxsize, ttl=ttl)
+
+
+def normalize_query(query):
+    """
+    "  React   HOOKS " -> "react hooks". Queries that only differ in case/spacing share an entry.
+    """
+    return " ".join(query.lower().split())
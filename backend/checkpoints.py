@@ -0,0 +1,104 @@
+"""
+Per-stage checkpoints for process_video_task.
+
+After each expensive stage the worker records what it produced on the video
+row (videos.ingest_stage / videos.ingest_state). A retried job resumes from
+the last completed stage instead of starting over:
+
+    new         -> download + transcode
+    transcoded  -> probe, frame times and the S3 keys of the transcoded files are known:
+                   fetch those small files, skip the source download and FFmpeg
+    analyzed    -> the analysis JSON is known: skip Gemini entirely, only embed + save
+    done        -> processed
+
+Within the analysis, uploaded Gemini file names and finished chunk results
+(long videos) are checkpointed too, so a retry neither re-uploads nor
+re-analyzes the parts that already succeeded.
+
+With a job lease (see job_queue.Lease), every write first locks the job row:
+a worker that lost the job to another one gets LeaseLostError instead of
+overwriting the new owner's checkpoint.
+"""
+import copy
+import threading
+import models
+from database import SessionLocal
+
+STAGES = ["new", "transcoded", "analyzed", "done"]
+
+
+class IngestCheckpoint:
+    def __init__(self, video_db_id, stage=None, state=None, lease=None):
+        self.video_db_id = video_db_id
+        self.stage = stage if stage in STAGES else "new"
+        self.state = copy.deepcopy(state or {})
+        self.lease = lease
+        self._lock = threading.Lock() # Chunks are analyzed (and checkpointed) in parallel
+
+    @classmethod
+    def load(cls, db, video_db_id, lease=None):
+        video = db.query(models.Video).filter(models.Video.id == video_db_id).first()
+        if not video:
+            return cls(video_db_id, lease=lease)
+        return cls(video_db_id, video.ingest_stage, video.ingest_state, lease)
+
+    def check_lease(self, db=None):
+        """
+        Raises LeaseLostError if the job went to another worker. With 'db', also
+        holds the job row until that session commits.
+        """
+        if not self.lease:
+            return
+        if db is None:
+            self.lease.check()
+        else:
+            self.lease.lock(db)
+
+    def reached(self, stage):
+        return STAGES.index(self.stage) >= STAGES.index(stage)
+
+    def get(self, key, default=None):
+        with self._lock:
+            return copy.deepcopy(self.state.get(key, default))
+
+    def get_item(self, group, key):
+        with self._lock:
+            return copy.deepcopy(self.state.get(group, {}).get(key))
+
+    def save(self, stage=None, **artifacts):
+        with self._lock:
+            self.state.update(artifacts)
+            if stage:
+                self.stage = stage
+            self._write()
+        if stage:
+            print(f"📌 Checkpoint: video {self.video_db_id} reached '{stage}'.")
+
+    def save_item(self, group, key, value):
+        with self._lock:
+            self.state.setdefault(group, {})[key] = value
+            self._write()
+
+    def drop_item(self, group, key):
+        with self._lock:
+            if self.state.get(group, {}).pop(key, None) is not None:
+                self._write()
+
+    def drop(self, *keys):
+        with self._lock:
+            for key in keys:
+                self.state.pop(key, None)
+            self._write()
+
+    def _write(self):
+        # Own short-lived session: called from the chunk threads too
+        db = SessionLocal()
+        try:
+            self.check_lease(db)
+            db.query(models.Video).filter(models.Video.id == self.video_db_id).update(
+                {"ingest_stage": self.stage, "ingest_state": copy.deepcopy(self.state)},
+                synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
@@ -1,6 +1,8 @@
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.engine import make_url
 import os
 from dotenv import load_dotenv
 
@@ -31,4 +33,40 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+# --- ASYNC ENGINE (asyncpg) ---
+# Used by the read-heavy API routes (/search, /videos/, /videos/urls) so a request
+# waiting on Postgres does not hold a threadpool slot. The sync engine above
+# stays for writes and for the worker.
+
+def to_async_url(url):
+    """
+    postgresql://...?sslmode=require -> postgresql+asyncpg://...?ssl=require
+    (asyncpg does not understand libpq-only parameters like sslmode/channel_binding)
+    """
+    parsed = make_url(url).set(drivername="postgresql+asyncpg")
+    query = dict(parsed.query)
+    if "sslmode" in query:
+        query["ssl"] = query.pop("sslmode")
+    query.pop("channel_binding", None)
+    return parsed.set(query=query)
+
+async_engine = create_async_engine(
+    to_async_url(SQLALCHEMY_DATABASE_URL),
+    pool_pre_ping=True,
+    pool_recycle=1800,
+    pool_size=10,
+    max_overflow=20
+)
+
+# No pgvector codec on purpose: pgvector.sqlalchemy's Vector binds and reads the
+# text form ('[1,2,3]'), which asyncpg passes through as-is.
+
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+
+# Dependency
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -1,120 +1,478 @@
-def get_video_duration(ffmpeg_exe, video_path):
+import os
+import re
+import time
+import asyncio
+import json
+import shutil
+import tempfile
+import subprocess
+import boto3
+from botocore.config import Config
+import google.generativeai as genai
+import imageio_ffmpeg
+from concurrent.futures import ThreadPoolExecutor
+import models
+from database import SessionLocal
+from timecodes import parse_timestamp, format_timestamp
+from rate_limiter import QuotaExceededError, acquire_model, get_quota
+from s3_stream import TransferStats, ContentHasher, iter_object_chunks, download_to_file, pipe_to_processes, quick_fingerprint, file_fingerprint
+import metrics
+from metrics import stage
+from json_repair import load_json
+from checkpoints import IngestCheckpoint
+import scratch
+import renditions
+from embedding_service import get_embedding_service
+from search_cache import bump_library_version
+
+# --- 1. CONFIGURATION ---
+# The worker runs in its own process (see worker.py), so it builds its own clients.
+
+# AWS S3
+region = os.getenv("AWS_REGION")
+s3_config = Config(region_name=region, signature_version='s3v4')
+s3_client = boto3.client(
+    's3',
+    endpoint_url=f"https://s3.{region}.amazonaws.com",
+    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+    config=s3_config
+)
+
+# Google AI
+genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+
+# Ingestion
+# "download": parallel ranged GETs to a temp file, then FFmpeg.
+# "stream": pipe the ranged GETs straight into FFmpeg (transcode overlaps download, no source on disk).
+INGEST_MODE = os.getenv("INGEST_MODE", "download")
+# Transcoded files are kept here until the video is processed, so a retry can skip download + FFmpeg
+ARTIFACT_PREFIX = os.getenv("INGEST_ARTIFACT_PREFIX", "ingest-artifacts/")
+# Scratch disk reserved per job on top of the source (audio + hyper-lapse + chunk cuts), as a share of its size
+SCRATCH_OUTPUT_RATIO = float(os.getenv("SCRATCH_OUTPUT_RATIO", "0.3"))
+
+# Gemini file uploads (see upload_files_to_gemini)
+UPLOAD_POLL_INITIAL = 1.0 # Seconds, doubles on every poll
+UPLOAD_POLL_MAX = 15.0
+UPLOAD_DEADLINE = float(os.getenv("GEMINI_UPLOAD_DEADLINE", "900")) # Upload + processing, all files
+
+# JSON answers (see analyze_with_retries)
+JSON_FOLLOWUPS = int(os.getenv("AI_JSON_FOLLOWUPS", "2")) # Text-only "fix your JSON" requests
+
+# Token estimate when count_tokens fails (keeps the rate limiter conservative)
+UNCOUNTED_REQUEST_TOKENS = 200000
+
+# Chunked (map-reduce) analysis for long videos (see analyze_in_chunks)
+CHUNKED_ANALYSIS_MIN_SECONDS = float(os.getenv("CHUNKED_ANALYSIS_MIN_SECONDS", "5400"))
+CHUNK_SECONDS = float(os.getenv("CHUNK_SECONDS", "1800"))
+CHUNK_OVERLAP = float(os.getenv("CHUNK_OVERLAP", "60"))
+CHUNK_CONCURRENCY = int(os.getenv("CHUNK_CONCURRENCY", "3"))
+
+# Adaptive hyper-lapse (see sample_keyframes_filter)
+VISUAL_FRAME_BUDGET = int(os.getenv("VISUAL_FRAME_BUDGET", "720")) # Max frames sent to Gemini
+SCENE_THRESHOLD = float(os.getenv("SCENE_THRESHOLD", "0.3")) # 0..1, FFmpeg scene change score
+KEYFRAME_MIN_GAP = float(os.getenv("KEYFRAME_MIN_GAP", "2")) # Seconds
+KEYFRAME_MAX_GAP = float(os.getenv("KEYFRAME_MAX_GAP", "60")) # Seconds
+
+# FFmpeg
+# imageio_ffmpeg bundles ffmpeg but not ffprobe; use a system ffprobe when there is one.
+FFPROBE_EXE = os.getenv("FFPROBE_PATH") or shutil.which("ffprobe")
+
+def ffmpeg_threads():
     """
-    Get video duration in seconds using raw FFmpeg.
+    FFMPEG_THREADS if set, otherwise split the cores between the jobs
+    running on this node (worker.py exports WORKER_CONCURRENCY), whatever the machine size.
     """
+    if os.getenv("FFMPEG_THREADS"):
+        return int(os.getenv("FFMPEG_THREADS"))
+    return max(1, (os.cpu_count() or 1) // int(os.getenv("WORKER_CONCURRENCY", "1")))
+
+# --- 2. HELPER FUNCTIONS ---
+
+def normalize_visual_summary(visual_data):
+    if isinstance(visual_data, str): return visual_data
+    if isinstance(visual_data, list):
+        return "\n".join([f"[{item.get('time', '')}] {item.get('content', '')}" for item in visual_data])
+    return ""
+
+def probe_video(video_path):
+    """
+    Structured probe: ffprobe's JSON instead of regexing FFmpeg's stderr.
+    Returns {"duration", "has_audio", "has_video", "width", "height"}.
+    imageio_ffmpeg only ships ffmpeg, so without ffprobe we fall back to
+    reading 'ffmpeg -i' output (which needs no decode either).
+    """
+    probe = {"duration": None, "has_audio": False, "has_video": False, "width": None, "height": None}
     try:
+        if FFPROBE_EXE:
+            result = subprocess.run(
+                [FFPROBE_EXE, '-v', 'error', '-print_format', 'json', '-show_format', '-show_streams', video_path],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True
+            )
+            info = json.loads(result.stdout)
+            duration = info.get("format", {}).get("duration")
+            probe["duration"] = float(duration) if duration else None
+            for stream in info.get("streams", []):
+                if stream.get("codec_type") == "audio":
+                    probe["has_audio"] = True
+                elif stream.get("codec_type") == "video" and not probe["has_video"]:
+                    probe["has_video"] = True
+                    probe["width"] = stream.get("width")
+                    probe["height"] = stream.get("height")
+            return probe
+
         # FFmpeg writes file info to stderr, not stdout
         result = subprocess.run(
-            [ffmpeg_exe, '-i', video_path], 
-            stderr=subprocess.PIPE, 
-            stdout=subprocess.PIPE, 
-            text=True
+            [imageio_ffmpeg.get_ffmpeg_exe(), '-hide_banner', '-i', video_path],
+            stderr=subprocess.PIPE, stdout=subprocess.PIPE, text=True
         )
-        # Regex to find "Duration: 00:00:00.00"
         match = re.search(r"Duration: (\d{2}):(\d{2}):(\d{2}\.\d{2})", result.stderr)
         if match:
             hours, mins, secs = map(float, match.groups())
-            return hours * 3600 + mins * 60 + secs
+            probe["duration"] = hours * 3600 + mins * 60 + secs
+        probe["has_audio"] = re.search(r"Stream #.*: Audio:", result.stderr) is not None
+        video_match = re.search(r"Stream #.*: Video:.*?(\d{2,5})x(\d{2,5})", result.stderr)
+        if video_match:
+            probe["has_video"] = True
+            probe["width"], probe["height"] = map(int, video_match.groups())
     except Exception as e:
-        print(f"⚠️ Could not read duration: {e}")
-        return None
-    return None
+        print(f"⚠️ Could not probe video: {e}")
+    return probe
 
-def scale_timestamps(chapters_data, ratio):
+def scale_timestamps(chapters_data, ratio=None, frame_times=None, offset=0):
     """
-    Multiplies Gemini's compressed timestamps by the speedup ratio 
-    to get real-world time.
+    Maps Gemini's timestamps back to real-world time.
+    With 'frame_times' (the source time of every hyper-lapse frame, see
+    sample_keyframes_filter) second N of the hyper-lapse IS frame N, so the
+    mapping is exact. Otherwise multiply by 'ratio' (1.0 for the audio
+    timeline) and add 'offset' (start of the analyzed chunk).
     Example: "01:00" (Slideshow) * 20 -> "20:00" (Real Life)
+    An empty 'frame_times' is an error, never a guess.
     """
+    if frame_times is not None and not frame_times:
+        raise ValueError("No keyframe times: hyper-lapse timestamps cannot be mapped to real time.")
+    if frame_times is None and ratio is None:
+        raise ValueError("scale_timestamps needs 'frame_times' or a 'ratio'.")
     new_chapters = []
     for chapter in chapters_data:
         time_str = chapter.get("timestamp", "00:00")
-        try:
-            # Convert "MM:SS" to seconds
-            parts = list(map(int, time_str.split(":")))
-            if len(parts) == 2:
-                seconds = parts[0] * 60 + parts[1]
-            elif len(parts) == 3:
-                seconds = parts[0] * 3600 + parts[1] * 60 + parts[2]
-            else:
-                seconds = 0
-            
-            # MULTIPLY BY RATIO (The Fix)
-            real_seconds = seconds * ratio
-            
-            # Convert back to "HH:MM:SS" or "MM:SS"
-            m, s = divmod(real_seconds, 60)
-            h, m = divmod(m, 60)
-            
-            if h > 0:
-                new_time = f"{int(h):02d}:{int(m):02d}:{int(s):02d}"
-            else:
-                new_time = f"{int(m):02d}:{int(s):02d}"
-                
-            new_chapters.append({
-                "timestamp": new_time,
-                "label": chapter.get("label", "")
-            })
-        except:
+        seconds = parse_timestamp(time_str)
+        if seconds is None:
             new_chapters.append(chapter) # Keep original on error
+            continue
+
+        if frame_times:
+            # Frame N is shown during second N (1 FPS playback)
+            real_seconds = frame_times[min(seconds, len(frame_times) - 1)]
+        else:
+            real_seconds = seconds * ratio + offset
+
+        new_chapters.append({
+            "timestamp": format_timestamp(real_seconds),
+            "start_sec": int(real_seconds), # Numeric twin of 'timestamp': nothing downstream re-parses it
+            "label": chapter.get("label", ""),
+            "summary": chapter.get("summary", "")
+        })
             
     return new_chapters
 
-def optimize_video_for_ai(video_path):
+def chapter_start(chapter):
     """
-    STRATEGY: TIME DECOUPLING
-    1. Extract Audio (Full Duration).
-    2. Extract Visuals -> Compress 2 hours into ~6 minutes (Silent Hyper-Lapse).
-    Returns: (audio_path, video_path, 'decoupled')
+    Start second of a chapter: precomputed by scale_timestamps, parsed for older rows.
     """
-    try:
-        ffmpeg_exe = imageio_ffmpeg.get_ffmpeg_exe()
-        duration_sec = get_video_duration(ffmpeg_exe, video_path) or 7200
-        
-        # Output paths
-        audio_path = video_path.replace(".mp4", "_audio.mp3")
-        visual_path = video_path.replace(".mp4", "_visuals.mp4")
+    if chapter.get("start_sec") is not None:
+        return chapter["start_sec"]
+    return parse_timestamp(chapter.get("timestamp", "00:00"))
 
-        print(f"📉 Generating Decoupled Assets for {duration_sec}s video...")
+def build_segments(chapters_data, transcript_sum, duration_sec=None):
+    """
+    Turns (already scaled) chapters into searchable segments.
+    Each chapter runs until the next one starts; the last one until the end.
+    Chapters starting on the same second become one segment (no zero-length rows).
+    Returns a list of dicts: start_sec, end_sec, label, content.
+    """
+    starts = []
+    for chapter in chapters_data or []:
+        start = chapter_start(chapter)
+        if start is not None:
+            starts.append((int(start), chapter))
+    starts.sort(key=lambda x: x[0])
 
-        # 1. Extract Audio (Fast)
-        subprocess.run([
-            ffmpeg_exe, '-y', '-i', video_path, 
-            '-vn', '-acodec', 'libmp3lame', '-q:a', '4', 
-            audio_path
-        ], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # No usable chapters: the whole video is one segment
+    if not starts:
+        return [{
+            "start_sec": 0,
+            "end_sec": int(duration_sec) if duration_sec else None,
+            "label": None,
+            "content": transcript_sum or ""
+        }]
+
+    segments = []
+    for start, chapter in starts:
+        label = chapter.get("label", "")
+        content = f"{label}\n{chapter.get('summary', '')}".strip()
+        if segments and segments[-1]["start_sec"] == start:
+            # Same second (hyper-lapse frames mapping to one source time): keep the first label
+            segments[-1]["content"] = f"{segments[-1]['content']}\n{content}".strip()
+            continue
+        if segments:
+            segments[-1]["end_sec"] = start
+        segments.append({"start_sec": start, "end_sec": None, "label": label, "content": content})
+    segments[-1]["end_sec"] = int(duration_sec) if duration_sec else None
+    return segments
+
+def sample_keyframes_filter(duration_sec):
+    """
+    ADAPTIVE HYPER-LAPSE: keep a frame only when the picture changed
+    (FFmpeg scene score), instead of blindly 1 frame every 10 seconds.
+    - Static slide decks collapse to a few frames.
+    - Fast code demos keep more detail.
+    - Never 2 frames closer than duration/budget -> at most ~VISUAL_FRAME_BUDGET frames.
+    - Always 1 frame per KEYFRAME_MAX_GAP seconds, so nothing goes unseen.
+    'showinfo' logs the source time of every kept frame (parsed by parse_frame_times).
+    """
+    min_gap = max(KEYFRAME_MIN_GAP, (duration_sec or 7200) / VISUAL_FRAME_BUDGET)
+    max_gap = max(KEYFRAME_MAX_GAP, min_gap)
+    select = (
+        f"select='isnan(prev_selected_t)"
+        f"+gte(t-prev_selected_t,{max_gap:.3f})"
+        f"+gt(scene,{SCENE_THRESHOLD})*gte(t-prev_selected_t,{min_gap:.3f})'"
+    )
+    return f"{select},showinfo"
+
+def parse_frame_times(ffmpeg_log):
+    """
+    Source timestamp (seconds) of each hyper-lapse frame, in output order.
+    Reads the 'pts_time:' field of FFmpeg's showinfo lines.
+    """
+    return [
+        float(match.group(1))
+        for line in ffmpeg_log.splitlines() if "Parsed_showinfo" in line
+        for match in [re.search(r"pts_time:\s*([\d.]+)", line)] if match
+    ]
 
-        # 2. Create Hyper-Lapse Video
-        # Logic: Take 1 frame every 10 seconds. Play back at 1 FPS.
-        # A 2-hour video (7200s) becomes 720 frames = 12 minutes long.
+def transcode_cmd(ffmpeg_exe, input_path, audio_path, visual_path, probe, proxy_path=None, sprite_path=None):
+    """
+    ONE FFmpeg process, ONE decode of the source, up to four outputs:
+    1. Audio (Full Duration) -> MP3.
+    2. Silent Hyper-Lapse -> MP4.
+    3. Playback proxy -> faststart MP4 (see renditions.py), when 'proxy_path' is given.
+    4. Thumbnail sprite sheet -> JPEG (see renditions.py), when 'sprite_path' is given.
+    Outputs for streams the probe did not find are left out.
+    """
+    threads = str(ffmpeg_threads())
+    cmd = [
+        ffmpeg_exe, '-y',
+        '-threads', threads, # Decoder threads
+        '-filter_threads', threads,
+        '-filter_complex_threads', threads,
+        '-i', input_path
+    ]
+
+    if probe["has_video"]:
+        # Hyper-Lapse logic: Keep only the frames where something changed. Play back at 1 FPS.
+        # A 2-hour video becomes at most VISUAL_FRAME_BUDGET frames (12 minutes by default).
         # Gemini sees this as a 12-minute video (Cheap!)
-        select_filter = "fps=1/10,scale=-2:360,setpts=N/((1)*TB)"
-        
-        cmd = [
-            ffmpeg_exe, '-y', '-i', video_path,
-            '-vf', select_filter, 
-            '-an', 
-            '-c:v', 'libx264', 
+        sampler = sample_keyframes_filter(probe["duration"])
+        # The decoded frames feed every branch: the hyper-lapse and the playback renditions
+        branches = {"ai": f"[ai]{sampler},scale=-2:360,setpts=N/((1)*TB)[vis]"}
+        if proxy_path:
+            branches["pv"] = renditions.proxy_filter('pv', 'proxy')
+        if sprite_path:
+            branches["sp"] = renditions.sprite_filter('sp', 'sprite', renditions.sprite_layout(probe["duration"]))
+        split = f"[0:v:0]split={len(branches)}" + "".join(f"[{label}]" for label in branches)
+        graph = ";".join([split, *branches.values()])
+        cmd += ['-filter_complex', graph]
+
+    if probe["has_audio"]:
+        cmd += [
+            '-map', '0:a:0', '-vn',
+            '-acodec', 'libmp3lame', '-q:a', '4',
+            '-threads', threads,
+            audio_path
+        ]
+
+    if probe["has_video"]:
+        cmd += [
+            '-map', '[vis]', '-an',
+            '-c:v', 'libx264',
             '-preset', 'ultrafast',
             '-r', '1', # Force output metadata to 1 FPS
+            '-threads', threads,
             visual_path
         ]
-        
-        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        
-        return (audio_path, visual_path), 'decoupled'
+        if proxy_path:
+            cmd += renditions.proxy_output_args('proxy', probe["has_audio"], threads, proxy_path)
+        if sprite_path:
+            cmd += renditions.sprite_output_args('sprite', sprite_path)
+    return cmd
+
+def derived_paths(work_path):
+    """
+    (audio_path, visual_path) next to 'work_path', whatever its extension (.mp4, .mov, .mkv...).
+    """
+    base = os.path.splitext(work_path)[0]
+    return f"{base}_audio.mp3", f"{base}_visuals.mp4"
+
+def transcode_result(audio_path, visual_path, probe, ffmpeg_log):
+    if probe["has_audio"] and probe["has_video"]:
+        frame_times = parse_frame_times(ffmpeg_log)
+        print(f"🎞️ Kept {len(frame_times)} keyframes for the hyper-lapse.")
+        return (audio_path, visual_path), 'decoupled', probe, frame_times
+    if probe["has_audio"]:
+        return (audio_path, None), 'audio', probe, []
+    raise RuntimeError("Source has no audio track")
+
+def optimize_video_for_ai(video_path):
+    """
+    STRATEGY: TIME DECOUPLING
+    1. Extract Audio (Full Duration).
+    2. Extract Visuals -> Compress 2 hours into ~6 minutes (Silent Hyper-Lapse).
+    Both come out of a single FFmpeg pass (see transcode_cmd), together with the
+    playback proxy and the thumbnail sprite sheet (see renditions.py).
+    Returns: ((audio_path, video_path), 'decoupled' | 'audio', probe, frame_times)
+    """
+    ffmpeg_exe = imageio_ffmpeg.get_ffmpeg_exe()
+    with stage("probe"):
+        probe = probe_video(video_path)
+    if probe["duration"] is None:
+        # Unknown container: assume both streams and let FFmpeg decide
+        probe.update(has_audio=True, has_video=True)
+
+    # Output paths
+    audio_path, visual_path = derived_paths(video_path)
+    proxy_path = renditions.proxy_path(video_path)
+    sprite_path = renditions.sprite_path(video_path)
+
+    try:
+        print(f"📉 Generating Decoupled Assets for {probe['duration']}s video ({ffmpeg_threads()} threads)...")
+        cmd = transcode_cmd(ffmpeg_exe, video_path, audio_path, visual_path, probe, proxy_path, sprite_path)
+        # FFmpeg's log goes to a file: it holds the showinfo timestamps and can outgrow a pipe buffer
+        with tempfile.TemporaryFile(mode="w+") as log, stage("transcode"):
+            subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=log)
+            log.seek(0)
+            return transcode_result(audio_path, visual_path, probe, log.read())
 
     except Exception as e:
         print(f"❌ Optimization failed: {e}. Fallback to Audio.")
+        remove_local_files(proxy_path, sprite_path) # Possibly half-written
         # Fallback to just audio if video processing crashes
-        audio_path = video_path.replace(".mp4", "_audio.mp3")
-        subprocess.run([ffmpeg_exe, '-y', '-i', video_path, '-vn', audio_path], check=True)
-        return (audio_path, None), 'audio'
+        with stage("transcode", fallback="audio"):
+            subprocess.run([ffmpeg_exe, '-y', '-i', video_path, '-vn', audio_path], check=True)
+        return (audio_path, None), 'audio', probe, []
+
+def optimize_video_from_stream(chunks, probe_url, work_path):
+    """
+    STREAMING MODE: same outputs as optimize_video_for_ai, but FFmpeg reads the
+    S3 bytes from stdin while they download, and the source never touches the disk.
+    'probe_url' (a presigned GET) is only used by the probe.
+    Raises on failure: the caller falls back to download mode.
+    NOTE: MP4s whose moov atom is at the END cannot be demuxed from a pipe.
+    """
+    ffmpeg_exe = imageio_ffmpeg.get_ffmpeg_exe()
+    with stage("probe", mode="stream"):
+        probe = probe_video(probe_url)
+    if probe["duration"] is None:
+        raise RuntimeError("Could not probe the source over HTTP")
+
+    audio_path, visual_path = derived_paths(work_path)
+    proxy_path = renditions.proxy_path(work_path)
+    sprite_path = renditions.sprite_path(work_path)
+
+    print(f"📉 Streaming Decoupled Assets for {probe['duration']}s video ({ffmpeg_threads()} threads)...")
+
+    cmd = transcode_cmd(ffmpeg_exe, 'pipe:0', audio_path, visual_path, probe, proxy_path, sprite_path)
+    with tempfile.TemporaryFile(mode="w+") as log:
+        # Download and transcode overlap here: one span for both
+        with stage("download_transcode", mode="stream"):
+            proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=log)
+            try:
+                pipe_to_processes(chunks, [proc])
+            finally:
+                proc.wait()
+
+        if proc.returncode != 0:
+            for path in (audio_path, visual_path, proxy_path, sprite_path):
+                if os.path.exists(path): os.remove(path)
+            raise RuntimeError("FFmpeg could not transcode from the stream")
+
+        log.seek(0)
+        return transcode_result(audio_path, visual_path, probe, log.read())
     
 
+# --- 3. GEMINI FILES ---
+
+def delete_gemini_file(name):
+    try:
+        genai.delete_file(name)
+    except: pass
+
+async def upload_and_wait(path, deadline):
+    """
+    Uploads one file and waits until Gemini has finished PROCESSING it.
+    Polls with exponential backoff; the blocking SDK calls run in threads.
+    If it never becomes usable (deadline, FAILED, polling error) the file is
+    deleted here: the caller only gets the exception, not the handle.
+    """
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    gemini_file = await asyncio.to_thread(genai.upload_file, path=path)
+    uploaded = loop.time()
+    metrics.observe_stage("upload", uploaded - started, file=os.path.basename(path))
+    try:
+        delay = UPLOAD_POLL_INITIAL
+        while gemini_file.state.name == "PROCESSING":
+            if loop.time() + delay > deadline:
+                raise TimeoutError(f"Gemini is still processing {gemini_file.name} after {UPLOAD_DEADLINE}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, UPLOAD_POLL_MAX)
+            gemini_file = await asyncio.to_thread(genai.get_file, gemini_file.name)
+        metrics.observe_stage("poll_wait", loop.time() - uploaded, file=os.path.basename(path))
+        if gemini_file.state.name == "FAILED":
+            raise RuntimeError(f"Gemini failed to process {gemini_file.name}")
+    except BaseException:
+        await asyncio.to_thread(delete_gemini_file, gemini_file.name)
+        raise
+    return gemini_file
+
+def upload_files_to_gemini(paths):
+    """
+    Uploads all files concurrently and waits for all of them (one shared deadline).
+    Wall time = the slowest file, not the sum. Returns the files in the same order.
+    On failure, every uploaded file is deleted before re-raising (the failed
+    ones by upload_and_wait, the others here).
+    """
+    async def run():
+        deadline = asyncio.get_running_loop().time() + UPLOAD_DEADLINE
+        return await asyncio.gather(*(upload_and_wait(p, deadline) for p in paths), return_exceptions=True)
+
+    results = asyncio.run(run())
+    errors = [r for r in results if isinstance(r, BaseException)]
+    if errors:
+        for r in results:
+            if not isinstance(r, BaseException):
+                delete_gemini_file(r.name)
+        raise errors[0]
+    return list(results)
+
+
 # Update signature to accept a LIST of contents
 # --- REPLACEMENT FUNCTION ---
-def generate_with_fallback(contents, prompt_text=""):
+def count_request_tokens(model_names, request_content):
+    """
+    Counts the request once (all our models share a tokenizer).
+    If counting fails, assume a large request so the limiter stays conservative.
+    """
+    try:
+        count_info = genai.GenerativeModel(model_name=model_names[0]).count_tokens(request_content)
+        print(f"🔢 TOKEN DEBUG: Used {count_info.total_tokens} / 1,000,000 limit")
+        metrics.record_counted_tokens(model_names[0], count_info.total_tokens)
+        return count_info.total_tokens
+    except Exception as e:
+        print(f"⚠️ Could not count tokens: {e}")
+        return UNCOUNTED_REQUEST_TOKENS
+
+def generate_with_fallback(contents, prompt_text="", generation_config=None):
     # If contents is just a list of files, add the prompt to it
     if isinstance(contents, list) and isinstance(prompt_text, str):
         request_content = contents + [prompt_text]
@@ -124,95 +482,47 @@ def generate_with_fallback(contents, prompt_text=""):
     # FIX 1: ONLY use the high-capacity model. Removed the weak 2.5/Robotics models.
     models_to_try = ["gemini-flash-latest", "gemini-robotics-er-1.5-preview"] 
     
-    for model_name in models_to_try:
-        # We will try the SAME model up to 3 times if it's just a rate limit issue
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                print(f"🤖 Attempting analysis with {model_name} (Attempt {attempt + 1}/{max_retries})...")
-                model = genai.GenerativeModel(model_name=model_name)
-                
-                # --- DEBUG: PRINT TOKEN COUNT ---
-                try:
-                    count_info = model.count_tokens(request_content)
-                    print(f"🔢 TOKEN DEBUG: Used {count_info.total_tokens} / 1,000,000 limit")
-                except Exception as e:
-                    print(f"⚠️ Could not count tokens: {e}")
-                # --------------------------------
+    # Admission: reserve requests/min + tokens/min BEFORE calling, on whichever
+    # model has room (see rate_limiter.py). No more blind 60s sleeps.
+    token_count = count_request_tokens(models_to_try, request_content)
+    candidates = list(models_to_try)
 
-                return model.generate_content(request_content)
-            
-            except Exception as e:
-                error_str = str(e)
-                # FIX 2: Check specifically for Rate Limit (429) errors
-                if "429" in error_str or "ResourceExhausted" in error_str:
-                    print(f"🛑 Rate Limit Hit on {model_name}. Sleeping for 60 seconds to reset quota...")
-                    time.sleep(60) # WAIT for the bucket to drain
-                    continue # Retry the loop
-                else:
-                    # If it's a real error (like invalid API key), fail immediately
-                    print(f"❌ Non-retriable error with {model_name}: {error_str}")
-                    break 
+    # A 429 can still happen (other apps on the same key); each one drains that
+    # model's bucket and we go back to the scheduler, at most 'max_retries' times.
+    max_retries = 3
+    rate_limit_hits = 0
+    while candidates:
+        model_name = acquire_model(candidates, token_count)
+        if model_name is None:
+            break
+        try:
+            print(f"🤖 Attempting analysis with {model_name} ({token_count} tokens)...")
+            model = genai.GenerativeModel(model_name=model_name)
+            with stage("generate", model=model_name):
+                response = model.generate_content(request_content, generation_config=generation_config)
+            metrics.record_usage(model_name, response)
+            return response
+        
+        except Exception as e:
+            error_str = str(e)
+            # FIX 2: Check specifically for Rate Limit (429) errors
+            if "429" in error_str or "ResourceExhausted" in error_str:
+                rate_limit_hits += 1
+                print(f"🛑 Rate Limit Hit on {model_name}. Draining its bucket ({rate_limit_hits}/{max_retries})...")
+                get_quota(model_name).drain()
+                if rate_limit_hits >= max_retries:
+                    break
+            else:
+                # If it's a real error (like invalid API key), drop this model
+                print(f"❌ Non-retriable error with {model_name}: {error_str}")
+                candidates.remove(model_name)
                     
     raise RuntimeError("All AI models failed or rate limits persisted.")
 
 
-# --- 4. BACKGROUND TASK (The Worker) ---
-
-# Note: We do NOT pass 'db' here. We create it inside.
-def process_video_task(video_db_id: int, file_key: str):
-    # OPEN FRESH DB CONNECTION
-    db = SessionLocal() 
-    
-    try:
-        print(f"🎬 Processing Video {video_db_id}...")
-        
-        # Download
-        bucket_name = os.getenv("AWS_BUCKET_NAME")
-
-        # 1. Get original name
-        original_name = file_key.split("/")[-1]
-        
-        # 2. Sanitize: Replace spaces with underscores
-        clean_name = original_name.replace(" ", "_")
-        
-        temp_dir = tempfile.gettempdir() 
-        temp_path = os.path.join(temp_dir, clean_name)
-        
-        print(f"⬇️ Downloading to {temp_path} (Sanitized)...")
-        s3_client.download_file(bucket_name, file_key, temp_path)
-        
-        # 1. OPTIMIZE
-        # Returns a tuple of paths now!
-        (path_a, path_b), opt_type = optimize_video_for_ai(temp_path)
-        
-        files_to_upload = []
-        
-        # 2. UPLOAD
-        if opt_type == 'decoupled':
-            print("📤 Uploading Audio Track...")
-            audio_file = genai.upload_file(path=path_a)
-            print("📤 Uploading Visual Hyper-Lapse...")
-            visual_file = genai.upload_file(path=path_b)
-            
-            # Wait for both
-            while audio_file.state.name == "PROCESSING":
-                time.sleep(1)
-                audio_file = genai.get_file(audio_file.name)
-            while visual_file.state.name == "PROCESSING":
-                time.sleep(1)
-                visual_file = genai.get_file(visual_file.name)
-                
-            files_to_upload = [audio_file, visual_file]
-            
-        elif opt_type == 'audio':
-            print("📤 Uploading Audio...")
-            audio_file = genai.upload_file(path=path_a)
-            files_to_upload = [audio_file]
+# --- AI ANALYSIS ---
 
-        # Analyze
-        print(f"🧠 Analyzing ({opt_type})...")
-        base_reqs = """
+BASE_REQS = """
         I need a structured JSON output.
         RULES:
         1. Output ONLY valid JSON.
@@ -220,71 +530,642 @@ def process_video_task(video_db_id: int, file_key: str):
         3. Escape any quotes inside strings.
         4. "transcript_summary": Comprehensive detailed notes of the lecture concepts of what was SPOKEN.
         5. "visual_summary": Detailed description of slides/diagrams that was SHOWN (slides, diagrams, code blocks, physical objects). Be specific (e.g., "A diagram showing the Event Loop").
-        6. "chapters": List of objects with "timestamp" (MM:SS) and "label".
+        6. "chapters": List of objects with "timestamp" (MM:SS), "label" and "summary" (2-3 sentences on what is said and shown in that chapter).
         7. "tags": List of 5-10 technical keywords.
         """
 
-        if opt_type == 'decoupled':
-            # THE MAGIC PROMPT
-            prompt = f"""
+# Structured output: Gemini decodes against this schema, so the answer is JSON by construction
+ANALYSIS_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "transcript_summary": {"type": "STRING"},
+        "visual_summary": {"type": "STRING"},
+        "chapters": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "timestamp": {"type": "STRING"},
+                    "label": {"type": "STRING"},
+                    "summary": {"type": "STRING"}
+                },
+                "required": ["timestamp", "label", "summary"]
+            }
+        },
+        "tags": {"type": "ARRAY", "items": {"type": "STRING"}}
+    },
+    "required": ["transcript_summary", "visual_summary", "chapters", "tags"]
+}
+JSON_CONFIG = {"response_mime_type": "application/json", "response_schema": ANALYSIS_SCHEMA}
+
+def build_prompt(opt_type, part=None, video_timeline=True):
+    """
+    part = (index, total, start_sec, end_sec) when analyzing one window of a long video.
+    video_timeline=False: chapters on the audio's (real) timeline, for a hyper-lapse
+    whose keyframe times are unknown.
+    """
+    context = ""
+    if part:
+        index, total, start_sec, end_sec = part
+        context = (
+            f"This is PART {index + 1} of {total} of a longer lecture "
+            f"({format_timestamp(start_sec)} - {format_timestamp(end_sec)} of the original). "
+            "Describe only this part. Timestamps start at 00:00 for this part."
+        )
+
+    if opt_type == 'decoupled':
+        timeline = (
+            "Give chapter timestamps on the SILENT VIDEO's timeline (we map them back to real time)."
+            if video_timeline else
+            "Give chapter timestamps on the AUDIO's timeline (it runs in real time)."
+        )
+        # THE MAGIC PROMPT
+        return f"""
             I have provided two files:
             1. The FULL AUDIO of a lecture.
             2. A SILENT VIDEO of the slides, accelerated (Hyper-Lapse). 
-               - In the video, 1 second of playback equals 10 seconds of real time.
+               - Each second of playback is ONE keyframe, kept only when the screen changed.
+            {context}
             
             Please correlate the Audio transcript with the Visual slides. 
-            Use the Audio for the timestamps and summary. 
+            Use the Audio for the summary. 
             Use the Video to describe the visual context (slides/diagrams).
-            {base_reqs}
+            {timeline}
+            {BASE_REQS}
             """
+    return f"Analyze this AUDIO. {context} {BASE_REQS}"
+
+def build_fix_prompt(raw_text, error):
+    return (
+        "The text below was meant to be ONE JSON object with the keys transcript_summary, "
+        f"visual_summary, chapters and tags, but it is not valid JSON ({error}). "
+        "Return the same content as valid JSON. Do not add, drop or summarize anything.\n\n"
+        f"{raw_text}"
+    )
+
+def parse_analysis(raw_text):
+    data, method = load_json(raw_text)
+    if not isinstance(data, dict):
+        raise ValueError(f"expected a JSON object, got {type(data).__name__}")
+    return data, method
+
+def analyze_with_retries(gemini_files, prompt):
+    """
+    ONE multimodal generation, constrained to ANALYSIS_SCHEMA.
+    If the answer is still not valid JSON it is repaired locally (json_repair.py).
+    Only if that fails is the model asked to fix its own TEXT, in a text-only
+    request: the audio/video files are never sent again.
+    """
+    response = generate_with_fallback(gemini_files, prompt, generation_config=JSON_CONFIG)
+    raw_text = response.text
+
+    for attempt in range(JSON_FOLLOWUPS + 1):
+        try:
+            data, method = parse_analysis(raw_text)
+        except ValueError as e:
+            if attempt == JSON_FOLLOWUPS:
+                metrics.JSON_PARSES.labels(method="failed").inc()
+                print(f"RAW TEXT WAS: {raw_text}")
+                raise ValueError("AI failed to produce valid JSON after local repair and follow-ups.")
+            print(f"⚠️ AI returned invalid JSON ({e}). Text-only fix request {attempt + 1}/{JSON_FOLLOWUPS}...")
+            response = generate_with_fallback([], build_fix_prompt(raw_text, e), generation_config=JSON_CONFIG)
+            raw_text = response.text
+            continue
+
+        if attempt:
+            method = "followup"
+        metrics.JSON_PARSES.labels(method=method).inc()
+        if method == "partial":
+            print("⚠️ AI answer was cut off. Keeping the complete part.")
+        print(f"✅ AI returned valid JSON ({method}).")
+        return data
+
+def reuse_gemini_files(checkpoint, slot):
+    """
+    The files a previous attempt uploaded for this slot, if Gemini still has them all.
+    """
+    names = checkpoint.get_item("gemini_files", slot)
+    if not names:
+        return None
+    try:
+        files = [genai.get_file(name) for name in names]
+    except Exception:
+        return None
+    if all(f.state.name == "ACTIVE" for f in files):
+        return files
+    return None
+
+def analyze_files(audio_path, visual_path, opt_type, frame_times, offset=0, part=None, checkpoint=None, slot="full"):
+    """
+    Upload -> analyze -> map timestamps to real time, for one set of files.
+    Returns {"transcript_summary", "visual_summary", "chapters", "tags"}.
+    The Gemini files are deleted once analyzed. Without a checkpoint they are
+    also deleted on failure; with one they are kept for the retry (Gemini
+    expires them after 48h anyway).
+    """
+    paths = [audio_path, visual_path] if opt_type == 'decoupled' else [audio_path]
+    # Hyper-lapse second N is keyframe N: without the keyframe times, ask for the audio's timeline
+    video_timeline = opt_type == 'decoupled' and bool(frame_times)
+    if opt_type == 'decoupled' and not frame_times:
+        print("⚠️ No keyframe times for the hyper-lapse. Chapters will follow the audio timeline.")
+    gemini_files = reuse_gemini_files(checkpoint, slot) if checkpoint else None
+    if gemini_files:
+        print(f"♻️ Reusing {len(gemini_files)} Gemini file(s) from the previous attempt ({slot}).")
+    else:
+        print(f"📤 Uploading {len(paths)} file(s) ({opt_type})...")
+        gemini_files = upload_files_to_gemini(paths)
+        if checkpoint:
+            checkpoint.save_item("gemini_files", slot, [f.name for f in gemini_files])
+
+    keep = False
+    try:
+        print(f"🧠 Analyzing ({opt_type})...")
+        data = analyze_with_retries(gemini_files, build_prompt(opt_type, part, video_timeline))
+    except Exception as e:
+        # A retry can reuse the uploads, unless the request can never fit the quota
+        keep = checkpoint is not None and not isinstance(e, QuotaExceededError)
+        raise
+    finally:
+        if not keep:
+            for f in gemini_files:
+                try:
+                    genai.delete_file(f.name)
+                except: pass
+            if checkpoint:
+                checkpoint.drop_item("gemini_files", slot)
+
+    chapters_data = data.get("chapters", [])
+    # --- FIX: SCALING LOGIC APPLIED CORRECTLY ---
+    if video_timeline:
+        # Hyper-lapse frame N was taken at frame_times[N] in the original
+        print(f"⏳ Mapping timestamps through {len(frame_times)} keyframes...")
+        final_chapters = scale_timestamps(chapters_data, frame_times=frame_times)
+    else:
+        # Audio runs in real time; only the chunk offset applies
+        final_chapters = scale_timestamps(chapters_data, ratio=1.0, offset=offset)
+
+    return {
+        "transcript_summary": data.get("transcript_summary", ""),
+        "visual_summary": normalize_visual_summary(data.get("visual_summary", "")),
+        "chapters": final_chapters,
+        "tags": data.get("tags", [])
+    }
+
+def chunk_windows(duration_sec):
+    """
+    [(start, end), ...] windows of CHUNK_SECONDS, each overlapping the next by
+    CHUNK_OVERLAP so a topic that spans a boundary is seen whole at least once.
+    No window lies entirely inside the previous one's overlap (it would cost a
+    Gemini call and own no chapter).
+    """
+    windows = []
+    start = 0.0
+    while start < duration_sec and (not windows or start + CHUNK_OVERLAP < duration_sec):
+        windows.append((start, min(start + CHUNK_SECONDS + CHUNK_OVERLAP, duration_sec)))
+        start += CHUNK_SECONDS
+    return windows
+
+def cut_chunk(ffmpeg_exe, audio_path, visual_path, frame_times, start, end, chunk_base):
+    """
+    Cuts one window out of the already transcoded files (cheap: the audio is
+    stream-copied, the hyper-lapse slice is a few hundred 360p frames).
+    Returns (audio_chunk, visual_chunk, chunk_frame_times).
+    """
+    audio_chunk = f"{chunk_base}_audio.mp3"
+    subprocess.run([
+        ffmpeg_exe, '-y', '-ss', f"{start:.3f}", '-t', f"{end - start:.3f}",
+        '-i', audio_path, '-c', 'copy', audio_chunk
+    ], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    indexes = [i for i, t in enumerate(frame_times) if start <= t < end]
+    if not visual_path or not indexes:
+        return audio_chunk, None, []
+
+    first, last = indexes[0], indexes[-1]
+    visual_chunk = f"{chunk_base}_visuals.mp4"
+    subprocess.run([
+        ffmpeg_exe, '-y', '-ss', str(first), '-i', visual_path,
+        '-frames:v', str(last - first + 1),
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-r', '1',
+        visual_chunk
+    ], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return audio_chunk, visual_chunk, frame_times[first:last + 1]
+
+def analyze_chunk(ffmpeg_exe, audio_path, visual_path, opt_type, frame_times, window, part, chunk_base, checkpoint=None):
+    start, end = window
+    slot = f"chunk{part[0]}"
+    if checkpoint:
+        done = checkpoint.get_item("chunks", slot)
+        if done:
+            print(f"♻️ Part {part[0] + 1}/{part[1]} was analyzed by a previous attempt.")
+            return done
+
+    audio_chunk, visual_chunk, chunk_frames = cut_chunk(
+        ffmpeg_exe, audio_path, visual_path, frame_times, start, end, chunk_base
+    )
+    chunk_type = opt_type if visual_chunk else 'audio'
+    try:
+        print(f"🧩 Part {part[0] + 1}/{part[1]} ({format_timestamp(start)} - {format_timestamp(end)})...")
+        result = analyze_files(
+            audio_chunk, visual_chunk, chunk_type, chunk_frames,
+            offset=start, part=part, checkpoint=checkpoint, slot=slot
+        )
+    finally:
+        remove_local_files(audio_chunk, visual_chunk)
+    if checkpoint:
+        checkpoint.save_item("chunks", slot, result)
+    return result
+
+def merge_chunk_results(windows, results):
+    """
+    REDUCE: chapters are already in real time. In an overlap, both chunks saw
+    the same minutes; each chunk keeps only the chapters up to the middle
+    of its overlap with the next one.
+    """
+    chapters = []
+    transcript_parts = []
+    visual_parts = []
+    tag_counts = {}
+
+    for k, ((start, end), result) in enumerate(zip(windows, results)):
+        owned_from = start + CHUNK_OVERLAP / 2 if k > 0 else 0
+        owned_to = start + CHUNK_SECONDS + CHUNK_OVERLAP / 2 if k < len(windows) - 1 else float("inf")
+        for chapter in result["chapters"]:
+            seconds = chapter_start(chapter)
+            if seconds is not None and owned_from <= seconds < owned_to:
+                chapters.append((seconds, chapter))
+
+        header = f"[{format_timestamp(start)} - {format_timestamp(end)}]"
+        if result["transcript_summary"]:
+            transcript_parts.append(f"{header}\n{result['transcript_summary']}")
+        if result["visual_summary"]:
+            visual_parts.append(f"{header}\n{result['visual_summary']}")
+        for tag in result["tags"]:
+            tag_counts[tag] = tag_counts.get(tag, 0) + 1
+
+    chapters.sort(key=lambda x: x[0])
+    return {
+        "transcript_summary": "\n\n".join(transcript_parts),
+        "visual_summary": "\n\n".join(visual_parts),
+        "chapters": [chapter for _, chapter in chapters],
+        # Tags seen in most parts first
+        "tags": sorted(tag_counts, key=lambda t: -tag_counts[t])[:10]
+    }
+
+def analyze_in_chunks(audio_path, visual_path, opt_type, duration_sec, frame_times, work_path, checkpoint=None):
+    """
+    MAP-REDUCE for long videos: every window is analyzed on its own (in
+    parallel, CHUNK_CONCURRENCY at a time), so the context size and the
+    latency depend on CHUNK_SECONDS, not on the video length, and a bad
+    JSON answer only retries its own window.
+    """
+    ffmpeg_exe = imageio_ffmpeg.get_ffmpeg_exe()
+    windows = chunk_windows(duration_sec)
+    print(f"🧩 Chunked analysis: {len(windows)} parts of {CHUNK_SECONDS}s (+{CHUNK_OVERLAP}s overlap)...")
+
+    base = os.path.splitext(work_path)[0]
+    with ThreadPoolExecutor(max_workers=CHUNK_CONCURRENCY) as pool:
+        futures = [
+            metrics.run_in_context(
+                pool, analyze_chunk, ffmpeg_exe, audio_path, visual_path, opt_type, frame_times,
+                window, (k, len(windows), window[0], window[1]), f"{base}_chunk{k}", checkpoint
+            )
+            for k, window in enumerate(windows)
+        ]
+        results = [f.result() for f in futures]
+
+    return merge_chunk_results(windows, results)
+
+
+# --- 4. BACKGROUND TASK (The Worker) ---
+
+def remove_local_files(*paths):
+    for path in paths:
+        if path and os.path.exists(path):
+            os.remove(path)
+
+def should_stream(db, bucket_name, file_key, video_db_id):
+    """
+    Stream mode only knows the content hash once FFmpeg is done. Two small ranged
+    GETs first: if a processed video has the same fingerprint, download instead,
+    so the full hash (and the dedup) comes BEFORE any transcode.
+    Download mode needs none of this: it hashes before FFmpeg anyway.
+    """
+    if INGEST_MODE != "stream":
+        return False
+    try:
+        fingerprint = quick_fingerprint(s3_client, bucket_name, file_key)
+    except Exception as e:
+        print(f"⚠️ Could not fingerprint s3://{bucket_name}/{file_key}: {e}")
+        return True
+    db.query(models.Video).filter(models.Video.id == video_db_id).update({"source_fingerprint": fingerprint})
+    db.commit()
+    candidate = db.query(models.Video.id).filter(
+        models.Video.source_fingerprint == fingerprint,
+        models.Video.processed == True,
+        models.Video.id != video_db_id
+    ).first()
+    if candidate:
+        print(f"🔁 Looks like video {candidate.id}. Downloading to confirm before transcoding.")
+        return False
+    return True
+
+def find_processed_duplicate(db, content_hash, video_db_id):
+    return db.query(models.Video).filter(
+        models.Video.content_hash == content_hash,
+        models.Video.processed == True,
+        models.Video.id != video_db_id
+    ).order_by(models.Video.id).first()
+
+def clone_analysis(db, original, video_db_id):
+    """
+    Copies the AI results (and segment vectors) of an identical, already processed video.
+    """
+    video = db.query(models.Video).filter(models.Video.id == video_db_id).first()
+    if not video:
+        return
+    video.transcript_summary = original.transcript_summary
+    video.visual_summary = original.visual_summary
+    video.chapters = original.chapters
+    video.tags = original.tags
+    video.embedding = original.embedding
+    video.renditions = original.renditions # Same bytes, same renditions
+
+    db.query(models.VideoSegment).filter(models.VideoSegment.video_id == video_db_id).delete()
+    for seg in db.query(models.VideoSegment).filter(models.VideoSegment.video_id == original.id).all():
+        db.add(models.VideoSegment(
+            video_id=video_db_id,
+            user_id=video.user_id, # The new owner, not the original's
+            start_sec=seg.start_sec,
+            end_sec=seg.end_sec,
+            label=seg.label,
+            content=seg.content,
+            embedding=seg.embedding
+        ))
+
+    video.processed = True
+    video.ingest_stage = "done"
+    video.ingest_state = None
+    bump_library_version(db, video.user_id) # The owner's cached /search results are stale now
+    db.commit()
+
+def finish_job(job, started, outcome):
+    seconds = time.perf_counter() - started
+    metrics.INGEST_SECONDS.labels(outcome=outcome).observe(seconds)
+    metrics.INGEST_JOBS.labels(outcome=outcome).inc()
+    if job.tokens:
+        metrics.GEMINI_TOKENS_PER_VIDEO.observe(job.tokens)
+    metrics.log_event("ingest_done", outcome=outcome, seconds=round(seconds, 3), gemini_tokens=job.tokens)
+
+def fetch_source(bucket_name, file_key, temp_path, stream=False):
+    """
+    Download mode: the source lands in 'temp_path', optimized is None.
+    Stream mode: the source is transcoded on the fly, optimized is the transcode result.
+    Returns (hasher, optimized).
+    """
+    optimized = None
+    if stream:
+        try:
+            print(f"🌊 Streaming s3://{bucket_name}/{file_key} into FFmpeg...")
+            stats = TransferStats()
+            hasher = ContentHasher()
+            probe_url = s3_client.generate_presigned_url(
+                'get_object', Params={'Bucket': bucket_name, 'Key': file_key}, ExpiresIn=3600
+            )
+            chunks = hasher.wrap(iter_object_chunks(s3_client, bucket_name, file_key, stats=stats))
+            optimized = optimize_video_from_stream(chunks, probe_url, temp_path)
+            print(f"📶 Streamed {stats.summary()}")
+            metrics.record_download(stats)
+        except Exception as e:
+            print(f"⚠️ Streaming ingestion failed ({e}). Falling back to download mode.")
+
+    if optimized is None:
+        print(f"⬇️ Downloading to {temp_path} (Sanitized)...")
+        hasher = ContentHasher()
+        with stage("download"):
+            stats = download_to_file(s3_client, bucket_name, file_key, temp_path, hasher=hasher)
+        print(f"📶 Downloaded {stats.summary()}")
+        metrics.record_download(stats)
+    return hasher, optimized
+
+def artifact_key(video_db_id, name, path):
+    return f"{ARTIFACT_PREFIX}{video_db_id}/{name}{os.path.splitext(path)[1]}"
+
+def checkpoint_transcode(checkpoint, bucket_name, optimized, work_path):
+    """
+    Keeps the transcoded files in S3 (the audio + a few hundred 360p frames) and
+    records where, with the probe and frame times: the 'transcoded' checkpoint.
+    """
+    (path_a, path_b), opt_type, probe, frame_times = optimized
+    keys = {}
+    proxy_key = None
+    sprite = None
+    with stage("checkpoint_upload"):
+        for name, path in (("audio", path_a), ("visual", path_b)):
+            if path:
+                keys[name] = artifact_key(checkpoint.video_db_id, name, path)
+                s3_client.upload_file(path, bucket_name, keys[name])
+        # The proxy is a final rendition, not a temporary artifact: straight to its own key
+        proxy = renditions.proxy_path(work_path)
+        if path_b and os.path.exists(proxy):
+            proxy_key = renditions.upload(
+                s3_client, bucket_name, proxy, renditions.rendition_key(checkpoint.video_db_id, "proxy.mp4")
+            )
+        # Same for the sprite sheet (+ its VTT/JSON index)
+        sprite_path = renditions.sprite_path(work_path)
+        if path_b and os.path.exists(sprite_path):
+            sprite = renditions.publish_sprite(
+                s3_client, bucket_name, checkpoint.video_db_id, sprite_path, probe["duration"]
+            )
+    checkpoint.save(
+        "transcoded", probe=probe, opt_type=opt_type, frame_times=frame_times, artifacts=keys,
+        proxy_key=proxy_key, sprite=sprite
+    )
+
+def restore_transcode(checkpoint, bucket_name, work_path):
+    """
+    Fetches the transcoded files of a previous attempt. Same return value as optimize_video_for_ai.
+    """
+    keys = checkpoint.get("artifacts", {})
+    audio_path, visual_path = derived_paths(work_path)
+    if not keys.get("visual"):
+        visual_path = None
+    with stage("restore_transcode"):
+        s3_client.download_file(bucket_name, keys["audio"], audio_path)
+        if visual_path:
+            s3_client.download_file(bucket_name, keys["visual"], visual_path)
+    return (audio_path, visual_path), checkpoint.get("opt_type"), checkpoint.get("probe"), checkpoint.get("frame_times", [])
+
+def delete_artifacts(checkpoint, bucket_name):
+    for key in checkpoint.get("artifacts", {}).values():
+        try:
+            s3_client.delete_object(Bucket=bucket_name, Key=key)
+        except Exception as e:
+            print(f"⚠️ Could not delete checkpoint artifact {key}: {e}")
+
+def discard_checkpoint(db, video_db_id, bucket_name):
+    """
+    The job failed for good: nothing will resume from the checkpoint, so the
+    transcoded files in S3 and the Gemini files kept for a retry are deleted.
+    """
+    checkpoint = IngestCheckpoint.load(db, video_db_id)
+    delete_artifacts(checkpoint, bucket_name)
+    for names in checkpoint.get("gemini_files", {}).values():
+        for name in names:
+            delete_gemini_file(name)
+    if checkpoint.stage == "transcoded": # Its files are gone: a manual retry starts over
+        checkpoint.stage = "new"
+    checkpoint.drop("artifacts", "gemini_files")
+
+def publish_renditions(checkpoint, bucket_name, work_path, segments, duration_sec):
+    """
+    Chapter previews (+ HLS) from the proxy, chapter thumbnails from the sprite sheet.
+    Returns the videos.renditions value, or None.
+    Previews are a convenience: if they fail, the video is still processed (proxy only).
+    """
+    proxy_key = checkpoint.get("proxy_key")
+    sprite = checkpoint.get("sprite")
+    starts = [s["start_sec"] for s in segments if not duration_sec or s["start_sec"] < duration_sec]
+    extras = {}
+    if sprite:
+        extras = {"sprite": sprite, "thumbnails": renditions.chapter_thumbnails(sprite, starts)}
+    if not proxy_key:
+        return extras or None
+    proxy = renditions.proxy_path(work_path)
+    try:
+        with stage("renditions", previews=len(starts)):
+            if not os.path.exists(proxy):
+                # Resumed job: the proxy was made by an earlier attempt
+                s3_client.download_file(bucket_name, proxy_key, proxy)
+            return {**renditions.publish(
+                s3_client, bucket_name, imageio_ffmpeg.get_ffmpeg_exe(),
+                checkpoint.video_db_id, proxy, proxy_key, starts
+            ), **extras}
+    except Exception as e:
+        print(f"⚠️ Preview renditions failed ({e}). Keeping the proxy only.")
+        return {"proxy": proxy_key, "previews": [], **extras}
+
+def object_size(bucket_name, key):
+    try:
+        return s3_client.head_object(Bucket=bucket_name, Key=key)["ContentLength"]
+    except Exception as e:
+        print(f"⚠️ Could not size s3://{bucket_name}/{key}: {e}")
+        return 0
+
+def scratch_need(bucket_name, file_key, checkpoint):
+    """
+    Scratch bytes a job will use: the source (unless a checkpoint lets it skip
+    the download) plus the transcoded files. A resumed job also downloads the
+    proxy to cut the previews from (and the HLS segments, a copy of it).
+    """
+    if checkpoint.stage == "done": # Redelivered after success: ingest() is a no-op
+        return 0
+    proxy = 0
+    if checkpoint.reached("transcoded") and checkpoint.get("proxy_key"):
+        proxy = object_size(bucket_name, checkpoint.get("proxy_key")) * (2 if renditions.RENDITION_HLS else 1)
+    if checkpoint.reached("analyzed"):
+        return proxy
+    size = object_size(bucket_name, file_key)
+    outputs = int(size * SCRATCH_OUTPUT_RATIO)
+    if checkpoint.reached("transcoded"):
+        return outputs + proxy
+    return size + outputs
+
+def ingest(db, checkpoint, video_db_id, file_key, bucket_name, temp_path):
+    """
+    The pipeline itself. Every local file lives next to 'temp_path', in the job's scratch dir.
+    Returns the outcome: "processed", "deduplicated" or "already_done".
+    """
+    if checkpoint.stage == "done":
+        # A redelivered job (e.g. the worker died before acking): the video is saved
+        # and the checkpoint cleared, there is nothing to resume
+        print(f"⏭️ Video {video_db_id} is already processed. Nothing to do.")
+        return "already_done"
+    if checkpoint.reached("analyzed"):
+        result = checkpoint.get("analysis")
+        probe = checkpoint.get("probe")
+    else:
+        if checkpoint.reached("transcoded"):
+            optimized = restore_transcode(checkpoint, bucket_name, temp_path)
         else:
-            prompt = f"Analyze this AUDIO. {base_reqs}"
-
-        # --- SELF-HEALING RETRY LOOP ---
-        max_retries = 3
-        data = None
-        for attempt in range(max_retries):
-            print(f"🤖 AI Analysis Attempt {attempt + 1}/{max_retries}...")
-            response = generate_with_fallback(files_to_upload, prompt)
-            
-            raw_text = response.text.replace("```json", "").replace("```", "").strip()
-            clean_text = raw_text.replace('\\', '\\\\')
-            
-            try:
-                data = json.loads(clean_text)
-                print("✅ AI returned valid JSON.")
-                break # Success! Exit the loop.
-            except json.JSONDecodeError as e:
-                print(f"⚠️ AI returned invalid JSON on attempt {attempt + 1}: {e}")
-                prompt += "\n\nCRITICAL: Your previous response was not valid JSON. Please try again and strictly follow all JSON formatting rules. Escape all quotes."
-                if attempt == max_retries - 1:
-                    print(f"RAW TEXT WAS: {raw_text}")
-                    raise ValueError("AI failed to produce valid JSON after multiple retries.")
-        # --------------------------------
+            # 1. DOWNLOAD (+ content hash) + OPTIMIZE (stream mode: only if it cannot be a duplicate)
+            stream = should_stream(db, bucket_name, file_key, video_db_id)
+            hasher, optimized = fetch_source(bucket_name, file_key, temp_path, stream=stream)
 
-        
-        transcript_sum = data.get("transcript_summary", "")
-        visual_sum = normalize_visual_summary(data.get("visual_summary", ""))
-        chapters_data = data.get("chapters", [])
-        tags_data = data.get("tags", [])
-
-        # --- FIX: SCALING LOGIC APPLIED CORRECTLY ---
-        final_chapters = chapters_data
-        if opt_type == 'decoupled':
-            # Ratio is 10.0 because we captured 1 frame every 10s and played at 1fps.
-            SPEEDUP_RATIO = 10.0 
-            print(f"⏳ Scaling timestamps by {SPEEDUP_RATIO}x...")
-            # Using correct variable 'chapters_data' here
-            final_chapters = scale_timestamps(chapters_data, SPEEDUP_RATIO)
-
-        # Embed
-        print("🧮 Generating Embeddings...")
-        embeddings = GoogleGenerativeAIEmbeddings(model="models/text-embedding-004")
+            # 2. DEDUP: same bytes already processed? Reuse the analysis.
+            content_hash = hasher.hexdigest()
+            checkpoint.check_lease(db)
+            video = db.query(models.Video).filter(models.Video.id == video_db_id).first()
+            if video:
+                video.content_hash = content_hash
+                if optimized is None: # Downloaded: fingerprint the local copy, for later streamed uploads
+                    video.source_fingerprint = file_fingerprint(temp_path)
+                db.commit()
+            original = find_processed_duplicate(db, content_hash, video_db_id)
+            if original:
+                print(f"♻️ Same content as video {original.id}. Reusing its analysis.")
+                checkpoint.check_lease(db)
+                clone_analysis(db, original, video_db_id)
+                return "deduplicated"
+
+            if optimized is None:
+                optimized = optimize_video_for_ai(temp_path)
+            checkpoint_transcode(checkpoint, bucket_name, optimized, temp_path)
+
+        (path_a, path_b), opt_type, probe, frame_times = optimized
+
+        # 3. UPLOAD + ANALYZE
+        checkpoint.check_lease()
+        # Long videos are split into overlapping windows analyzed in parallel (map-reduce)
+        with stage("analyze", opt_type=opt_type):
+            if probe["duration"] and probe["duration"] >= CHUNKED_ANALYSIS_MIN_SECONDS:
+                result = analyze_in_chunks(
+                    path_a, path_b, opt_type, probe["duration"], frame_times, temp_path, checkpoint
+                )
+            else:
+                try:
+                    result = analyze_files(path_a, path_b, opt_type, frame_times, checkpoint=checkpoint)
+                except QuotaExceededError as e:
+                    # Too big for one request at any pace: the windows are smaller
+                    if not probe["duration"]:
+                        raise
+                    print(f"✂️ {e} Falling back to chunked analysis.")
+                    result = analyze_in_chunks(
+                        path_a, path_b, opt_type, probe["duration"], frame_times, temp_path, checkpoint
+                    )
+        checkpoint.drop("chunks", "gemini_files")
+        checkpoint.save("analyzed", analysis=result)
+
+    transcript_sum = result["transcript_summary"]
+    visual_sum = result["visual_summary"]
+    final_chapters = result["chapters"]
+    tags_data = result["tags"]
+
+    # Embed
+    print("🧮 Generating Embeddings...")
+    with stage("embed"):
         combined_text = f"Visuals: {visual_sum}\nAudio: {transcript_sum}\nTags: {', '.join(tags_data)}"
-        vector = embeddings.embed_query(combined_text[:8000]) # Truncate safety
 
-        # Save to DB
-        print("💾 Saving to DB...")
+        # One vector per chapter, so search can land on the right moment
+        segments = build_segments(final_chapters, transcript_sum, probe["duration"])
+
+        # Whole video + every chapter in one go: long texts are chunked and pooled,
+        # not truncated, and the chunks share batch calls (see embedding_service.py)
+        vectors = get_embedding_service().embed_documents_pooled(
+            [combined_text] + [s["content"] for s in segments]
+        )
+        vector = vectors[0]
+        # A chapter with neither label nor summary has nothing to embed: it stands for the whole video
+        segment_vectors = [v if v is not None else vector for v in vectors[1:]]
+
+    # Hover previews + seek-friendly proxy for the frontend
+    checkpoint.check_lease()
+    video_renditions = publish_renditions(checkpoint, bucket_name, temp_path, segments, probe["duration"])
+
+    # Save to DB
+    print("💾 Saving to DB...")
+    with stage("db_write", segments=len(segments)):
+        checkpoint.check_lease(db) # Held until the commit: no other worker saves this video meanwhile
         video = db.query(models.Video).filter(models.Video.id == video_db_id).first()
         if video:
             video.transcript_summary = transcript_sum
@@ -292,31 +1173,64 @@ def process_video_task(video_db_id: int, file_key: str):
             video.chapters = final_chapters 
             video.tags = tags_data
             video.embedding = vector
+            video.renditions = video_renditions
+
+            # Replace segments (a retried job must not duplicate them)
+            db.query(models.VideoSegment).filter(models.VideoSegment.video_id == video_db_id).delete()
+            for seg, seg_vector in zip(segments, segment_vectors):
+                db.add(models.VideoSegment(video_id=video_db_id, user_id=video.user_id, embedding=seg_vector, **seg))
+
             video.processed = True
+            # Processed: the checkpoint is no longer needed
+            video.ingest_stage = "done"
+            video.ingest_state = None
+            # Same transaction: cached /search results go stale exactly when the video becomes searchable
+            bump_library_version(db, video.user_id)
             db.commit()
+    delete_artifacts(checkpoint, bucket_name)
+    return "processed"
 
-        # --- CLEANUP START ---
-        # 1. Remove the original downloaded file
-        if os.path.exists(temp_path): 
-            os.remove(temp_path)
-            
-        # 2. Remove the generated Audio file
-        if path_a and path_a != temp_path and os.path.exists(path_a): 
-            os.remove(path_a)
-            
-        # 3. Remove the generated Visual file (if exists)
-        if path_b and path_b != temp_path and os.path.exists(path_b): 
-            os.remove(path_b)
-            
-        # 4. Clean up Google Storage
-        for f in files_to_upload: 
-            try:
-                genai.delete_file(f.name)
-            except: pass
-            
-        print("✅ Done!")
+# Note: We do NOT pass 'db' here. We create it inside.
+# Errors are re-raised so the job queue can schedule a retry (see job_queue.py).
+def process_video_task(video_db_id: int, file_key: str, lease=None):
+    # OPEN FRESH DB CONNECTION
+    db = SessionLocal() 
+    job = metrics.start_job(video_db_id)
+    started = time.perf_counter()
+    
+    try:
+        print(f"🎬 Processing Video {video_db_id}...")
+        
+        # Download
+        bucket_name = os.getenv("AWS_BUCKET_NAME")
+
+        # 1. Get original name
+        original_name = file_key.split("/")[-1]
+        
+        # 2. Sanitize: Replace spaces with underscores
+        clean_name = original_name.replace(" ", "_")
+
+        # A retried job picks up where the previous attempt stopped (see checkpoints.py)
+        # 'lease' (from the worker) makes it stop, without writing, if the job is taken over
+        checkpoint = IngestCheckpoint.load(db, video_db_id, lease)
+        if checkpoint.stage not in ("new", "done"):
+            print(f"⏩ Resuming video {video_db_id} from '{checkpoint.stage}'.")
+
+        # Own scratch dir per job, within the node's disk budget (see scratch.py).
+        # It is removed when the job ends, success or not: no local cleanup below.
+        need_bytes = scratch_need(bucket_name, file_key, checkpoint)
+        wait_started = time.perf_counter()
+        with scratch.job_dir(f"video{video_db_id}", need_bytes) as work_dir:
+            metrics.observe_stage("scratch_wait", time.perf_counter() - wait_started, need_bytes=need_bytes)
+            temp_path = os.path.join(work_dir, clean_name)
+            outcome = ingest(db, checkpoint, video_db_id, file_key, bucket_name, temp_path)
+
+        print("✅ Done!" if outcome == "processed" else f"✅ Done ({outcome})!")
+        finish_job(job, started, outcome)
 
     except Exception as e:
         print(f"❌ Worker Error: {str(e)}")
+        finish_job(job, started, "failed")
+        raise
     finally:
-        db.close() # CRITICAL: Close session
\ No newline at end of file
+        db.close() # CRITICAL: Close session
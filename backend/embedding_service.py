@@ -0,0 +1,210 @@
+"""
+Document embeddings for the worker: ONE client per process, token-aware
+chunking, pooled document vectors and shared batch calls.
+
+    service = get_embedding_service()
+    vectors = service.embed_documents_pooled([long_text, chapter_1, chapter_2])
+
+- Texts longer than EMBED_CHUNK_TOKENS are split on sentence boundaries
+  (with a small overlap) instead of being truncated, every chunk is embedded,
+  and the chunk vectors are mean-pooled (weighted by length) into one vector.
+- Every chunk of every caller goes through one queue. A collector thread
+  groups whatever is waiting into embed_documents calls of up to
+  EMBED_BATCH_SIZE texts, so the worker slots of a process share batches
+  instead of paying one round-trip per text.
+"""
+import os
+import re
+import time
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from langchain_google_genai import GoogleGenerativeAIEmbeddings
+import metrics
+
+# --- CONFIGURATION ---
+EMBEDDING_MODEL = "models/text-embedding-004"
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "100")) # API maximum per batch request
+EMBED_BATCH_WAIT = float(os.getenv("EMBED_BATCH_WAIT_MS", "50")) / 1000 # How long a batch waits to fill up
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "2")) # Batch calls in flight
+EMBED_CHUNK_TOKENS = int(os.getenv("EMBED_CHUNK_TOKENS", "1500")) # Model input limit is 2048 tokens
+EMBED_CHUNK_OVERLAP_TOKENS = int(os.getenv("EMBED_CHUNK_OVERLAP_TOKENS", "100"))
+EMBED_MAX_RETRIES = 3
+EMBED_TIMEOUT = float(os.getenv("EMBED_TIMEOUT_SECONDS", "300")) # One embed_texts call, queueing included
+CHARS_PER_TOKEN = 4 # Good enough for English prose; keeps us well under the limit
+
+
+def estimate_tokens(text):
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def chunk_text(text, max_tokens=EMBED_CHUNK_TOKENS, overlap_tokens=EMBED_CHUNK_OVERLAP_TOKENS):
+    """
+    Splits 'text' into chunks of at most ~max_tokens, on sentence/line boundaries.
+    Consecutive chunks share ~overlap_tokens of text so no idea is cut in half.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return [text]
+
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    units = []
+    for sentence in re.split(r"(?<=[.!?])\s+|\n+", text):
+        sentence = sentence.strip()
+        # A single "sentence" longer than a chunk (no punctuation): hard split
+        while len(sentence) > max_chars:
+            units.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        if sentence:
+            units.append(sentence)
+
+    chunks = []
+    current = []
+    current_tokens = 0
+    for unit in units:
+        tokens = estimate_tokens(unit)
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(" ".join(current))
+            # Carry the tail of this chunk into the next one
+            overlap = []
+            overlap_size = 0
+            for previous in reversed(current):
+                overlap_size += estimate_tokens(previous)
+                if overlap_size > overlap_tokens:
+                    break
+                overlap.insert(0, previous)
+            current = overlap
+            current_tokens = sum(estimate_tokens(u) for u in current)
+        current.append(unit)
+        current_tokens += tokens
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+def mean_pool(vectors, weights):
+    """
+    Weighted mean of the chunk vectors, L2-normalized (cosine search only cares about direction).
+    """
+    total = sum(weights)
+    pooled = [
+        sum(vector[i] * weight for vector, weight in zip(vectors, weights)) / total
+        for i in range(len(vectors[0]))
+    ]
+    norm = sum(x * x for x in pooled) ** 0.5 or 1.0
+    return [x / norm for x in pooled]
+
+
+class EmbeddingService:
+    def __init__(self, client=None, batch_size=EMBED_BATCH_SIZE, batch_wait=EMBED_BATCH_WAIT):
+        self._client = client
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._collector = None
+        self._pool = ThreadPoolExecutor(max_workers=EMBED_CONCURRENCY, thread_name_prefix="embed")
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL)
+            return self._client
+
+    @client.setter
+    def client(self, client):
+        # Benchmarks swap in a fake
+        with self._lock:
+            self._client = client
+
+    def embed_texts(self, texts):
+        """
+        One vector per text (each must fit the model). Blocks until all are embedded,
+        at most EMBED_TIMEOUT seconds (then TimeoutError: the job fails and is retried).
+        """
+        futures = []
+        for text in texts:
+            future = Future()
+            self._queue.put((text, future))
+            futures.append(future)
+        self._ensure_collector()
+        deadline = time.monotonic() + EMBED_TIMEOUT
+        return [future.result(timeout=max(deadline - time.monotonic(), 0)) for future in futures]
+
+    def embed_documents_pooled(self, documents):
+        """
+        One vector per document, whatever its length (chunk -> embed -> pool).
+        All chunks of all documents are queued at once, so they share batches.
+        Empty or blank documents are not sent (the API rejects them): their vector is None.
+        """
+        chunked = [chunk_text(document) if document and document.strip() else [] for document in documents]
+        vectors = self.embed_texts([chunk for chunks in chunked for chunk in chunks])
+
+        pooled = []
+        start = 0
+        for chunks in chunked:
+            chunk_vectors = vectors[start:start + len(chunks)]
+            start += len(chunks)
+            if not chunks:
+                pooled.append(None)
+            elif len(chunks) == 1:
+                pooled.append(chunk_vectors[0])
+            else:
+                pooled.append(mean_pool(chunk_vectors, [estimate_tokens(c) for c in chunks]))
+        return pooled
+
+    def _ensure_collector(self):
+        with self._lock:
+            if self._collector is None:
+                self._collector = threading.Thread(target=self._collect, name="embed-collector", daemon=True)
+                self._collector.start()
+
+    def _collect(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    if timeout > 0:
+                        batch.append(self._queue.get(timeout=timeout))
+                    else:
+                        # Past the deadline: still take what is already queued
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._pool.submit(self._embed_batch, batch)
+
+    def _embed_batch(self, batch):
+        texts = [text for text, _ in batch]
+        metrics.EMBED_BATCH_SIZE.observe(len(texts))
+        for attempt in range(EMBED_MAX_RETRIES):
+            try:
+                vectors = self.client.embed_documents(texts)
+                break
+            except Exception as e:
+                if attempt == EMBED_MAX_RETRIES - 1 or not ("429" in str(e) or "ResourceExhausted" in str(e)):
+                    for _, future in batch:
+                        future.set_exception(e)
+                    return
+                print(f"🛑 Embedding rate limit hit. Retrying batch of {len(texts)} ({attempt + 1}/{EMBED_MAX_RETRIES})...")
+                time.sleep(2 ** attempt)
+        if len(vectors) != len(batch):
+            # Never guess which text a vector belongs to, and never leave a caller waiting
+            error = RuntimeError(f"Embedding API returned {len(vectors)} vectors for {len(batch)} texts")
+            for _, future in batch:
+                future.set_exception(error)
+            return
+        for (_, future), vector in zip(batch, vectors):
+            future.set_result(vector)
+
+
+_service = None
+_service_lock = threading.Lock()
+
+def get_embedding_service():
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = EmbeddingService()
+        return _service
@@ -0,0 +1,187 @@
+import os
+import random
+import threading
+from datetime import timedelta
+from sqlalchemy import or_, and_
+from sqlalchemy.sql import func
+from sqlalchemy.orm import Session
+import models
+
+# --- CONFIGURATION ---
+# How long a claimed job stays ours without a heartbeat
+LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "120"))
+# Retry backoff: base * 2^(attempt-1), capped, plus jitter
+RETRY_BASE_SECONDS = int(os.getenv("JOB_RETRY_BASE_SECONDS", "30"))
+RETRY_MAX_SECONDS = int(os.getenv("JOB_RETRY_MAX_SECONDS", "1800"))
+MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+
+
+class PermanentJobError(Exception):
+    """
+    Raised by a job for a failure a retry cannot fix: the job is marked failed at once.
+    """
+
+
+class LeaseLostError(Exception):
+    """
+    Another worker reclaimed the job: this one must stop and leave it alone.
+    """
+
+
+class Lease:
+    """
+    A worker's hold on a claimed job. The heartbeat sets 'lost' when it fails to
+    extend it; the job checks it between stages and before every write.
+    """
+    def __init__(self, job_id, worker_id):
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.lost = threading.Event()
+
+    def check(self):
+        if self.lost.is_set():
+            raise LeaseLostError(f"Job {self.job_id} is no longer leased by {self.worker_id}.")
+
+    def lock(self, db: Session):
+        """
+        Locks the job row until 'db' commits, so it cannot be reclaimed meanwhile.
+        Raises LeaseLostError if it is already someone else's.
+        """
+        self.check()
+        owned = db.query(models.IngestionJob.id).filter(
+            models.IngestionJob.id == self.job_id,
+            models.IngestionJob.locked_by == self.worker_id,
+            models.IngestionJob.status == "running"
+        ).with_for_update().first()
+        if not owned:
+            self.lost.set()
+            self.check()
+
+
+def enqueue_job(db: Session, video_id: int, s3_key: str):
+    """
+    Adds an ingestion job. Does NOT commit, so the caller can create the
+    video row and its job in the same transaction.
+    """
+    job = models.IngestionJob(
+        video_id=video_id,
+        s3_key=s3_key,
+        status="queued",
+        attempts=0,
+        max_attempts=MAX_ATTEMPTS
+    )
+    db.add(job)
+    return job
+
+
+def claim_job(db: Session, worker_id: str, on_failed=None):
+    """
+    Claims the next runnable job (queued and due, or running with an expired lease).
+    SKIP LOCKED lets many workers poll the same table without blocking each other.
+    Returns (job_id, video_id, s3_key, attempt) or None.
+    'on_failed(video_id)' is called for the jobs found out of attempts on the way.
+    """
+    while True:
+        job = db.query(models.IngestionJob).filter(
+            or_(
+                and_(models.IngestionJob.status == "queued", models.IngestionJob.run_after <= func.now()),
+                and_(models.IngestionJob.status == "running", models.IngestionJob.lease_expires_at < func.now())
+            )
+        ).order_by(models.IngestionJob.run_after).with_for_update(skip_locked=True).first()
+
+        if not job:
+            db.rollback()
+            return None
+
+        # A worker died while holding this job and it has no attempts left
+        if job.attempts >= job.max_attempts:
+            print(f"💀 Job {job.id} exhausted {job.attempts} attempts (lease expired). Marking failed.")
+            job.status = "failed"
+            job.locked_by = None
+            job.last_error = job.last_error or "Lease expired after final attempt"
+            video_id = job.video_id
+            db.commit()
+            if on_failed:
+                on_failed(video_id)
+            continue
+
+        job.status = "running"
+        job.attempts += 1
+        job.locked_by = worker_id
+        job.heartbeat_at = func.now()
+        job.lease_expires_at = func.now() + timedelta(seconds=LEASE_SECONDS)
+        db.commit()
+        return job.id, job.video_id, job.s3_key, job.attempts
+
+
+def heartbeat(db: Session, job_id: int, worker_id: str):
+    """
+    Extends the lease. Returns False if the lease was lost (another worker reclaimed it).
+    """
+    updated = db.query(models.IngestionJob).filter(
+        models.IngestionJob.id == job_id,
+        models.IngestionJob.locked_by == worker_id,
+        models.IngestionJob.status == "running"
+    ).update({
+        models.IngestionJob.heartbeat_at: func.now(),
+        models.IngestionJob.lease_expires_at: func.now() + timedelta(seconds=LEASE_SECONDS)
+    }, synchronize_session=False)
+    db.commit()
+    return updated == 1
+
+
+def complete_job(db: Session, job_id: int, worker_id: str):
+    """
+    Marks the job done if this worker still holds it. Returns False if it does not.
+    """
+    updated = db.query(models.IngestionJob).filter(
+        models.IngestionJob.id == job_id,
+        models.IngestionJob.locked_by == worker_id,
+        models.IngestionJob.status == "running"
+    ).update({
+        models.IngestionJob.status: "done",
+        models.IngestionJob.locked_by: None,
+        models.IngestionJob.lease_expires_at: None,
+        models.IngestionJob.last_error: None
+    }, synchronize_session=False)
+    db.commit()
+    return updated == 1
+
+
+def retry_delay(attempt: int):
+    delay = min(RETRY_BASE_SECONDS * 2 ** (attempt - 1), RETRY_MAX_SECONDS)
+    return delay + random.uniform(0, delay * 0.1)
+
+
+def fail_job(db: Session, job_id: int, worker_id: str, error: str, retry: bool = True):
+    """
+    Puts the job back in the queue with exponential backoff,
+    or marks it failed once it has used all its attempts (or if 'retry' is False).
+    Returns True if the failure is final.
+    """
+    job = db.query(models.IngestionJob).filter(
+        models.IngestionJob.id == job_id,
+        models.IngestionJob.locked_by == worker_id
+    ).with_for_update().first()
+    if not job:
+        db.rollback()
+        return False
+
+    job.last_error = error[:2000]
+    job.locked_by = None
+    job.lease_expires_at = None
+
+    if not retry:
+        print(f"💀 Job {job.id} failed permanently (not retryable).")
+        job.status = "failed"
+    elif job.attempts >= job.max_attempts:
+        print(f"💀 Job {job.id} failed permanently after {job.attempts} attempts.")
+        job.status = "failed"
+    else:
+        delay = retry_delay(job.attempts)
+        print(f"🔁 Job {job.id} will retry in {int(delay)}s (attempt {job.attempts}/{job.max_attempts}).")
+        job.status = "queued"
+        job.run_after = func.now() + timedelta(seconds=delay)
+    final = job.status == "failed"
+    db.commit()
+    return final
@@ -0,0 +1,184 @@
+"""
+Local repair of almost-valid JSON from the AI, so a stray quote or a cut-off
+answer does not cost another multimodal generation.
+
+    data, method = load_json(response.text) # method: "strict" | "repaired" | "partial"
+
+Repairs, in one pass over the text:
+- markdown fences and chatter around the object are dropped (balanced-brace extraction),
+- invalid escapes ("C:\\Users", "\\d+") get their backslash escaped; valid ones are kept,
+- raw newlines/tabs inside strings are escaped,
+- quotes inside strings ("the "event loop" model") are escaped,
+- trailing commas are dropped,
+- a truncated answer is closed (open string, arrays, objects); if the cut fell
+  in the middle of a member, the answer is rolled back to the last complete one.
+"""
+import re
+import json
+
+VALID_ESCAPES = '"\\/bfnrt'
+CONTROL_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+CLOSERS = {"{": "}", "[": "]"}
+MAX_ROLLBACKS = 50
+
+
+def strip_fences(text):
+    return re.sub(r"```(?:json)?", "", text or "").strip()
+
+
+def extract_json_block(text):
+    """
+    The first top-level JSON object/array in 'text' (string-aware brace matching).
+    A block that never closes is returned up to the end (truncated answer).
+    """
+    text = strip_fences(text)
+    starts = [i for i in (text.find("{"), text.find("[")) if i != -1]
+    if not starts:
+        return text
+    start = min(starts)
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            depth += 1
+        elif char in "}]":
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return text[start:]
+
+
+def _next_significant(text, i):
+    while i < len(text) and text[i].isspace():
+        i += 1
+    return i
+
+
+def _closes_string(text, i):
+    """
+    Is the quote at text[i] the end of the string (and not a quote inside it)?
+    It is if what follows makes sense after a JSON string.
+    """
+    j = _next_significant(text, i + 1)
+    if j >= len(text) or text[j] in "}]:":
+        return True
+    if text[j] == ",":
+        k = _next_significant(text, j + 1)
+        return k >= len(text) or text[k] in '"{[]}-0123456789'
+    return False
+
+
+def repair_json(text):
+    """
+    Returns (repaired_text, truncated). See the module docstring.
+    """
+    out = []
+    stack = []
+    rollback_points = [] # (len(out), stack) after each complete member
+    in_string = False
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if in_string:
+            if char == "\\":
+                nxt = text[i + 1] if i + 1 < len(text) else ""
+                if nxt and nxt in VALID_ESCAPES:
+                    out.append(char + nxt)
+                    i += 2
+                    continue
+                if nxt == "u" and re.match(r"[0-9a-fA-F]{4}", text[i + 2:i + 6]):
+                    out.append(text[i:i + 6])
+                    i += 6
+                    continue
+                out.append("\\\\") # Lone backslash: keep it as a literal
+            elif char == '"':
+                if _closes_string(text, i):
+                    in_string = False
+                    out.append(char)
+                else:
+                    out.append('\\"')
+            elif char in CONTROL_ESCAPES:
+                out.append(CONTROL_ESCAPES[char])
+            elif ord(char) < 0x20:
+                out.append(f"\\u{ord(char):04x}")
+            else:
+                out.append(char)
+        elif char == '"':
+            in_string = True
+            out.append(char)
+        elif char in "{[":
+            stack.append(char)
+            out.append(char)
+        elif char in "}]":
+            if stack:
+                stack.pop()
+                out.append(char)
+            # An unmatched closer is dropped
+        elif char == ",":
+            j = _next_significant(text, i + 1)
+            if j < len(text) and text[j] in "}]":
+                i += 1 # Trailing comma
+                continue
+            rollback_points.append((len(out), list(stack)))
+            out.append(char)
+        else:
+            out.append(char)
+        i += 1
+
+    truncated = in_string or bool(stack)
+    if not truncated:
+        return "".join(out), False
+
+    # Truncated answer: close what is open. If the cut left a member
+    # half-written ('"key": ', '"ke'), fall back to the last complete member.
+    closed = _close("".join(out) + ('"' if in_string else ""), stack)
+    if _is_valid(closed):
+        return closed, True
+    for length, snapshot in reversed(rollback_points[-MAX_ROLLBACKS:]):
+        candidate = _close("".join(out[:length]), snapshot)
+        if _is_valid(candidate):
+            return candidate, True
+    return closed, True
+
+
+def _close(text, stack):
+    text = text.rstrip()
+    if text.endswith(":"):
+        text += " null"
+    text = text.rstrip(",")
+    return text + "".join(CLOSERS[opener] for opener in reversed(stack))
+
+
+def _is_valid(text):
+    try:
+        json.loads(text)
+        return True
+    except ValueError:
+        return False
+
+
+def load_json(text):
+    """
+    Parses an AI answer. Returns (data, method):
+    "strict" (valid as is), "repaired", or "partial" (truncated answer, closed).
+    Raises ValueError if even the repaired text is not JSON.
+    """
+    block = extract_json_block(text)
+    try:
+        return json.loads(block), "strict"
+    except ValueError:
+        pass
+    repaired, truncated = repair_json(block)
+    data = json.loads(repaired)
+    return data, "partial" if truncated else "repaired"
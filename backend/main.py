@@ -1,34 +1,39 @@
-from fastapi import FastAPI, Depends, BackgroundTasks, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Response, Query, Request, Header
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy import select, tuple_, cast
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import Session, defer
+from sqlalchemy.ext.asyncio import AsyncSession
 import models
-from database import engine, get_db, SessionLocal # Import SessionLocal for background tasks
+from database import engine, get_db, get_async_db
+from job_queue import enqueue_job
+from timecodes import format_timestamp, parse_timestamp
+from cache import make_cache, normalize_query
+from search import check_iterative_scan, hybrid_search, best_moments, match_type, chapter_at, chapters_between
+from search_cache import SearchResultCache
+from url_signer import UrlSigner
+import metrics
 import boto3
 from botocore.exceptions import NoCredentialsError
 from botocore.config import Config
 import os
-import re
-import shutil
-import time
+import hmac
 import json
-import tempfile
-from pydantic import BaseModel
+import time
+import uuid
+import base64
+from datetime import datetime
+from typing import Optional
+from pydantic import BaseModel, Field
 import google.generativeai as genai
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from moviepy.editor import VideoFileClip
-import PIL.Image
-import subprocess
-import imageio_ffmpeg
 
-# --- 1. MONKEY PATCH (Fix for MoviePy/Pillow) ---
-if not hasattr(PIL.Image, 'ANTIALIAS'):
-    PIL.Image.ANTIALIAS = PIL.Image.LANCZOS
-
-# --- 2. CONFIGURATION ---
+# --- 1. CONFIGURATION ---
 # Database
 # UNCOMMENT THIS LINE FOR ONE RUN:
 # models.Base.metadata.drop_all(bind=engine) 
-models.Base.metadata.create_all(bind=engine)
+models.init_db(engine)
+check_iterative_scan(engine)
 
 # App
 app = FastAPI()
@@ -40,8 +45,26 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"], # Keyset pagination cursor (GET /videos/)
 )
 
+# Request latency per route template ("/videos/{video_id}", not one series per id)
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        metrics.HTTP_SECONDS.labels(
+            method=request.method,
+            route=route.path if route else "unmatched",
+            status=str(status)
+        ).observe(time.perf_counter() - started)
+
 # AWS S3
 region = os.getenv("AWS_REGION")
 s3_config = Config(region_name=region, signature_version='s3v4')
@@ -53,204 +76,185 @@ s3_client = boto3.client(
     config=s3_config
 )
 
+# Playback URLs: signed once, reused until close to expiry
+url_signer = UrlSigner(s3_client, os.getenv("AWS_BUCKET_NAME"))
+
 # Google AI
 genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
 
-# --- 3. HELPER FUNCTIONS ---
+# Embeddings: ONE client for the whole process (not one per request)
+embeddings = GoogleGenerativeAIEmbeddings(model="models/text-embedding-004")
 
-def normalize_visual_summary(visual_data):
-    if isinstance(visual_data, str): return visual_data
-    if isinstance(visual_data, list):
-        return "\n".join([f"[{item.get('time', '')}] {item.get('content', '')}" for item in visual_data])
-    return ""
+# Query -> vector cache. Identical searches skip the remote embedding call.
+query_embedding_cache = make_cache(
+    "query_embedding",
+    maxsize=int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "4096")),
+    ttl=int(os.getenv("QUERY_EMBEDDING_CACHE_TTL", "86400"))
+)
 
-def get_video_duration(ffmpeg_exe, video_path):
-    try:
-        result = subprocess.run([ffmpeg_exe, '-i', video_path], stderr=subprocess.PIPE, text=True)
-        match = re.search(r"Duration: (\d{2}):(\d{2}):(\d{2}\.\d{2})", result.stderr)
-        if match:
-            h, m, s = map(float, match.groups())
-            return h * 3600 + m * 60 + s
-    except: return None
-    return None
-
-def scale_timestamps(chapters_data, ratio):
-    new_chapters = []
-    for chapter in chapters_data:
-        time_str = chapter.get("timestamp", "00:00")
-        try:
-            parts = list(map(int, time_str.split(":")))
-            seconds = sum(p * 60**i for i, p in enumerate(reversed(parts)))
-            real_seconds = seconds * ratio
-            m, s = divmod(real_seconds, 60)
-            h, m = divmod(m, 60)
-            new_time = f"{int(h):02d}:{int(m):02d}:{int(s):02d}" if h > 0 else f"{int(m):02d}:{int(s):02d}"
-            new_chapters.append({"timestamp": new_time, "label": chapter.get("label", "")})
-        except: new_chapters.append(chapter)
-    return new_chapters
-
-def optimize_video_for_ai(video_path):
-    """
-    STRATEGY: SYNCED SLIDESHOW
-    Creates a single, low-FPS video file with full audio, but a compressed duration.
-    Returns: (file_path, optimization_type)
-    """
-    try:
-        ffmpeg_exe = imageio_ffmpeg.get_ffmpeg_exe()
-        duration_sec = get_video_duration(ffmpeg_exe, video_path) or 0
-        
-        # Don't optimize short videos
-        if duration_sec < 600:
-            return video_path, 'original'
-
-        print(f"📉 Generating 'Synced Slideshow' for {duration_sec}s video...")
-        
-        optimized_path = video_path.replace(".mp4", "_optimized.mp4")
-        
-        # We need ~700 frames max for safety. FPS = 700 / duration.
-        target_fps = 700 / duration_sec
-        target_fps = max(target_fps, 0.05) # At least 1 frame every 20s
-        
-        # THE MAGIC: We resample the video AND audio to a new, shorter timeline.
-        # This creates ONE file that is 10x shorter but contains all the data.
-        cmd = [
-            ffmpeg_exe, '-y', '-i', video_path,
-            '-vf', f"setpts=0.1*PTS,scale=-2:480", # Speed up video 10x
-            '-af', 'atempo=2.0,atempo=2.0,atempo=2.0,atempo=1.25', # Speed up audio 10x (2*2*2*1.25)
-            '-c:v', 'libx264', '-preset', 'ultrafast',
-            optimized_path
-        ]
-        
-        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        return optimized_path, 'synced_slideshow'
+# Query -> results cache, invalidated when a video finishes processing
+search_result_cache = SearchResultCache()
 
-    except Exception as e:
-        print(f"❌ Optimization failed: {e}. Fallback to Original.")
-        return video_path, 'original'
 
-def generate_with_fallback(contents, prompt_text=""):
-    request_content = [contents, prompt_text]
-    models_to_try = ["gemini-flash-latest", "gemini-robotics-er-1.5-preview"] 
-    
-    for model_name in models_to_try:
-        try:
-            print(f"🤖 Attempting analysis with {model_name}...")
-            model = genai.GenerativeModel(model_name=model_name)
-            return model.generate_content(request_content)
-        except Exception as e:
-            print(f"❌ Error with {model_name}: {str(e)}")
-            continue
-    raise RuntimeError("All AI models failed.")
+# --- 2. ENDPOINTS ---
+# Ingestion runs in worker.py (see decoupling.process_video_task), not in the API process.
 
-# --- WORKER ---
-def process_video_task(video_db_id: int, file_key: str):
-    try:
-        print(f"🎬 Processing Video {video_db_id}...")
-        bucket_name = os.getenv("AWS_BUCKET_NAME")
-        original_name = file_key.split("/")[-1]
-        clean_name = original_name.replace(" ", "_")
-        temp_dir = tempfile.gettempdir() 
-        temp_path = os.path.join(temp_dir, clean_name)
-        
-        s3_client.download_file(bucket_name, file_key, temp_path)
-        
-        final_upload_path, opt_type = optimize_video_for_ai(temp_path)
-        
-        print(f"📤 Uploading ({opt_type} mode)...")
-        video_file = genai.upload_file(path=final_upload_path)
-        
-        while video_file.state.name == "PROCESSING":
-            time.sleep(5)
-            video_file = genai.get_file(video_file.name)
-
-        print(f"🧠 Analyzing ({opt_type})...")
-        prompt = """
-        Analyze this video lecture. The audio has been sped up significantly.
-        I need a structured JSON output with:
-        1. "transcript_summary": A detailed summary/notes of the spoken content.
-        2. "visual_summary": A description of the visual slides or diagrams that was SHOWN.
-        3. "chapters": A list of objects with "timestamp" (MM:SS) and a descriptive "label".
-        4. "tags": List of 5-10 technical keywords.
-        Output ONLY valid JSON, escaping all quotes.
-        """
-
-        response = generate_with_fallback(video_file, prompt)
-        
-        # Parse with robust error handling
-        raw_text = response.text.replace("```json", "").replace("```", "").strip()
-        try:
-            data = json.loads(raw_text)
-        except json.JSONDecodeError as e:
-            print(f"❌ JSON PARSE ERROR: {e}\nRAW TEXT: {raw_text}")
-            raise ValueError("AI returned invalid JSON")
-        
-        transcript_sum = data.get("transcript_summary", "")
-        visual_sum = normalize_visual_summary(data.get("visual_summary", ""))
-        chapters_data = data.get("chapters", [])
-        tags_data = data.get("tags", [])
-        
-        # SCALING IS STILL NEEDED
-        final_chapters = chapters_data
-        if opt_type == 'synced_slideshow':
-            SPEEDUP_RATIO = 10.0 
-            print(f"⏳ Scaling timestamps by {SPEEDUP_RATIO}x...")
-            final_chapters = scale_timestamps(data.get("chapters", []), SPEEDUP_RATIO)
-
-        # Embed
-        print("🧮 Generating Embeddings...")
-        embeddings = GoogleGenerativeAIEmbeddings(model="models/text-embedding-004")
-        combined_text = f"Visuals: {visual_sum}\nAudio: {transcript_sum}\nTags: {', '.join(tags_data)}"
-        vector = embeddings.embed_query(combined_text[:8000]) # Truncate safety
-        
-        db = SessionLocal()
-        try:
-            print("💾 Saving to DB...")
-            video = db.query(models.Video).filter(models.Video.id == video_db_id).first()
-            if video:
-                video.transcript_summary = transcript_sum
-                video.visual_summary = visual_sum
-                video.chapters = final_chapters
-                video.tags = tags_data
-                video.embedding = vector
-                video.processed = True
-                db.commit()
-        finally:
-            db.close()
-
-        # Cleanup
-        if os.path.exists(temp_path): os.remove(temp_path)
-        if final_upload_path != temp_path and os.path.exists(final_upload_path): 
-            os.remove(final_upload_path)
-        genai.delete_file(video_file.name)
-        
-        print("✅ Done!")
-
-    except Exception as e:
-        print(f"❌ Worker Error: {str(e)}")
-
-# --- 5. ENDPOINTS ---
+# Never sent to clients: the vectors, the tsvector and the ingestion checkpoint
+HEAVY_COLUMNS = [defer(models.Video.embedding), defer(models.Video.search_tsv), defer(models.Video.ingest_state)]
 
 class SearchQuery(BaseModel):
     query: str
+    limit: int = Field(10, ge=1, le=50)
+    tags: Optional[list[str]] = None # Only videos having ALL these tags
 
 class VideoCreate(BaseModel):
     filename: str
     content_type: str
 
+# Without a trusted proxy (local dev, the demo) every request belongs to this user
+DEFAULT_USER_ID = os.getenv("DEFAULT_USER_ID", "demo_user")
+# Shared with the auth proxy in front of the API: it verifies the Clerk session,
+# then forwards X-User-Id along with X-Proxy-Secret
+TRUSTED_PROXY_SECRET = os.getenv("TRUSTED_PROXY_SECRET")
+
+def current_user_id(x_user_id: Optional[str] = Header(None), x_proxy_secret: Optional[str] = Header(None)):
+    """
+    The tenant every query is scoped to. X-User-Id is only believed when the
+    request proves it came through the trusted proxy; anything else is a 401.
+    """
+    if not TRUSTED_PROXY_SECRET:
+        if x_user_id and x_user_id != DEFAULT_USER_ID:
+            raise HTTPException(status_code=401, detail="X-User-Id needs a trusted proxy (TRUSTED_PROXY_SECRET)")
+        return DEFAULT_USER_ID
+    if not x_proxy_secret or not hmac.compare_digest(x_proxy_secret.encode(), TRUSTED_PROXY_SECRET.encode()):
+        raise HTTPException(status_code=401, detail="Requests must come through the auth proxy")
+    if not x_user_id:
+        raise HTTPException(status_code=401, detail="Missing X-User-Id")
+    return x_user_id
+
+def has_tags(tags):
+    # tags::jsonb @> '["a", "b"]' -> GIN index ix_videos_tags_gin
+    return cast(models.Video.tags, JSONB).contains(tags)
+
 @app.get("/")
 def read_root():
     return {"message": "Codex API is running"}
 
+def encode_cursor(created_at, video_id):
+    raw = json.dumps([created_at.isoformat(), video_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def decode_cursor(cursor: str):
+    try:
+        created_at, video_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), int(video_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 @app.get("/videos/")
-def read_videos(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    # Defer embedding to prevent 500 error
-    videos = db.query(models.Video).options(defer(models.Video.embedding)).order_by(models.Video.created_at.desc()).offset(skip).limit(limit).all()
+async def read_videos(
+    response: Response,
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = None,
+    skip: int = 0, # Legacy offset paging, ignored when a cursor is given
+    view: str = Query("full", pattern="^(compact|full)$"),
+    tag: Optional[list[str]] = Query(None),
+    user_id: str = Depends(current_user_id),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    The user's videos, newest first. Keyset pagination on (created_at, id): pass the
+    X-Next-Cursor header of a page as ?cursor= to get the next one (an index seek
+    on (user_id, created_at, id), however deep).
+    ?tag=react&tag=hooks keeps only the videos having all these tags.
+    view=compact returns only id, title, tags, processed, created_at;
+    use GET /videos/{id} for the rest.
+    """
+    if view == "compact":
+        stmt = select(
+            models.Video.id, models.Video.title, models.Video.tags,
+            models.Video.processed, models.Video.created_at
+        )
+    else:
+        # Defer embedding to prevent 500 error
+        stmt = select(models.Video).options(*HEAVY_COLUMNS)
+
+    stmt = stmt.where(models.Video.user_id == user_id)
+    if tag:
+        stmt = stmt.where(has_tags(tag))
+    stmt = stmt.order_by(models.Video.created_at.desc(), models.Video.id.desc()).limit(limit)
+    if cursor:
+        created_at, video_id = decode_cursor(cursor)
+        stmt = stmt.where(tuple_(models.Video.created_at, models.Video.id) < tuple_(created_at, video_id))
+    elif skip:
+        stmt = stmt.offset(skip)
+
+    result = await db.execute(stmt)
+    videos = [row._asdict() for row in result.all()] if view == "compact" else result.scalars().all()
+
+    if len(videos) == limit:
+        last = videos[-1]
+        if view == "compact":
+            response.headers["X-Next-Cursor"] = encode_cursor(last["created_at"], last["id"])
+        else:
+            response.headers["X-Next-Cursor"] = encode_cursor(last.created_at, last.id)
     return videos
 
+@app.get("/videos/{video_id}")
+async def read_video(
+    video_id: int, user_id: str = Depends(current_user_id), db: AsyncSession = Depends(get_async_db)
+):
+    result = await db.execute(
+        select(models.Video).options(*HEAVY_COLUMNS)
+        .where(models.Video.id == video_id, models.Video.user_id == user_id)
+    )
+    video = result.scalars().first()
+    if not video:
+        raise HTTPException(status_code=404, detail="Video not found")
+    return video
+
+def chapter_json(row):
+    return {
+        "id": row.id,
+        "start_sec": row.start_sec,
+        "end_sec": row.end_sec,
+        "start_at": format_timestamp(row.start_sec),
+        "end_at": format_timestamp(row.end_sec) if row.end_sec is not None else None,
+        "label": row.label
+    }
+
+@app.get("/videos/{video_id}/chapters")
+async def read_chapters(
+    video_id: int,
+    at: Optional[int] = Query(None, ge=0),
+    start: Optional[int] = Query(None, ge=0),
+    end: Optional[int] = Query(None, ge=0),
+    user_id: str = Depends(current_user_id),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Chapters with integer seconds, in time order (index on video_id, start_sec).
+    ?at=2470 -> the chapter playing at that second (404 if none).
+    ?start=2400&end=3000 -> the chapters overlapping that range (either bound optional).
+    """
+    if at is not None:
+        row = await chapter_at(db, video_id, at, user_id)
+        if row is None:
+            raise HTTPException(status_code=404, detail="No chapter at that time")
+        return chapter_json(row)
+    if start is not None and end is not None and end <= start:
+        raise HTTPException(status_code=400, detail="'end' must be after 'start'")
+    return [chapter_json(row) for row in await chapters_between(db, video_id, user_id, start, end)]
+
+def upload_prefix(user_id: str):
+    return f"uploads/{user_id}/"
+
 @app.post("/videos/presigned-url")
-def generate_presigned_url(video: VideoCreate):
+def generate_presigned_url(video: VideoCreate, user_id: str = Depends(current_user_id)):
     bucket_name = os.getenv("AWS_BUCKET_NAME")
-    object_name = video.filename # Storing at root to fix path issues
+    # The caller's prefix + a folder per upload: same-name files never overwrite each other
+    filename = video.filename.replace("/", "_")
+    object_name = f"{upload_prefix(user_id)}{uuid.uuid4()}/{filename}"
     try:
         url = s3_client.generate_presigned_url(
             'put_object',
@@ -262,103 +266,239 @@ def generate_presigned_url(video: VideoCreate):
         return {"error": "AWS Credentials not available"}
 
 @app.post("/videos/process")
-def start_processing(video_data: dict, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+def start_processing(video_data: dict, user_id: str = Depends(current_user_id), db: Session = Depends(get_db)):
     s3_key = video_data.get("key")
     title = video_data.get("title", "Untitled")
+    # Only the caller's own uploads (see generate_presigned_url)
+    if not isinstance(s3_key, str) or not s3_key.startswith(upload_prefix(user_id)):
+        raise HTTPException(status_code=403, detail="Not your upload")
+    if db.query(models.Video.id).filter(models.Video.s3_key == s3_key).first():
+        raise HTTPException(status_code=409, detail="This upload is already processed")
     
-    new_video = models.Video(title=title, s3_key=s3_key, user_id="demo_user", processed=False)
+    new_video = models.Video(title=title, s3_key=s3_key, user_id=user_id, processed=False)
     db.add(new_video)
-    db.commit()
-    db.refresh(new_video)
-    
-    # Start worker WITHOUT passing 'db'
-    background_tasks.add_task(process_video_task, new_video.id, s3_key)
+    db.flush() # Assigns new_video.id
     
-    return {"status": "Processing started", "video_id": new_video.id}
-
-@app.post("/search")
-def search_videos(search: SearchQuery, db: Session = Depends(get_db)):
-    print(f"🔍 Searching for: {search.query}")
+    # Queue the job in the SAME transaction: no video without a job, and vice versa.
+    # A worker (python worker.py) picks it up; the API returns immediately.
+    job = enqueue_job(db, new_video.id, s3_key)
+    db.commit()
     
-    # 1. Get Vector Results (Semantic Match)
-    embeddings = GoogleGenerativeAIEmbeddings(model="models/text-embedding-004")
-    query_vector = embeddings.embed_query(search.query)
+    return {"status": "Processing started", "video_id": new_video.id, "job_id": job.id}
+
+async def embed_query_cached(query: str):
+    key = normalize_query(query)
+    vector = await query_embedding_cache.aget(key)
+    if vector is None:
+        # Non-blocking: the event loop serves other requests during the round-trip
+        vector = await embeddings.aembed_query(key)
+        await query_embedding_cache.aset(key, vector)
+    return vector
+
+def rendition_keys(renditions):
+    renditions = renditions or {}
+    sprite = renditions.get("sprite") or {}
+    keys = [renditions.get("proxy"), renditions.get("hls"), sprite.get("key"), sprite.get("vtt")]
+    return keys + [preview["key"] for preview in renditions.get("previews", [])]
+
+def rendition_urls(renditions, signed):
+    """
+    Signed URLs of the proxy, HLS playlist, chapter previews ({start_sec: url}) and sprite sheet.
+    HLS segments are fetched relative to the playlist, so HLS needs CDN mode (signed cookies,
+    see get_hls_cookies): a signed playlist URL does not cover its segments.
+    """
+    renditions = renditions or {}
+    sprite = renditions.get("sprite") or {}
+    return {
+        "proxy_url": signed.get(renditions.get("proxy")) or None,
+        "sprite": {
+            "url": signed.get(sprite["key"]) or None,
+            "vtt_url": signed.get(sprite.get("vtt")) or None,
+            "tile_width": sprite["tile_width"],
+            "tile_height": sprite["tile_height"]
+        } if sprite.get("key") else None,
+        "hls_url": (signed.get(renditions.get("hls")) or None) if url_signer.cdn_mode else None,
+        "previews": {p["start_sec"]: signed.get(p["key"]) for p in renditions.get("previews", [])}
+    }
+
+def chapters_with_thumbnails(video):
+    """
+    Each chapter + the position of its tile in the sprite sheet ("thumbnail": {"x", "y"}),
+    so a result grid renders every chapter from ONE image.
+    """
+    thumbnails = {t["start_sec"]: t for t in (video.renditions or {}).get("thumbnails", [])}
+    chapters = []
+    for chapter in video.chapters or []:
+        # Precomputed at ingestion; parsed only for videos processed before that
+        start = chapter.get("start_sec")
+        if start is None:
+            start = parse_timestamp(chapter.get("timestamp", ""))
+        tile = thumbnails.get(start)
+        chapters.append({**chapter, "start_sec": start, "thumbnail": {"x": tile["x"], "y": tile["y"]} if tile else None})
+    return chapters
+
+@app.get("/metrics")
+def prometheus_metrics():
+    body, content_type = metrics.render_latest()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/search/cache-stats")
+def search_cache_stats():
+    return {
+        "search_results": search_result_cache.stats(),
+        "query_embedding": query_embedding_cache.stats(),
+        "playback_urls": url_signer.stats()
+    }
+
+async def find_results(search: SearchQuery, user_id: str, db: AsyncSession):
+    """
+    The uncached part of /search: embedding, retrieval, hydration.
+    Returns JSON-ready results WITHOUT urls (they are signed per request, see attach_urls).
+    """
+    # 1. Get the query vector (Semantic Match)
+    with metrics.search_phase("embed"):
+        query_vector = await embed_query_cached(search.query)
     
-    # Get top 5 semantically similar videos
-    # We also fetch the 'distance' (similarity score) to filter bad results later
-    results = db.query(models.Video).order_by(
-        models.Video.embedding.cosine_distance(query_vector)
-    ).limit(5).all()
+    # 2. Hybrid retrieval: vector + full-text, fused with RRF in SQL (see search.py)
+    with metrics.search_phase("retrieve"):
+        hits = await hybrid_search(db, search.query, query_vector, search.limit, user_id, search.tags)
+    ranked_ids = [hit.video_id for hit in hits]
+    if not ranked_ids:
+        return []
     
-    response = []
-    bucket_name = os.getenv("AWS_BUCKET_NAME")
+    with metrics.search_phase("hydrate"):
+        result = await db.execute(
+            select(models.Video).options(*HEAVY_COLUMNS)
+            .where(models.Video.id.in_(ranked_ids))
+        )
+        videos_by_id = {v.id: v for v in result.scalars().all()}
+        moments_by_video = await best_moments(db, ranked_ids, query_vector)
     
-    for video in results:
-        # A. Generate URL
-        try:
-            playback_url = s3_client.generate_presigned_url(
-                'get_object',
-                Params={'Bucket': bucket_name, 'Key': video.s3_key},
-                ExpiresIn=3600
-            )
-        except: playback_url = ""
-
-        # B. Smart Hit Logic (Keyword match in Chapters)
-        best_timestamp = "00:00"
-        match_type = "semantic" # Default: just a general topic match
-        query_lower = search.query.lower()
-        
-        if video.chapters:
-            for c in video.chapters:
-                # Check if search term exists in chapter label
-                if query_lower in c.get('label', '').lower():
-                    best_timestamp = c.get('timestamp', "00:00")
-                    match_type = "chapter" # Upgrade: Specific chapter match!
-                    break
-
-        response.append({
+    results = []
+    for hit in hits:
+        video = videos_by_id.get(hit.video_id)
+        if not video:
+            continue
+
+        # Jump straight to the best-matching moment
+        moments = moments_by_video.get(video.id, [])
+        for moment in moments:
+            moment["start_at"] = format_timestamp(moment["start_sec"])
+        best_timestamp = moments[0]["start_at"] if moments else "00:00"
+
+        results.append({
             "id": video.id,
             "title": video.title,
             "description": (video.transcript_summary or "")[:200] + "...",
             "visuals": (video.visual_summary or "")[:100] + "...",
-            "chapters": video.chapters or [],
+            "chapters": chapters_with_thumbnails(video),
             "s3_key": video.s3_key,
-            "playback_url": playback_url,
+            "renditions": video.renditions,
             "start_at": best_timestamp,
-            "match_type": match_type # Send this to frontend
+            "moments": moments,
+            "score": round(float(hit.score), 6),
+            "match_type": match_type(hit.semantic_rank, hit.lexical_rank) # Send this to frontend
         })
+    return results
 
-    # 2. THE RE-RANKING FIX
-    # We sort the list in Python before sending it back.
-    # Logic: If match_type is 'chapter' (Jump available), it goes to the TOP.
-    response.sort(key=lambda x: 0 if x['match_type'] == 'chapter' else 1)
+def attach_urls(results):
+    """
+    Signs every URL of the results in one batch (cached, see url_signer.py): originals + renditions.
+    Builds new dicts: 'results' may be shared with the result cache.
+    """
+    signed = url_signer.sign_many(
+        [r["s3_key"] for r in results] + [key for r in results for key in rendition_keys(r["renditions"])]
+    )
+    response = []
+    for result in results:
+        result = dict(result)
+        renditions = rendition_urls(result.pop("renditions"), signed)
+        # Hover a moment: its preview clip
+        result["moments"] = [
+            {**moment, "preview_url": renditions["previews"].get(moment["start_sec"])}
+            for moment in result["moments"]
+        ]
+        result.update({
+            "playback_url": signed.get(result["s3_key"], ""), # The original upload (full quality)
+            "proxy_url": renditions["proxy_url"], # Faststart, low bitrate: use it for start_at jumps
+            "hls_url": renditions["hls_url"],
+            "sprite": renditions["sprite"],
+            "previews": [
+                {"start_at": format_timestamp(start), "url": url}
+                for start, url in sorted(renditions["previews"].items()) if url
+            ]
+        })
+        response.append(result)
+    return response
 
+@app.post("/search")
+async def search_videos(
+    search: SearchQuery, user_id: str = Depends(current_user_id), db: AsyncSession = Depends(get_async_db)
+):
+    print(f"🔍 Searching for: {search.query}")
+    started = time.perf_counter()
+
+    # Popular queries are answered from the result cache: no embedding call, no SQL
+    # (the key carries the library version, see search_cache.py)
+    cache_key = await search_result_cache.key(db, user_id, search.query, search.limit, search.tags)
+    results = await search_result_cache.aget(cache_key)
+    outcome = "hit" if results is not None else "miss"
+    if results is None:
+        results = await find_results(search, user_id, db)
+        await search_result_cache.aset(cache_key, results)
+
+    with metrics.search_phase("sign_urls"):
+        response = attach_urls(results)
+    search_result_cache.observe(outcome, time.perf_counter() - started)
     return response
 
 class VideoIDList(BaseModel):
     ids: list[int]
 
 @app.post("/videos/urls")
-def get_video_urls(video_ids: VideoIDList, db: Session = Depends(get_db)):
+async def get_video_urls(
+    video_ids: VideoIDList, user_id: str = Depends(current_user_id), db: AsyncSession = Depends(get_async_db)
+):
     """
     Takes a list of video IDs and returns a dictionary of signed playback URLs.
     This is much more efficient than fetching all video data.
+    Other users' videos are left out.
     """
-    urls = {}
-    bucket_name = os.getenv("AWS_BUCKET_NAME")
+    # Only the columns we need, then one batch through the URL cache
+    result = await db.execute(
+        select(models.Video.id, models.Video.s3_key)
+        .where(models.Video.id.in_(video_ids.ids), models.Video.user_id == user_id)
+    )
+    rows = result.all()
+    signed = url_signer.sign_many([row.s3_key for row in rows])
     
-    videos = db.query(models.Video).filter(models.Video.id.in_(video_ids.ids)).all()
-    
-    for video in videos:
-        try:
-            url = s3_client.generate_presigned_url(
-                'get_object',
-                Params={'Bucket': bucket_name, 'Key': video.s3_key},
-                ExpiresIn=3600 # URLs are valid for 1 hour
-            )
-            urls[video.id] = url
-        except Exception as e:
-            print(f"Error signing URL for video {video.id}: {e}")
-            urls[video.id] = None
-            
-    return urls
\ No newline at end of file
+    return {row.id: signed.get(row.s3_key) or None for row in rows}
+
+@app.get("/videos/{video_id}/hls/cookies")
+def get_hls_cookies(video_id: int, response: Response, user_id: str = Depends(current_user_id), db: Session = Depends(get_db)):
+    """
+    CDN mode only: sets the CloudFront signed cookies for the HLS segments of ONE
+    of the caller's videos (every other playback URL is signed on its own).
+    """
+    video = db.query(models.Video.renditions).filter(
+        models.Video.id == video_id, models.Video.user_id == user_id
+    ).first()
+    if not video:
+        raise HTTPException(status_code=404, detail="Video not found")
+    playlist = (video.renditions or {}).get("hls")
+    if not playlist:
+        raise HTTPException(status_code=404, detail="No HLS rendition")
+    cookies = url_signer.signed_cookies(playlist.rsplit("/", 1)[0] + "/")
+    if not cookies:
+        raise HTTPException(status_code=404, detail="CDN signed cookies are not configured")
+    expires_at = cookies.pop("expires_at")
+    path = cookies.pop("path")
+    for name, value in cookies.items():
+        response.set_cookie(
+            name, value,
+            expires=expires_at,
+            path=path,
+            domain=os.getenv("CDN_COOKIE_DOMAIN"),
+            secure=True, httponly=True, samesite="none"
+        )
+    return {"expires_at": expires_at.isoformat()}
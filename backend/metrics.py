@@ -0,0 +1,184 @@
+"""
+Prometheus metrics + structured timing spans for the API and the worker.
+
+    with stage("transcode"):
+        ...
+
+records the duration in codex_ingest_stage_seconds{stage="transcode"} and
+prints one JSON line per span, tagged with the video being processed
+(see start_job), so logs can be grepped/aggregated per video.
+
+The API serves the metrics at GET /metrics. The worker serves them on
+WORKER_METRICS_PORT (see worker.py). With several uvicorn processes, set
+PROMETHEUS_MULTIPROC_DIR so /metrics aggregates all of them.
+"""
+import os
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from prometheus_client import Counter, Histogram, CollectorRegistry, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import multiprocess
+
+# --- METRICS ---
+STAGE_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 3600)
+
+INGEST_STAGE_SECONDS = Histogram(
+    "codex_ingest_stage_seconds", "Duration of each ingestion stage", ["stage", "status"],
+    buckets=STAGE_BUCKETS
+)
+INGEST_SECONDS = Histogram(
+    "codex_ingest_seconds", "End-to-end duration of process_video_task", ["outcome"],
+    buckets=STAGE_BUCKETS
+)
+INGEST_JOBS = Counter("codex_ingest_jobs_total", "Finished ingestion jobs", ["outcome"])
+GEMINI_TOKENS = Counter("codex_gemini_tokens_total", "Gemini tokens", ["model", "kind"])
+GEMINI_TOKENS_PER_VIDEO = Histogram(
+    "codex_gemini_tokens_per_video", "Total Gemini tokens spent on one video",
+    buckets=(1e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2e6, 5e6)
+)
+JSON_PARSES = Counter(
+    "codex_json_parses_total", "How AI answers were parsed (strict, repaired, partial, followup, failed)", ["method"]
+)
+DOWNLOAD_BYTES = Counter("codex_s3_download_bytes_total", "Bytes read from S3 by the worker")
+DOWNLOAD_THROUGHPUT = Histogram(
+    "codex_s3_download_bytes_per_second", "S3 download throughput per job",
+    buckets=(1e6, 5e6, 1e7, 2.5e7, 5e7, 1e8, 2.5e8, 5e8)
+)
+EMBED_BATCH_SIZE = Histogram(
+    "codex_embed_batch_size", "Texts per embed_documents call (shared by the worker slots)",
+    buckets=(1, 2, 5, 10, 20, 50, 100)
+)
+SEARCH_PHASE_SECONDS = Histogram(
+    "codex_search_phase_seconds", "Latency of each /search phase", ["phase"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+SEARCH_SECONDS = Histogram(
+    "codex_search_seconds", "/search latency by result cache outcome (hit, miss)", ["cache"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+HTTP_SECONDS = Histogram(
+    "codex_http_request_seconds", "API request latency", ["method", "route", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+
+
+# --- PER-VIDEO CONTEXT ---
+# Set by process_video_task. Spans and token usage recorded from any thread that
+# inherited the context (asyncio tasks, asyncio.to_thread, run_in_context) are
+# tagged with the video and added to its token tally.
+_current_job = contextvars.ContextVar("current_job", default=None)
+
+class JobUsage:
+    def __init__(self, video_id):
+        self.video_id = video_id
+        self.tokens = 0
+        self._lock = threading.Lock()
+
+    def add(self, tokens):
+        with self._lock:
+            self.tokens += tokens
+
+def start_job(video_id):
+    job = JobUsage(video_id)
+    _current_job.set(job)
+    return job
+
+def current_video_id():
+    job = _current_job.get()
+    return job.video_id if job else None
+
+def run_in_context(pool, fn, *args):
+    """
+    pool.submit() that keeps the caller's context (so chunk threads still tally tokens).
+    """
+    ctx = contextvars.copy_context()
+    return pool.submit(ctx.run, fn, *args)
+
+
+# Callables that also receive every event (benchmarks collect the spans this way)
+_listeners = []
+
+def add_listener(fn):
+    _listeners.append(fn)
+
+
+def log_event(event, **fields):
+    fields.setdefault("video_id", current_video_id())
+    record = {"event": event, "ts": round(time.time(), 3), **fields}
+    print(json.dumps(record, default=str))
+    for fn in _listeners:
+        fn(record)
+
+
+@contextmanager
+def stage(name, **fields):
+    started = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        INGEST_STAGE_SECONDS.labels(stage=name, status=status).observe(seconds)
+        log_event("stage", stage=name, seconds=round(seconds, 3), status=status, **fields)
+
+
+def observe_stage(name, seconds, **fields):
+    """
+    For spans that cannot be a 'with' block (e.g. concurrent poll waits).
+    """
+    INGEST_STAGE_SECONDS.labels(stage=name, status="ok").observe(seconds)
+    log_event("stage", stage=name, seconds=round(seconds, 3), status="ok", **fields)
+
+
+def record_counted_tokens(model_name, tokens):
+    GEMINI_TOKENS.labels(model=model_name, kind="counted").inc(tokens)
+
+
+def record_usage(model_name, response):
+    """
+    Token usage reported by generate_content (usage_metadata).
+    """
+    usage = getattr(response, "usage_metadata", None)
+    if not usage:
+        return 0
+    prompt = getattr(usage, "prompt_token_count", 0) or 0
+    output = getattr(usage, "candidates_token_count", 0) or 0
+    total = getattr(usage, "total_token_count", 0) or (prompt + output)
+    GEMINI_TOKENS.labels(model=model_name, kind="prompt").inc(prompt)
+    GEMINI_TOKENS.labels(model=model_name, kind="output").inc(output)
+    job = _current_job.get()
+    if job is not None:
+        job.add(total)
+    log_event("gemini_usage", model=model_name, prompt_tokens=prompt, output_tokens=output, total_tokens=total)
+    return total
+
+
+@contextmanager
+def search_phase(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        SEARCH_PHASE_SECONDS.labels(phase=name).observe(time.perf_counter() - started)
+
+
+def record_download(stats):
+    DOWNLOAD_BYTES.inc(stats.bytes)
+    if stats.bytes_per_sec:
+        DOWNLOAD_THROUGHPUT.observe(stats.bytes_per_sec)
+
+
+def render_latest():
+    """
+    (body, content_type) for a /metrics response.
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -1,8 +1,18 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, JSON
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, JSON, ForeignKey, Index, Float, Computed, text
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.sql import func
 from database import Base
 from pgvector.sqlalchemy import Vector
 
+# Generated tsvector behind the lexical half of /search (see search.py)
+VIDEO_SEARCH_TSV = """
+    setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(jsonb_path_query_array(chapters::jsonb, '$[*].label')::text, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(tags::text, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(visual_summary, '')), 'B') ||
+    setweight(to_tsvector('english', coalesce(transcript_summary, '')), 'C')
+"""
+
 class Video(Base):
     __tablename__ = "videos"
 
@@ -14,6 +24,22 @@ class Video(Base):
     
     # AI Processing Status
     processed = Column(Boolean, default=False)
+
+    # Streaming hash of the uploaded bytes ("sha256:..." / "blake3:...").
+    # Re-uploads of the same file reuse the analysis of the first one.
+    content_hash = Column(String(80), nullable=True, index=True)
+    # Size + first/last MB (s3_stream.quick_fingerprint): a duplicate candidate found BEFORE FFmpeg
+    source_fingerprint = Column(String(80), nullable=True, index=True)
+
+    # Ingestion checkpoint (see checkpoints.py): last completed stage and what it produced
+    # (probe, transcoded S3 keys, Gemini file names, analysis JSON), so a retry resumes there.
+    ingest_stage = Column(String(20), nullable=True)
+    ingest_state = Column(JSON, nullable=True)
+
+    # Playback renditions in S3 (see renditions.py):
+    # {"proxy": key, "previews": [{"start_sec": 135, "key": key}], "hls": key,
+    #  "sprite": {"key", "vtt", "index", "interval", "columns", ...}, "thumbnails": [{"start_sec": 135, "x": 320, "y": 90}]}
+    renditions = Column(JSON, nullable=True)
     
     # --- 1. THE CONTENT ---
     # The detailed spoken content (Audio)
@@ -33,5 +59,149 @@ class Video(Base):
     # --- 4. THE BRAIN ---
     # Vector embedding of ALL the above combined
     embedding = Column(Vector(768)) 
+
+    # Lexical half of /search (see search.py): filled by Postgres, never written by us
+    search_tsv = Column(TSVECTOR, Computed(VIDEO_SEARCH_TSV, persisted=True))
     
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
\ No newline at end of file
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class IngestionJob(Base):
+    """
+    One row per ingestion request. Workers (worker.py) claim rows with
+    SELECT ... FOR UPDATE SKIP LOCKED, so the queue survives API restarts
+    and can be drained by any number of machines.
+    """
+    __tablename__ = "ingestion_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    video_id = Column(Integer, ForeignKey("videos.id", ondelete="CASCADE"), index=True)
+    s3_key = Column(String)
+
+    # queued -> running -> done | failed (running jobs go back to queued on retry)
+    status = Column(String, default="queued", index=True)
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=5)
+
+    # Retry backoff: the job is invisible to workers until this time
+    run_after = Column(DateTime(timezone=True), server_default=func.now())
+
+    # --- LEASE ---
+    # A running job belongs to 'locked_by' until 'lease_expires_at'.
+    # Workers extend the lease with heartbeats; a crashed worker's job is reclaimed.
+    locked_by = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+
+    last_error = Column(Text, nullable=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        # The claim query filters on status and orders by run_after
+        Index("ix_ingestion_jobs_status_run_after", "status", "run_after"),
+    )
+
+
+class VideoSegment(Base):
+    """
+    One searchable moment of a video (a chapter, or the whole video if the AI
+    returned no chapters). Each row has its own vector, so long lectures are
+    not squeezed into a single truncated embedding.
+    Also THE typed chapter table: integer seconds, indexed per video, so
+    "which chapter plays at 41:10" or "chapters between 40:00 and 50:00" are
+    index seeks instead of scans of the chapters JSON (see search.chapter_at).
+    """
+    __tablename__ = "video_segments"
+
+    id = Column(Integer, primary_key=True, index=True)
+    video_id = Column(Integer, ForeignKey("videos.id", ondelete="CASCADE"), index=True)
+    # Copied from the video: /search filters the ANN scan by tenant without a join
+    user_id = Column(String, nullable=True)
+
+    # Real-world position in the original video (after timestamp scaling)
+    start_sec = Column(Integer, default=0)
+    end_sec = Column(Integer, nullable=True) # None = until the end of the video
+
+    label = Column(String, nullable=True)
+    content = Column(Text, nullable=True) # The text that was embedded
+    embedding = Column(Vector(768))
+
+    __table_args__ = (
+        # Chapter lookups by time (GET /videos/{id}/chapters)
+        Index("ix_video_segments_video_id_start_sec", "video_id", "start_sec"),
+        # Per-tenant search: a small tenant's segments are ranked exactly from this index
+        Index("ix_video_segments_user_id_video_id", "user_id", "video_id"),
+        # ANN index: /search orders by cosine distance over ALL segments
+        Index(
+            "ix_video_segments_embedding_hnsw", "embedding",
+            postgresql_using="hnsw",
+            postgresql_with={"m": 16, "ef_construction": 64},
+            postgresql_ops={"embedding": "vector_cosine_ops"}
+        ),
+    )
+
+
+
+class RateLimitBucket(Base):
+    """
+    Shared token bucket state for RATE_LIMIT_BACKEND=postgres (see rate_limiter.py).
+    One row per bucket, e.g. "gemini-flash-latest:tpm".
+    """
+    __tablename__ = "rate_limit_buckets"
+
+    name = Column(String, primary_key=True)
+    tokens = Column(Float, nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False)
+
+
+class LibraryVersion(Base):
+    """
+    Counter bumped whenever the searchable library changes (see search_cache.py).
+    Cached /search results of an older version are never served again.
+    """
+    __tablename__ = "library_versions"
+
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+# --- SCHEMA UPGRADES ---
+# create_all() only creates missing TABLES. Columns/indexes added to existing
+# tables are listed here and applied at startup (every statement is idempotent).
+SCHEMA_UPGRADES = [
+    "ALTER TABLE videos ADD COLUMN IF NOT EXISTS content_hash VARCHAR(80)",
+    "CREATE INDEX IF NOT EXISTS ix_videos_content_hash ON videos (content_hash)",
+    "ALTER TABLE videos ADD COLUMN IF NOT EXISTS source_fingerprint VARCHAR(80)",
+    "CREATE INDEX IF NOT EXISTS ix_videos_source_fingerprint ON videos (source_fingerprint)",
+    f"ALTER TABLE videos ADD COLUMN IF NOT EXISTS search_tsv tsvector GENERATED ALWAYS AS ({VIDEO_SEARCH_TSV}) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_videos_search_tsv ON videos USING gin (search_tsv)",
+    "CREATE INDEX IF NOT EXISTS ix_videos_created_at_id ON videos (created_at, id)",
+    "ALTER TABLE videos ADD COLUMN IF NOT EXISTS ingest_stage VARCHAR(20)",
+    "ALTER TABLE videos ADD COLUMN IF NOT EXISTS ingest_state JSON",
+    "ALTER TABLE videos ADD COLUMN IF NOT EXISTS renditions JSON",
+    "CREATE INDEX IF NOT EXISTS ix_video_segments_video_id_start_sec ON video_segments (video_id, start_sec)",
+    # Multi-tenant scoping (see search.py): the column is backfilled once, when it is added
+    """
+    DO $$ BEGIN
+        IF NOT EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'video_segments' AND column_name = 'user_id'
+        ) THEN
+            ALTER TABLE video_segments ADD COLUMN user_id VARCHAR;
+            UPDATE video_segments s SET user_id = v.user_id FROM videos v WHERE v.id = s.video_id;
+        END IF;
+    END $$
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_video_segments_user_id_video_id ON video_segments (user_id, video_id)",
+    # Per-user listings, newest first (keyset on created_at, id)
+    "CREATE INDEX IF NOT EXISTS ix_videos_user_id_created_at_id ON videos (user_id, created_at, id)",
+    # Tag filters: tags::jsonb @> '["react"]'
+    "CREATE INDEX IF NOT EXISTS ix_videos_tags_gin ON videos USING gin ((tags::jsonb) jsonb_path_ops)",
+]
+
+def init_db(engine):
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for statement in SCHEMA_UPGRADES:
+            conn.execute(text(statement))
@@ -0,0 +1,200 @@
+"""
+Token buckets for Gemini quotas (requests/min and tokens/min, per model).
+
+Every generate_content call reserves 1 request + its counted tokens BEFORE it
+is sent. If no model has room, the caller waits exactly as long as the
+emptiest bucket needs to refill instead of finding out through a 429.
+
+RATE_LIMIT_BACKEND=memory   (default) one set of buckets per worker process
+RATE_LIMIT_BACKEND=postgres buckets live in the 'rate_limit_buckets' table and
+                            are shared by every worker on every machine
+"""
+import os
+import json
+import time
+import threading
+from datetime import datetime, timezone
+import models
+from database import SessionLocal
+from job_queue import PermanentJobError
+
+# --- CONFIGURATION ---
+# Per-model limits. Override with GEMINI_QUOTAS='{"model": {"rpm": 15, "tpm": 1000000}}'
+DEFAULT_QUOTAS = {
+    "gemini-flash-latest": {"rpm": 10, "tpm": 250000},
+    "gemini-robotics-er-1.5-preview": {"rpm": 10, "tpm": 250000},
+}
+QUOTAS = {**DEFAULT_QUOTAS, **json.loads(os.getenv("GEMINI_QUOTAS", "{}"))}
+BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+
+
+class QuotaExceededError(PermanentJobError):
+    """
+    The request is larger than the tokens/min quota of every model: no amount of waiting admits it.
+    """
+
+
+class TokenBucket:
+    """
+    Classic token bucket: holds up to 'capacity' tokens, refills 'capacity' per 'period' seconds.
+    """
+    def __init__(self, name, capacity, period=60.0):
+        self.name = name
+        self.capacity = float(capacity)
+        self.rate = self.capacity / period # Tokens per second
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """
+        Seconds until 'amount' tokens are available (0 = now). Infinite if it can never fit.
+        """
+        self._refill(now)
+        if amount > self.capacity:
+            return float("inf")
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount):
+        self.tokens -= amount
+
+    def drain(self):
+        # The server said 429: trust it over our own bookkeeping
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+
+
+class MemoryQuota:
+    """
+    requests/min + tokens/min buckets of one model, shared by all threads of this process.
+    """
+    def __init__(self, model_name, rpm, tpm):
+        self.model_name = model_name
+        self.requests = TokenBucket(f"{model_name}:rpm", rpm)
+        self.tokens = TokenBucket(f"{model_name}:tpm", tpm)
+        self._lock = threading.Lock()
+
+    def reserve(self, token_count):
+        """
+        Takes 1 request + token_count tokens if BOTH buckets have room.
+        Returns 0.0 on success, otherwise the seconds to wait before asking again.
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(token_count, now))
+            if wait == 0.0:
+                self.requests.take(1)
+                self.tokens.take(token_count)
+            return wait
+
+    def drain(self):
+        with self._lock:
+            self.requests.drain()
+            self.tokens.drain()
+
+
+class PostgresQuota:
+    """
+    Same contract as MemoryQuota, but the bucket state is a row per bucket in
+    'rate_limit_buckets', locked with SELECT ... FOR UPDATE for the few
+    milliseconds of the check. All workers share one quota.
+    """
+    def __init__(self, model_name, rpm, tpm):
+        self.model_name = model_name
+        self.limits = {f"{model_name}:rpm": float(rpm), f"{model_name}:tpm": float(tpm)}
+
+    def _locked_rows(self, db):
+        rows = {}
+        for name, capacity in self.limits.items():
+            row = db.query(models.RateLimitBucket).filter(
+                models.RateLimitBucket.name == name
+            ).with_for_update().first()
+            if not row:
+                row = models.RateLimitBucket(name=name, tokens=capacity, updated_at=datetime.now(timezone.utc))
+                db.add(row)
+                db.flush()
+            rows[name] = row
+        return rows
+
+    def reserve(self, token_count):
+        amounts = {f"{self.model_name}:rpm": 1, f"{self.model_name}:tpm": token_count}
+        db = SessionLocal()
+        try:
+            rows = self._locked_rows(db)
+            now = datetime.now(timezone.utc)
+            wait = 0.0
+            for name, row in rows.items():
+                capacity = self.limits[name]
+                rate = capacity / 60.0
+                # Refill for the time since the last writer
+                row.tokens = min(capacity, row.tokens + (now - row.updated_at).total_seconds() * rate)
+                row.updated_at = now
+                if amounts[name] > capacity:
+                    wait = float("inf")
+                elif row.tokens < amounts[name]:
+                    wait = max(wait, (amounts[name] - row.tokens) / rate)
+            if wait == 0.0:
+                for name, row in rows.items():
+                    row.tokens -= amounts[name]
+            db.commit()
+            return wait
+        finally:
+            db.close()
+
+    def drain(self):
+        db = SessionLocal()
+        try:
+            for row in self._locked_rows(db).values():
+                row.tokens = 0.0
+                row.updated_at = datetime.now(timezone.utc)
+            db.commit()
+        finally:
+            db.close()
+
+
+def quota_limits(model_name):
+    return QUOTAS.get(model_name, {"rpm": 10, "tpm": 250000})
+
+
+_quotas = {}
+_quotas_lock = threading.Lock()
+
+def get_quota(model_name):
+    with _quotas_lock:
+        if model_name not in _quotas:
+            limits = quota_limits(model_name)
+            quota_class = PostgresQuota if BACKEND == "postgres" else MemoryQuota
+            _quotas[model_name] = quota_class(model_name, limits["rpm"], limits["tpm"])
+        return _quotas[model_name]
+
+
+def acquire_model(model_names, token_count, max_wait=600.0):
+    """
+    Picks the first model (in preference order) whose quota admits the request
+    right now. If none does, sleeps until the soonest one refills.
+    Models whose tokens/min limit is smaller than the request are skipped;
+    if that is all of them, raises QuotaExceededError (retrying cannot help).
+    Returns the model name, or None if nothing fits within max_wait.
+    """
+    deadline = time.monotonic() + max_wait
+    while True:
+        waits = {}
+        for name in model_names:
+            wait = get_quota(name).reserve(token_count)
+            if wait == 0.0:
+                return name
+            waits[name] = wait
+
+        soonest = min(waits.values())
+        if soonest == float("inf"):
+            limits = ", ".join(f"{name}: {quota_limits(name)['tpm']}" for name in model_names)
+            raise QuotaExceededError(f"Request of {token_count} tokens exceeds the tokens/min quota ({limits}).")
+        if time.monotonic() + soonest > deadline:
+            return None
+        print(f"⏳ Quota full for {', '.join(model_names)}. Waiting {soonest:.1f}s for a slot...")
+        time.sleep(soonest)
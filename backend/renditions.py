@@ -0,0 +1,218 @@
+"""
+Playback renditions, so the frontend never streams the original upload for a preview:
+
+    renditions/<video_id>/proxy.mp4              low-bitrate, faststart (moov first) MP4
+    renditions/<video_id>/previews/<sec>.mp4     a few silent seconds from each chapter start
+    renditions/<video_id>/hls/index.m3u8         optional (RENDITION_HLS=1), cut from the proxy
+    renditions/<video_id>/sprite.jpg             ONE image: a grid of small frames across the video
+    renditions/<video_id>/sprite.vtt, .json      which tile shows which second
+
+- The proxy is one more output of the ingestion FFmpeg pass (see transcode_cmd in
+  decoupling.py): no extra decode of the source.
+- The sprite sheet comes out of that same pass too. Chapter thumbnails are tiles of
+  it (see tile_at), so a result grid needs one image request per video.
+- Previews need the chapters, so they are cut from the proxy after the analysis.
+  The proxy has a keyframe every PROXY_KEYFRAME_SECONDS, so every cut is a short seek.
+- Videos.renditions holds the keys: {"proxy", "previews": [{"start_sec", "key"}], "hls",
+  "sprite": {"key", "vtt", "index", ...layout}, "thumbnails": [{"start_sec", "x", "y"}]}.
+"""
+import os
+import math
+import json
+import subprocess
+
+# --- CONFIGURATION ---
+RENDITION_PREFIX = os.getenv("RENDITION_PREFIX", "renditions/")
+PROXY_HEIGHT = int(os.getenv("PROXY_HEIGHT", "480"))
+PROXY_VIDEO_BITRATE = os.getenv("PROXY_VIDEO_BITRATE", "800k")
+PROXY_KEYFRAME_SECONDS = 2 # Seek granularity, and HLS segments cut on keyframes
+PREVIEW_SECONDS = float(os.getenv("PREVIEW_SECONDS", "6"))
+PREVIEW_HEIGHT = int(os.getenv("PREVIEW_HEIGHT", "240"))
+PREVIEW_VIDEO_BITRATE = os.getenv("PREVIEW_VIDEO_BITRATE", "300k") # ~6s -> ~225 KB
+RENDITION_HLS = os.getenv("RENDITION_HLS", "0") == "1"
+HLS_SEGMENT_SECONDS = 6
+SPRITE_COLUMNS = 10
+SPRITE_ROWS = 10 # 100 tiles: a 1600x900 JPEG of a few dozen KB
+SPRITE_TILE_WIDTH = 160
+SPRITE_TILE_HEIGHT = 90
+SPRITE_MIN_INTERVAL = float(os.getenv("SPRITE_MIN_INTERVAL", "2")) # Short videos: a tile every N seconds at most
+
+CONTENT_TYPES = {
+    ".mp4": "video/mp4", ".m3u8": "application/vnd.apple.mpegurl", ".ts": "video/mp2t",
+    ".jpg": "image/jpeg", ".vtt": "text/vtt", ".json": "application/json"
+}
+
+
+def proxy_path(work_path):
+    return f"{os.path.splitext(work_path)[0]}_proxy.mp4"
+
+def rendition_key(video_db_id, name):
+    return f"{RENDITION_PREFIX}{video_db_id}/{name}"
+
+def proxy_filter(label_in, label_out):
+    # Never upscale: small sources keep their height
+    return f"[{label_in}]scale=-2:'min({PROXY_HEIGHT},ih)'[{label_out}]"
+
+def proxy_output_args(label, has_audio, threads, path):
+    """
+    FFmpeg output options for the proxy, appended to the ingestion pass.
+    """
+    args = ['-map', f'[{label}]']
+    if has_audio:
+        args += ['-map', '0:a:0', '-c:a', 'aac', '-b:a', '96k']
+    return args + [
+        '-c:v', 'libx264', '-preset', 'veryfast',
+        '-b:v', PROXY_VIDEO_BITRATE, '-maxrate', PROXY_VIDEO_BITRATE, '-bufsize', PROXY_VIDEO_BITRATE,
+        '-force_key_frames', f'expr:gte(t,n_forced*{PROXY_KEYFRAME_SECONDS})',
+        '-movflags', '+faststart', # moov atom first: playback starts before the download ends
+        '-threads', threads,
+        path
+    ]
+
+def sprite_path(work_path):
+    return f"{os.path.splitext(work_path)[0]}_sprite.jpg"
+
+def sprite_layout(duration_sec):
+    """
+    The grid for a video: one tile every 'interval' seconds, the whole video in ONE sheet.
+    """
+    tiles = SPRITE_COLUMNS * SPRITE_ROWS
+    interval = max(SPRITE_MIN_INTERVAL, (duration_sec or 7200) / tiles)
+    return {
+        "interval": round(interval, 3),
+        "columns": SPRITE_COLUMNS,
+        "rows": SPRITE_ROWS,
+        "tile_width": SPRITE_TILE_WIDTH,
+        "tile_height": SPRITE_TILE_HEIGHT,
+        "frames": min(tiles, max(1, math.ceil((duration_sec or 0) / interval)))
+    }
+
+def sprite_filter(label_in, label_out, layout):
+    """
+    fps -> letterboxed fixed-size tiles -> one tiled frame (so every tile has a known position).
+    """
+    w, h = layout["tile_width"], layout["tile_height"]
+    return (
+        f"[{label_in}]fps=1/{layout['interval']},"
+        f"scale={w}:{h}:force_original_aspect_ratio=decrease,pad={w}:{h}:(ow-iw)/2:(oh-ih)/2,"
+        f"tile={layout['columns']}x{layout['rows']}[{label_out}]"
+    )
+
+def sprite_output_args(label, path):
+    return ['-map', f'[{label}]', '-frames:v', '1', '-q:v', '5', path]
+
+def tile_at(layout, second):
+    """
+    (x, y) of the tile showing 'second'.
+    """
+    index = min(int(max(second, 0) // layout["interval"]), layout["frames"] - 1)
+    return (index % layout["columns"]) * layout["tile_width"], (index // layout["columns"]) * layout["tile_height"]
+
+def sprite_index(layout, image_name):
+    """
+    The same index twice: WebVTT (players' thumbnail tracks, '#xywh=' fragments)
+    and JSON (the result grid).
+    """
+    w, h = layout["tile_width"], layout["tile_height"]
+    frames = []
+    cues = ["WEBVTT", ""]
+    for i in range(layout["frames"]):
+        start = i * layout["interval"]
+        x, y = tile_at(layout, start)
+        frames.append({"t": round(start, 3), "x": x, "y": y})
+        cues += [
+            f"{vtt_time(start)} --> {vtt_time(start + layout['interval'])}",
+            f"{image_name}#xywh={x},{y},{w},{h}",
+            ""
+        ]
+    return "\n".join(cues), json.dumps({"image": image_name, **layout, "tiles": frames})
+
+def chapter_thumbnails(layout, starts):
+    """
+    One tile per chapter start: [{"start_sec", "x", "y"}] (w/h are the layout's tile size).
+    """
+    thumbnails = []
+    for start in sorted(set(int(s) for s in starts)):
+        x, y = tile_at(layout, start)
+        thumbnails.append({"start_sec": start, "x": x, "y": y})
+    return thumbnails
+
+def vtt_time(seconds):
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    return f"{int(hours):02d}:{int(minutes):02d}:{secs:06.3f}"
+
+def publish_sprite(s3_client, bucket_name, video_db_id, sprite, duration_sec):
+    """
+    Uploads the sheet and its VTT/JSON index. Returns the 'sprite' entry of videos.renditions.
+    """
+    layout = sprite_layout(duration_sec)
+    vtt, index = sprite_index(layout, "sprite.jpg") # Relative: next to the VTT/JSON
+    keys = {"key": upload(s3_client, bucket_name, sprite, rendition_key(video_db_id, "sprite.jpg"))}
+    for name, body, extension in (("vtt", vtt, ".vtt"), ("index", index, ".json")):
+        keys[name] = rendition_key(video_db_id, f"sprite{extension}")
+        s3_client.put_object(Bucket=bucket_name, Key=keys[name], Body=body.encode(), ContentType=CONTENT_TYPES[extension])
+    return {**keys, **layout}
+
+def upload(s3_client, bucket_name, path, key):
+    content_type = CONTENT_TYPES.get(os.path.splitext(path)[1], "application/octet-stream")
+    s3_client.upload_file(path, bucket_name, key, ExtraArgs={"ContentType": content_type})
+    return key
+
+def cut_previews(ffmpeg_exe, proxy, starts, out_dir):
+    """
+    One short, silent, low-bitrate clip per start second. Returns [(start_sec, path)].
+    """
+    clips = []
+    for start in sorted(set(int(s) for s in starts)):
+        path = os.path.join(out_dir, f"preview_{start}.mp4")
+        subprocess.run([
+            ffmpeg_exe, '-y',
+            '-ss', str(start), # Input seek: jumps to the keyframe before 'start'
+            '-i', proxy,
+            '-t', str(PREVIEW_SECONDS),
+            '-an', '-vf', f"scale=-2:'min({PREVIEW_HEIGHT},ih)'",
+            '-c:v', 'libx264', '-preset', 'veryfast', '-b:v', PREVIEW_VIDEO_BITRATE,
+            '-movflags', '+faststart',
+            path
+        ], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        clips.append((start, path))
+    return clips
+
+def segment_hls(ffmpeg_exe, proxy, out_dir):
+    """
+    VOD HLS from the proxy, without re-encoding. Returns the playlist path.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    playlist = os.path.join(out_dir, "index.m3u8")
+    subprocess.run([
+        ffmpeg_exe, '-y', '-i', proxy,
+        '-c', 'copy',
+        '-f', 'hls', '-hls_time', str(HLS_SEGMENT_SECONDS), '-hls_playlist_type', 'vod',
+        '-hls_segment_filename', os.path.join(out_dir, "seg_%05d.ts"),
+        playlist
+    ], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return playlist
+
+def publish(s3_client, bucket_name, ffmpeg_exe, video_db_id, proxy, proxy_key, starts):
+    """
+    Cuts the previews (and HLS) from the local proxy and uploads them.
+    Returns the videos.renditions value.
+    """
+    work_dir = os.path.dirname(proxy)
+    renditions = {"proxy": proxy_key, "previews": []}
+
+    for start, path in cut_previews(ffmpeg_exe, proxy, starts, work_dir):
+        key = upload(s3_client, bucket_name, path, rendition_key(video_db_id, f"previews/{start}.mp4"))
+        renditions["previews"].append({"start_sec": start, "key": key})
+        os.remove(path)
+
+    if RENDITION_HLS:
+        hls_dir = os.path.join(work_dir, "hls")
+        playlist = segment_hls(ffmpeg_exe, proxy, hls_dir)
+        for name in sorted(os.listdir(hls_dir)):
+            if name != "index.m3u8":
+                upload(s3_client, bucket_name, os.path.join(hls_dir, name), rendition_key(video_db_id, f"hls/{name}"))
+        # Playlist last: it only references segments that already exist
+        renditions["hls"] = upload(s3_client, bucket_name, playlist, rendition_key(video_db_id, "hls/index.m3u8"))
+    return renditions
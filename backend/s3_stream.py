@@ -0,0 +1,169 @@
+"""
+Parallel ranged GETs for large S3 objects.
+
+iter_object_chunks() fetches 'concurrency' parts at a time and yields them
+IN ORDER, so the consumer can write a file, hash, or pipe into FFmpeg while
+the next parts are still downloading. Memory is bounded by part_size * concurrency.
+"""
+import os
+import time
+import hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# BLAKE3 is much faster than SHA-256 on big files (pip install blake3). Optional.
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+MB = 1024 * 1024
+
+# --- CONFIGURATION ---
+PART_SIZE = int(os.getenv("S3_PART_SIZE_MB", "16")) * MB
+CONCURRENCY = int(os.getenv("S3_DOWNLOAD_CONCURRENCY", "8"))
+
+
+class TransferStats:
+    def __init__(self, total_bytes=0):
+        self.total_bytes = total_bytes
+        self.bytes = 0
+        self.started = time.monotonic()
+        self.finished = None
+
+    @property
+    def seconds(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def bytes_per_sec(self):
+        return self.bytes / self.seconds if self.seconds > 0 else 0.0
+
+    def summary(self):
+        return f"{self.bytes / MB:.1f} MB in {self.seconds:.1f}s ({self.bytes_per_sec / MB:.1f} MB/s)"
+
+
+class ContentHasher:
+    """
+    Streaming content hash, fed chunk by chunk during the download.
+    hexdigest() is prefixed with the algorithm ("blake3:..." / "sha256:...")
+    so nodes with and without blake3 never compare hashes of different kinds.
+    """
+    def __init__(self):
+        if blake3 is not None:
+            self.algorithm, self._hash = "blake3", blake3.blake3()
+        else:
+            self.algorithm, self._hash = "sha256", hashlib.sha256()
+
+    def update(self, chunk):
+        self._hash.update(chunk)
+
+    def wrap(self, chunks):
+        for chunk in chunks:
+            self.update(chunk)
+            yield chunk
+
+    def hexdigest(self):
+        return f"{self.algorithm}:{self._hash.hexdigest()}"
+
+
+def _get_range(s3_client, bucket, key, start, end):
+    response = s3_client.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end}")
+    return response["Body"].read()
+
+
+def _edges_fingerprint(size, read_range, edge_bytes):
+    digest = hashlib.sha256(str(size).encode())
+    if size:
+        digest.update(read_range(0, min(edge_bytes, size) - 1))
+        digest.update(read_range(max(size - edge_bytes, 0), size - 1))
+    return f"edges:{digest.hexdigest()}"
+
+
+def quick_fingerprint(s3_client, bucket, key, edge_bytes=MB):
+    """
+    Size + first and last 'edge_bytes', from two small ranged GETs.
+    Identical objects always have the same fingerprint, so a miss rules out a
+    duplicate without reading the object; a hit is only a candidate (confirm it
+    with the full ContentHasher digest).
+    """
+    size = s3_client.head_object(Bucket=bucket, Key=key)["ContentLength"]
+    return _edges_fingerprint(size, lambda start, end: _get_range(s3_client, bucket, key, start, end), edge_bytes)
+
+
+def file_fingerprint(path, edge_bytes=MB):
+    """
+    quick_fingerprint of a file that is already on disk (no request).
+    """
+    with open(path, "rb") as f:
+        def read_range(start, end):
+            f.seek(start)
+            return f.read(end - start + 1)
+        return _edges_fingerprint(os.path.getsize(path), read_range, edge_bytes)
+
+
+def iter_object_chunks(s3_client, bucket, key, part_size=PART_SIZE, concurrency=CONCURRENCY, stats=None):
+    """
+    Yields the object's bytes in order, one part at a time.
+    Pass a TransferStats to collect bytes/sec.
+    """
+    size = s3_client.head_object(Bucket=bucket, Key=key)["ContentLength"]
+    if stats is not None:
+        stats.total_bytes = size
+
+    ranges = [(start, min(start + part_size, size) - 1) for start in range(0, size, part_size)]
+    pending = deque()
+    next_range = 0
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        # Keep at most 'concurrency' parts in flight (bounded read-ahead)
+        while next_range < len(ranges) and len(pending) < concurrency:
+            pending.append(pool.submit(_get_range, s3_client, bucket, key, *ranges[next_range]))
+            next_range += 1
+
+        while pending:
+            chunk = pending.popleft().result()
+            if next_range < len(ranges):
+                pending.append(pool.submit(_get_range, s3_client, bucket, key, *ranges[next_range]))
+                next_range += 1
+            if stats is not None:
+                stats.bytes += len(chunk)
+            yield chunk
+
+    if stats is not None:
+        stats.finished = time.monotonic()
+
+
+def download_to_file(s3_client, bucket, key, dest_path, part_size=PART_SIZE, concurrency=CONCURRENCY, hasher=None):
+    """
+    Parallel replacement for s3_client.download_file. Returns TransferStats.
+    Pass a ContentHasher to hash the bytes on the way through (no second read of the file).
+    """
+    stats = TransferStats()
+    with open(dest_path, "wb") as f:
+        for chunk in iter_object_chunks(s3_client, bucket, key, part_size, concurrency, stats):
+            if hasher is not None:
+                hasher.update(chunk)
+            f.write(chunk)
+    return stats
+
+
+def pipe_to_processes(chunks, processes):
+    """
+    Tees the chunks into the stdin of every process (e.g. several FFmpeg jobs
+    reading 'pipe:0'). A process that exits early is dropped; the rest keep reading.
+    """
+    alive = list(processes)
+    for chunk in chunks:
+        for proc in list(alive):
+            try:
+                proc.stdin.write(chunk)
+            except (BrokenPipeError, OSError):
+                alive.remove(proc)
+        if not alive:
+            break
+    for proc in processes:
+        try:
+            proc.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
@@ -0,0 +1,149 @@
+"""
+Per-job scratch space for the worker, with a node-wide disk budget.
+
+    with job_dir("video42", need_bytes) as work_dir:
+        ... # download / transcode into work_dir
+
+- Every job gets its own directory under SCRATCH_DIR: two uploads with the
+  same file name can no longer overwrite each other.
+- A job reserves 'need_bytes' before it starts. When the reservations of all
+  running jobs on this node (every worker process sharing SCRATCH_DIR) would
+  exceed SCRATCH_BUDGET_GB, or the disk is nearly full, the job waits.
+- The directory is removed when the job ends, whether it succeeded or not.
+- sweep() (called at worker startup) removes directories left behind by
+  processes that crashed or were killed.
+"""
+import os
+import json
+import time
+import uuid
+import fcntl
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+# --- CONFIGURATION ---
+SCRATCH_DIR = os.getenv("SCRATCH_DIR") or os.path.join(tempfile.gettempdir(), "codex-scratch")
+SCRATCH_BUDGET_BYTES = int(float(os.getenv("SCRATCH_BUDGET_GB", "50")) * 1024 ** 3)
+SCRATCH_MIN_FREE_BYTES = int(float(os.getenv("SCRATCH_MIN_FREE_GB", "2")) * 1024 ** 3) # Never fill the disk
+SCRATCH_MAX_WAIT = float(os.getenv("SCRATCH_MAX_WAIT", "3600")) # Then give up: the job queue retries later
+POLL_INTERVAL = 2.0
+RESERVATION_FILE = ".reservation"
+# Tells this process apart from an earlier one with the same pid (containers often run as pid 1)
+PROCESS_TOKEN = uuid.uuid4().hex
+
+
+class ScratchBudgetExceeded(RuntimeError):
+    pass
+
+
+@contextmanager
+def _node_lock():
+    # flock: also serializes the worker PROCESSES of this node, not only threads
+    os.makedirs(SCRATCH_DIR, exist_ok=True)
+    with open(os.path.join(SCRATCH_DIR, ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _read_reservation(path):
+    try:
+        with open(os.path.join(path, RESERVATION_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _owner_alive(reservation):
+    pid = reservation.get("pid")
+    if not pid:
+        return False
+    if pid == os.getpid():
+        return reservation.get("token") == PROCESS_TOKEN
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _job_dirs():
+    return [
+        os.path.join(SCRATCH_DIR, name) for name in os.listdir(SCRATCH_DIR)
+        if os.path.isdir(os.path.join(SCRATCH_DIR, name))
+    ]
+
+
+def reserved_bytes():
+    """
+    Bytes reserved by the running jobs of this node (dead owners do not count).
+    """
+    total = 0
+    for path in _job_dirs():
+        reservation = _read_reservation(path)
+        if reservation and _owner_alive(reservation):
+            total += reservation.get("bytes", 0)
+    return total
+
+
+def _fits(need_bytes, reserved):
+    if reserved == 0:
+        # Alone on the node: run even if bigger than the budget, otherwise it never would
+        return True
+    free = shutil.disk_usage(SCRATCH_DIR).free
+    return reserved + need_bytes <= SCRATCH_BUDGET_BYTES and need_bytes <= free - SCRATCH_MIN_FREE_BYTES
+
+
+def _try_reserve(label, need_bytes):
+    with _node_lock():
+        if not _fits(need_bytes, reserved_bytes()):
+            return None
+        path = os.path.join(SCRATCH_DIR, f"{label}-{os.getpid()}-{uuid.uuid4().hex[:8]}")
+        os.makedirs(path)
+        with open(os.path.join(path, RESERVATION_FILE), "w") as f:
+            json.dump({"pid": os.getpid(), "token": PROCESS_TOKEN, "bytes": need_bytes, "created": time.time()}, f)
+        return path
+
+
+@contextmanager
+def job_dir(label, need_bytes):
+    """
+    Waits until 'need_bytes' fit in the budget, yields a fresh directory,
+    and always removes it afterwards.
+    """
+    deadline = time.monotonic() + SCRATCH_MAX_WAIT
+    path = _try_reserve(label, need_bytes)
+    if path is None:
+        print(f"⏳ Scratch budget full. Waiting for {need_bytes / 1024 ** 3:.2f} GB...")
+    while path is None:
+        if time.monotonic() > deadline:
+            raise ScratchBudgetExceeded(f"No room for {need_bytes} bytes of scratch after {SCRATCH_MAX_WAIT}s")
+        time.sleep(POLL_INTERVAL)
+        path = _try_reserve(label, need_bytes)
+
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def sweep():
+    """
+    Removes the directories of jobs whose process is gone (crash, OOM kill, reboot).
+    """
+    removed = 0
+    with _node_lock():
+        for path in _job_dirs():
+            reservation = _read_reservation(path)
+            if reservation and _owner_alive(reservation):
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+    if removed:
+        print(f"🧹 Removed {removed} scratch dir(s) left by dead workers.")
+    return removed
@@ -0,0 +1,225 @@
+"""
+Hybrid retrieval for /search: pgvector (meaning) + Postgres full-text (exact terms),
+merged with Reciprocal Rank Fusion INSIDE Postgres:
+
+    score(video) = 1 / (RRF_K + semantic_rank) + 1 / (RRF_K + lexical_rank)
+
+A video found by only one retriever still scores; one found by both wins.
+The chapter-by-time lookups (chapter_at, chapters_between) live here too.
+All queries run on the async engine (database.get_async_db).
+
+Every query is scoped to ONE user (tenant) inside SQL, so the work grows with
+that user's library, not the whole table:
+- video_segments carries user_id (copied from the video). A small tenant is
+  ranked exactly off the (user_id, video_id) index; a large one goes through the
+  shared HNSW index with pgvector's iterative scan (HNSW_ITERATIVE_SCAN, pgvector >= 0.8), which
+  keeps scanning until enough of the tenant's rows are found.
+- Optional tag filter: tags::jsonb @> '["react"]' (GIN, jsonb_path_ops).
+"""
+import os
+import json
+from sqlalchemy import text, bindparam, select, or_
+from pgvector.sqlalchemy import Vector
+import models
+
+# --- CONFIGURATION ---
+SEGMENT_CANDIDATES = int(os.getenv("SEARCH_SEGMENT_CANDIDATES", "100")) # Moments fetched from the ANN index
+LEXICAL_CANDIDATES = int(os.getenv("SEARCH_LEXICAL_CANDIDATES", "100")) # Videos fetched from the GIN index
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "120")) # Recall/speed trade-off (must be >= SEGMENT_CANDIDATES)
+# Filtered ANN (pgvector >= 0.8): "relaxed_order", "strict_order", or "" to leave the server default.
+# Unset: "relaxed_order" if the installed pgvector has it (see check_iterative_scan)
+HNSW_ITERATIVE_SCAN = os.getenv("HNSW_ITERATIVE_SCAN")
+ITERATIVE_SCAN_SINCE = (0, 8)
+RRF_K = 60 # Standard RRF constant: damps the weight of the very top ranks
+MOMENTS_PER_VIDEO = 3
+
+# Appended to the segment / video filters when the request filters on tags
+SEGMENT_TAG_FILTER = """
+      AND s.video_id IN (
+          SELECT v.id FROM videos v
+          WHERE v.user_id = :user_id AND v.tags::jsonb @> CAST(:tags AS jsonb)
+      )"""
+VIDEO_TAG_FILTER = """
+      AND v.tags::jsonb @> CAST(:tags AS jsonb)"""
+
+HYBRID_SEARCH_SQL = """
+WITH q AS (
+    SELECT websearch_to_tsquery('english', :query) AS tsq
+),
+segment_hits AS (
+    -- ANN over the user's video_segments (HNSW, cosine)
+    SELECT s.video_id, s.embedding <=> :query_vector AS distance
+    FROM video_segments s
+    WHERE s.user_id = :user_id{segment_filter}
+    ORDER BY s.embedding <=> :query_vector
+    LIMIT :segment_candidates
+),
+legacy_hits AS (
+    -- Videos ingested before segments existed only have the video-level vector
+    SELECT v.id AS video_id, v.embedding <=> :query_vector AS distance
+    FROM videos v
+    WHERE v.user_id = :user_id
+      AND v.embedding IS NOT NULL
+      AND NOT EXISTS (SELECT 1 FROM video_segments s WHERE s.video_id = v.id){video_filter}
+    ORDER BY v.embedding <=> :query_vector
+    LIMIT :segment_candidates
+),
+semantic AS (
+    SELECT video_id, row_number() OVER (ORDER BY min(distance)) AS rank
+    FROM (SELECT * FROM segment_hits UNION ALL SELECT * FROM legacy_hits) hits
+    GROUP BY video_id
+),
+lexical AS (
+    -- Full-text over videos.search_tsv (GIN)
+    SELECT v.id AS video_id,
+           row_number() OVER (ORDER BY ts_rank_cd(v.search_tsv, q.tsq) DESC) AS rank
+    FROM videos v, q
+    WHERE v.user_id = :user_id
+      AND v.search_tsv @@ q.tsq{video_filter}
+    ORDER BY rank
+    LIMIT :lexical_candidates
+)
+SELECT coalesce(s.video_id, l.video_id) AS video_id,
+       coalesce(1.0 / (:rrf_k + s.rank), 0) + coalesce(1.0 / (:rrf_k + l.rank), 0) AS score,
+       s.rank AS semantic_rank,
+       l.rank AS lexical_rank
+FROM semantic s
+FULL OUTER JOIN lexical l ON s.video_id = l.video_id
+ORDER BY score DESC
+LIMIT :limit
+"""
+
+# Two fixed statements (with / without tag filter), so each keeps a stable plan
+HYBRID_SEARCH_STATEMENTS = {
+    tagged: text(HYBRID_SEARCH_SQL.format(
+        segment_filter=SEGMENT_TAG_FILTER if tagged else "",
+        video_filter=VIDEO_TAG_FILTER if tagged else ""
+    )).bindparams(bindparam("query_vector", type_=Vector(768)))
+    for tagged in (False, True)
+}
+
+
+def check_iterative_scan(engine):
+    """
+    Once at startup: older pgvector rejects 'SET hnsw.iterative_scan', which would fail every /search.
+    """
+    global HNSW_ITERATIVE_SCAN
+    with engine.connect() as conn:
+        version = conn.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar()
+    supported = bool(version) and tuple(int(part) for part in version.split(".")[:2]) >= ITERATIVE_SCAN_SINCE
+    if HNSW_ITERATIVE_SCAN is None:
+        HNSW_ITERATIVE_SCAN = "relaxed_order" if supported else ""
+    elif HNSW_ITERATIVE_SCAN and not supported:
+        print(f"⚠️ pgvector {version} has no iterative scan: ignoring HNSW_ITERATIVE_SCAN={HNSW_ITERATIVE_SCAN}")
+        HNSW_ITERATIVE_SCAN = ""
+    return HNSW_ITERATIVE_SCAN
+
+
+async def hybrid_search(db, query, query_vector, limit, user_id, tags=None):
+    """
+    Returns [(video_id, score, semantic_rank, lexical_rank)], best first, among
+    the videos of 'user_id' (having ALL 'tags', if given).
+    A rank is None when that retriever did not find the video.
+    """
+    await db.execute(text(f"SET LOCAL hnsw.ef_search = {HNSW_EF_SEARCH}"))
+    if HNSW_ITERATIVE_SCAN:
+        await db.execute(text(f"SET LOCAL hnsw.iterative_scan = {HNSW_ITERATIVE_SCAN}"))
+    params = {
+        "query": query,
+        "user_id": user_id,
+        "query_vector": query_vector,
+        "segment_candidates": SEGMENT_CANDIDATES,
+        "lexical_candidates": LEXICAL_CANDIDATES,
+        "rrf_k": RRF_K,
+        "limit": limit
+    }
+    if tags:
+        params["tags"] = json.dumps(tags)
+    result = await db.execute(HYBRID_SEARCH_STATEMENTS[bool(tags)], params)
+    return result.all()
+
+
+async def best_moments(db, video_ids, query_vector):
+    """
+    The closest segments of each result video ({video_id: [moment, ...]}).
+    Only touches the segments of the (few) result videos.
+    """
+    distance = models.VideoSegment.embedding.cosine_distance(query_vector)
+    result = await db.execute(select(
+        models.VideoSegment.video_id,
+        models.VideoSegment.start_sec,
+        models.VideoSegment.end_sec,
+        models.VideoSegment.label,
+        distance.label("distance")
+    ).where(models.VideoSegment.video_id.in_(video_ids)).order_by(distance))
+    rows = result.all()
+
+    moments_by_video = {}
+    for row in rows:
+        moments = moments_by_video.setdefault(row.video_id, [])
+        if len(moments) < MOMENTS_PER_VIDEO:
+            moments.append({
+                "start_sec": row.start_sec,
+                "end_sec": row.end_sec,
+                "label": row.label,
+                "score": round(1 - row.distance, 4)
+            })
+    return moments_by_video
+
+
+def match_type(semantic_rank, lexical_rank):
+    if semantic_rank and lexical_rank:
+        return "hybrid"
+    return "lexical" if lexical_rank else "semantic"
+
+
+# --- CHAPTERS BY TIME ---
+# video_segments rows are the chapters (integer seconds), indexed on (video_id, start_sec).
+
+CHAPTER_COLUMNS = (
+    models.VideoSegment.id,
+    models.VideoSegment.start_sec,
+    models.VideoSegment.end_sec,
+    models.VideoSegment.label
+)
+
+# A video without chapters has one label-less segment (the whole video): search only, not a chapter
+IS_CHAPTER = models.VideoSegment.label.isnot(None)
+
+
+async def chapter_at(db, video_id, second, user_id):
+    """
+    The chapter playing at 'second', or None. One backward index seek:
+    the last chapter starting at or before 'second', if it has not ended yet.
+    """
+    result = await db.execute(
+        select(*CHAPTER_COLUMNS)
+        .where(
+            models.VideoSegment.video_id == video_id,
+            models.VideoSegment.user_id == user_id,
+            models.VideoSegment.start_sec <= second,
+            IS_CHAPTER
+        )
+        .order_by(models.VideoSegment.start_sec.desc())
+        .limit(1)
+    )
+    row = result.first()
+    if row is None or (row.end_sec is not None and row.end_sec <= second):
+        return None
+    return row
+
+
+async def chapters_between(db, video_id, user_id, start=None, end=None):
+    """
+    Chapters overlapping [start, end) (either bound optional), in time order.
+    One index range scan: start_sec < end bounds the scan, end_sec > start filters it.
+    """
+    stmt = select(*CHAPTER_COLUMNS).where(
+        models.VideoSegment.video_id == video_id, models.VideoSegment.user_id == user_id, IS_CHAPTER
+    )
+    if end is not None:
+        stmt = stmt.where(models.VideoSegment.start_sec < end)
+    if start is not None:
+        stmt = stmt.where(or_(models.VideoSegment.end_sec.is_(None), models.VideoSegment.end_sec > start))
+    result = await db.execute(stmt.order_by(models.VideoSegment.start_sec))
+    return result.all()
@@ -0,0 +1,94 @@
+"""
+/search result cache: popular queries skip the embedding API and Postgres.
+
+    key = <user>:<user's library version>:<limit>:<tags as a JSON list>:<normalized query>
+
+- A hit only re-signs the URLs (local and cached, see url_signer.py), so a cached
+  result never hands out an expired link.
+- Invalidation: the worker bumps the OWNER's library version in the SAME transaction
+  that sets processed=True (see bump_library_version). Keys of older versions are never
+  read again and age out of the LRU (or the Redis TTL). Other users' entries stay valid:
+  search is scoped per user (see search.py).
+- The API re-reads a user's version at most every SEARCH_CACHE_VERSION_TTL seconds, so a
+  newly processed video shows up in cached queries within that delay.
+"""
+import os
+import json
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+import models
+import metrics
+from cache import TTLCache, make_cache, normalize_query
+
+# --- CONFIGURATION ---
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "2048"))
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", "600")) # Upper bound, versions usually expire entries first
+SEARCH_CACHE_VERSION_TTL = float(os.getenv("SEARCH_CACHE_VERSION_TTL", "2"))
+
+
+def library_name(user_id):
+    return f"videos:{user_id}"
+
+
+def bump_library_version(db, user_id):
+    """
+    Worker side. Call before the commit that makes one of 'user_id's videos searchable.
+    """
+    stmt = insert(models.LibraryVersion).values(name=library_name(user_id), version=1)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[models.LibraryVersion.name],
+        set_={"version": models.LibraryVersion.version + 1}
+    ))
+
+
+class LibraryVersionClock:
+    """
+    API side: each user's library version, read from Postgres at most every 'ttl' seconds.
+    """
+    def __init__(self, ttl=SEARCH_CACHE_VERSION_TTL):
+        self.versions = TTLCache(maxsize=100000, ttl=ttl)
+
+    async def get(self, db, user_id):
+        version = self.versions.get(user_id)
+        if version is None:
+            result = await db.execute(
+                select(models.LibraryVersion.version).where(models.LibraryVersion.name == library_name(user_id))
+            )
+            version = result.scalar() or 0
+            self.versions.set(user_id, version)
+        return version
+
+
+class SearchResultCache:
+    def __init__(self):
+        self.cache = make_cache("search_results", maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL)
+        self.clock = LibraryVersionClock()
+        self.latency = {"hit": [0, 0.0], "miss": [0, 0.0]} # outcome -> [count, total seconds]
+
+    async def key(self, db, user_id, query, limit, tags=None):
+        version = await self.clock.get(db, user_id)
+        # Exact (the tag filter is case-sensitive) and unambiguous: ["a,b"] is not ["a", "b"]
+        tag_scope = json.dumps(sorted(set(tags or [])))
+        return f"{user_id}:{version}:{limit}:{tag_scope}:{normalize_query(query)}"
+
+    async def aget(self, key):
+        return await self.cache.aget(key)
+
+    async def aset(self, key, results):
+        await self.cache.aset(key, results)
+
+    def observe(self, outcome, seconds):
+        metrics.SEARCH_SECONDS.labels(cache=outcome).observe(seconds)
+        entry = self.latency[outcome]
+        entry[0] += 1
+        entry[1] += seconds
+
+    def stats(self):
+        return {
+            **self.cache.stats(),
+            "tracked_users": self.clock.versions.stats()["size"],
+            "mean_ms": {
+                outcome: round(total / count * 1000, 2) if count else None
+                for outcome, (count, total) in self.latency.items()
+            }
+        }
@@ -0,0 +1,104 @@
+"""
+API tests against a real Postgres with pgvector: the SQL is what they exercise.
+
+    TEST_DATABASE_URL=postgresql://... python -m pytest tests
+
+The tables are dropped and recreated: point it at a disposable database.
+Without TEST_DATABASE_URL only the tests that need the database (the
+'database' / 'api' fixtures) are skipped; the pure ones always run.
+Embeddings come from benchmarks/fakes.py, so no key and no network are needed.
+"""
+import os
+import sys
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(TESTS_DIR)
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+# The backend reads its config at import time: set it before any test module imports it.
+# Without a test database the engines point nowhere; they only connect when used.
+os.environ["DATABASE_URL"] = TEST_DATABASE_URL or "postgresql://codex-tests@127.0.0.1:1/unused"
+os.environ.setdefault("AWS_REGION", "us-east-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "test")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "test")
+os.environ.setdefault("AWS_BUCKET_NAME", "codex-test")
+os.environ.setdefault("GOOGLE_API_KEY", "offline")
+os.environ["TRUSTED_PROXY_SECRET"] = "test-proxy"
+os.environ.pop("CACHE_REDIS_URL", None)
+for path in (BACKEND_DIR, os.path.join(BACKEND_DIR, "benchmarks")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+@pytest.fixture(scope="session")
+def database():
+    """
+    A fresh schema, once per session.
+    """
+    if not TEST_DATABASE_URL:
+        pytest.skip("Set TEST_DATABASE_URL to a disposable Postgres with pgvector")
+    import models
+    from database import engine
+
+    models.Base.metadata.drop_all(bind=engine)
+    models.init_db(engine)
+    return engine
+
+
+@pytest.fixture(scope="session")
+def api(database):
+    """
+    The real FastAPI app, with offline embeddings.
+    One TestClient for the session: the async engine's pool stays on one event loop.
+    """
+    from fastapi.testclient import TestClient
+    import fakes
+
+    import main
+    fakes.configure_embeddings(fakes.FakeConfig(latency_scale=0))
+    main.embeddings = fakes.FakeEmbeddings()
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture
+def as_user():
+    """
+    The headers the auth proxy adds for a signed-in user.
+    """
+    return lambda user_id: {"X-User-Id": user_id, "X-Proxy-Secret": "test-proxy"}
+
+
+@pytest.fixture
+def seed_video():
+    """
+    Inserts a processed video (and its chapter segments) the way the worker leaves it.
+    """
+    import models
+    import fakes
+    from database import SessionLocal
+    from search_cache import bump_library_version
+
+    def seed(user_id, title, chapters):
+        with SessionLocal() as db:
+            summary = f"{title}. " + " ".join(label for _, label in chapters)
+            video = models.Video(
+                title=title, s3_key=f"uploads/{title}.mp4", user_id=user_id, processed=True,
+                transcript_summary=summary, visual_summary="Slides.", tags=["test"],
+                chapters=[{"timestamp": f"{start // 60:02d}:{start % 60:02d}", "label": label} for start, label in chapters],
+                embedding=fakes.text_vector(summary)
+            )
+            db.add(video)
+            db.flush()
+            ends = [start for start, _ in chapters[1:]] + [None]
+            for (start, label), end in zip(chapters, ends):
+                db.add(models.VideoSegment(
+                    video_id=video.id, user_id=user_id, start_sec=start, end_sec=end,
+                    label=label, content=label, embedding=fakes.text_vector(label)
+                ))
+            bump_library_version(db, user_id)
+            db.commit()
+            return video.id
+    return seed
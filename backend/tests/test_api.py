@@ -0,0 +1,106 @@
+"""
+Smoke tests: main imports, and the listing and search routes answer against the real schema.
+"""
+
+
+def test_list_videos(api, seed_video, as_user):
+    video_id = seed_video("smoke-list", "event loop lecture", [(0, "Intro"), (120, "Event loop basics")])
+
+    response = api.get("/videos/", headers=as_user("smoke-list"))
+
+    assert response.status_code == 200
+    videos = response.json()
+    assert [v["id"] for v in videos] == [video_id]
+    # Heavy columns stay out of the listing
+    assert "embedding" not in videos[0] and "search_tsv" not in videos[0]
+
+
+def test_list_videos_compact(api, seed_video, as_user):
+    seed_video("smoke-compact", "css grid lecture", [(0, "Css grid basics")])
+
+    response = api.get("/videos/", params={"view": "compact"}, headers=as_user("smoke-compact"))
+
+    assert response.status_code == 200
+    assert set(response.json()[0]) == {"id", "title", "tags", "processed", "created_at"}
+
+
+
+def test_search(api, seed_video, as_user):
+    video_id = seed_video("smoke-search", "git rebase lecture", [(0, "Intro"), (300, "Git rebase basics")])
+
+    response = api.post("/search", json={"query": "git rebase", "limit": 5}, headers=as_user("smoke-search"))
+
+    assert response.status_code == 200
+    results = response.json()
+    assert results and results[0]["id"] == video_id
+
+
+def test_search_repeated(api, seed_video, as_user):
+    # Once pgvector is loaded in a connection, settings it does not know are rejected
+    seed_video("smoke-repeat", "docker images lecture", [(0, "Docker images basics")])
+
+    for query in ("docker images", "docker basics", "images"):
+        response = api.post("/search", json={"query": query, "limit": 5}, headers=as_user("smoke-repeat"))
+        assert response.status_code == 200
+
+
+def test_user_header_needs_the_proxy_secret(api):
+    assert api.get("/videos/", headers={"X-User-Id": "someone"}).status_code == 401
+    assert api.get("/videos/", headers={"X-User-Id": "someone", "X-Proxy-Secret": "guess"}).status_code == 401
+    assert api.post("/search", json={"query": "x"}, headers={"X-Proxy-Secret": "test-proxy"}).status_code == 401
+
+
+def test_backfilled_chapters(api, as_user, monkeypatch):
+    import models
+    import fakes
+    import backfill_segments
+    from types import SimpleNamespace
+    from database import SessionLocal
+
+    with SessionLocal() as db:
+        chaptered, plain = (
+            models.Video(title=title, s3_key=f"uploads/{title}.mp4", user_id="legacy", processed=True,
+                         transcript_summary="Old notes.", chapters=chapters)
+            for title, chapters in (
+                ("chaptered", [{"timestamp": "00:00", "label": "Intro"}, {"timestamp": "02:00", "label": "Joins"}]),
+                ("plain", [])
+            )
+        )
+        db.add_all([chaptered, plain])
+        db.commit()
+        ids = chaptered.id, plain.id
+
+        service = SimpleNamespace(embed_documents_pooled=lambda texts: [fakes.text_vector(t) for t in texts])
+        monkeypatch.setattr(backfill_segments, "get_embedding_service", lambda: service)
+        assert backfill_segments.backfill(db, backfill_segments.pending(db, 10)) == 3
+        assert backfill_segments.pending(db, 10) == []
+
+    headers = as_user("legacy")
+    assert api.get(f"/videos/{ids[0]}/chapters", params={"at": 150}, headers=headers).json()["label"] == "Joins"
+    # The whole-video segment of a video without chapters is not a chapter
+    assert api.get(f"/videos/{ids[1]}/chapters", headers=headers).json() == []
+    assert api.get(f"/videos/{ids[1]}/chapters", params={"at": 5}, headers=headers).status_code == 404
+
+
+def test_uploads_are_scoped_to_their_owner(api, as_user):
+    upload = {"filename": "lecture 1.mp4", "content_type": "video/mp4"}
+    assert api.post("/videos/presigned-url", json=upload).status_code == 401
+
+    first, again = (api.post("/videos/presigned-url", json=upload, headers=as_user("uploader")).json() for _ in range(2))
+    assert first["key"].startswith("uploads/uploader/") and first["key"].endswith("/lecture 1.mp4")
+    assert first["key"] != again["key"]
+
+    body = {"key": first["key"], "title": "Lecture 1"}
+    assert api.post("/videos/process", json=body, headers=as_user("someone-else")).status_code == 403
+    assert api.post("/videos/process", json={"key": "lecture 1.mp4"}, headers=as_user("uploader")).status_code == 403
+    assert api.post("/videos/process", json=body, headers=as_user("uploader")).status_code == 200
+    assert api.post("/videos/process", json=body, headers=as_user("uploader")).status_code == 409
+
+
+def test_hls_cookies_need_the_owner(api, seed_video, as_user):
+    video_id = seed_video("hls-owner", "hls lecture", [(0, "Intro")])
+
+    assert api.get(f"/videos/{video_id}/hls/cookies").status_code == 401
+    assert api.get(f"/videos/{video_id}/hls/cookies", headers=as_user("hls-someone-else")).status_code == 404
+    response = api.get(f"/videos/{video_id}/hls/cookies", headers=as_user("hls-owner"))
+    assert response.status_code == 404 and response.json()["detail"] == "No HLS rendition"
@@ -0,0 +1,266 @@
+"""
+Worker-side checks that need neither Gemini nor S3 (only the ones taking the
+'database' fixture need Postgres).
+"""
+import pytest
+
+import decoupling
+from checkpoints import IngestCheckpoint
+
+
+def test_redelivered_done_job_is_a_no_op():
+    checkpoint = IngestCheckpoint(1, stage="done")
+
+    # No database, S3 or scratch access at all
+    assert decoupling.scratch_need("bucket", "uploads/a.mp4", checkpoint) == 0
+    assert decoupling.ingest(None, checkpoint, 1, "uploads/a.mp4", "bucket", "/nonexistent/a.mp4") == "already_done"
+
+
+def test_request_over_the_tpm_quota_is_not_retried():
+    import job_queue
+    from rate_limiter import QuotaExceededError, acquire_model, quota_limits
+
+    too_big = quota_limits("gemini-flash-latest")["tpm"] + 1
+    with pytest.raises(QuotaExceededError) as raised:
+        acquire_model(["gemini-flash-latest"], too_big, max_wait=0)
+    assert isinstance(raised.value, job_queue.PermanentJobError)
+    # Nothing was reserved for it
+    assert acquire_model(["gemini-flash-latest"], 1, max_wait=0) == "gemini-flash-latest"
+
+
+def test_chapters_on_the_same_second_make_one_segment():
+    chapters = [
+        {"start_sec": 10, "label": "Setup", "summary": "a"},
+        {"start_sec": 10, "label": "Install", "summary": "b"},
+        {"start_sec": 60, "label": "Run", "summary": "c"}
+    ]
+
+    segments = decoupling.build_segments(chapters, "notes", duration_sec=100)
+
+    assert [(s["start_sec"], s["end_sec"], s["label"]) for s in segments] == [(10, 60, "Setup"), (60, 100, "Run")]
+    assert segments[0]["content"] == "Setup\na\nInstall\nb"
+
+
+def test_hyper_lapse_without_keyframe_times_is_never_guessed():
+    chapters = [{"timestamp": "00:30", "label": "Intro"}]
+
+    with pytest.raises(ValueError):
+        decoupling.scale_timestamps(chapters, frame_times=[])
+    # What analyze_files does instead: chapters on the audio's (real) timeline
+    assert "AUDIO's timeline" in decoupling.build_prompt("decoupled", video_timeline=False)
+    assert decoupling.scale_timestamps(chapters, ratio=1.0, offset=60)[0]["start_sec"] == 90
+
+
+class FakeS3:
+    def __init__(self, objects):
+        self.objects = objects
+        self.deleted = []
+
+    def head_object(self, Bucket, Key):
+        return {"ContentLength": len(self.objects[Key])}
+
+    def get_object(self, Bucket, Key, Range):
+        import io
+        start, end = (int(x) for x in Range.split("=")[1].split("-"))
+        return {"Body": io.BytesIO(self.objects[Key][start:end + 1])}
+
+    def delete_object(self, Bucket, Key):
+        self.deleted.append(Key)
+
+
+def test_stream_mode_checks_for_a_duplicate_before_ffmpeg(database, monkeypatch):
+    import models
+    from database import SessionLocal
+
+    body = b"lecture" * 1000
+    s3 = FakeS3({"uploads/a.mp4": body, "uploads/b.mp4": body, "uploads/c.mp4": body + b"!"})
+    monkeypatch.setattr(decoupling, "s3_client", s3)
+    monkeypatch.setattr(decoupling, "INGEST_MODE", "stream")
+
+    with SessionLocal() as db:
+        first, again, other = (
+            models.Video(title=key, s3_key=key, user_id="dedup", processed=False)
+            for key in ("uploads/a.mp4", "uploads/b.mp4", "uploads/c.mp4")
+        )
+        db.add_all([first, again, other])
+        db.commit()
+
+        assert decoupling.should_stream(db, "bucket", first.s3_key, first.id)
+        first.processed = True
+        db.commit()
+        # Same bytes as a processed video: download and hash first, no transcode yet
+        assert not decoupling.should_stream(db, "bucket", again.s3_key, again.id)
+        assert decoupling.should_stream(db, "bucket", other.s3_key, other.id)
+
+
+def test_upload_timeout_deletes_the_gemini_files(monkeypatch, tmp_path):
+    import fakes
+
+    fake = fakes.FakeGenai(fakes.FakeConfig(processing_sec=60))
+    monkeypatch.setattr(decoupling, "genai", fake)
+    monkeypatch.setattr(decoupling, "UPLOAD_DEADLINE", 0.5)
+    monkeypatch.setattr(decoupling, "UPLOAD_POLL_INITIAL", 0.1)
+    paths = []
+    for name in ("audio.mp3", "visuals.mp4"):
+        path = tmp_path / name
+        path.write_bytes(b"x" * 1024)
+        paths.append(str(path))
+
+    with pytest.raises(TimeoutError):
+        decoupling.upload_files_to_gemini(paths)
+    assert fake.calls["upload"] == 2 and fake._files == {}
+
+
+def test_empty_documents_are_not_embedded():
+    import fakes
+    from embedding_service import EmbeddingService
+
+    sent = []
+
+    class Client(fakes.FakeEmbeddings):
+        def embed_documents(self, texts, *args, **kwargs):
+            sent.extend(texts)
+            return super().embed_documents(texts, *args, **kwargs)
+
+    fakes.configure_embeddings(fakes.FakeConfig(latency_scale=0))
+    vectors = EmbeddingService(client=Client()).embed_documents_pooled(["Intro\nHello.", "", "  ", None])
+
+    assert sent == ["Intro\nHello."]
+    assert vectors[0] is not None and vectors[1:] == [None, None, None]
+
+
+def test_chunk_results_keep_each_overlap_once():
+    windows = [(0, decoupling.CHUNK_SECONDS + decoupling.CHUNK_OVERLAP), (decoupling.CHUNK_SECONDS, 2 * decoupling.CHUNK_SECONDS)]
+    middle = decoupling.CHUNK_SECONDS + decoupling.CHUNK_OVERLAP / 2
+    results = [
+        {"transcript_summary": "one", "visual_summary": "", "tags": ["a", "b"], "chapters": [
+            {"start_sec": 0, "label": "Intro"}, {"start_sec": int(middle) + 1, "label": "Seen by both (late)"}
+        ]},
+        {"transcript_summary": "two", "visual_summary": "", "tags": ["b"], "chapters": [
+            {"start_sec": int(middle) + 1, "label": "Seen by both"}, {"start_sec": int(middle) + 600, "label": "End"}
+        ]}
+    ]
+
+    merged = decoupling.merge_chunk_results(windows, results)
+
+    assert [c["label"] for c in merged["chapters"]] == ["Intro", "Seen by both", "End"]
+    assert merged["tags"][0] == "b"
+
+
+@pytest.mark.parametrize("extra, count", [(0, 3), (1, 3), (60, 3), (61, 4)])
+def test_chunk_windows_at_the_overlap_boundary(monkeypatch, extra, count):
+    monkeypatch.setattr(decoupling, "CHUNK_SECONDS", 1800)
+    monkeypatch.setattr(decoupling, "CHUNK_OVERLAP", 60)
+
+    windows = decoupling.chunk_windows(3 * 1800 + extra)
+
+    assert len(windows) == count
+    assert windows[-1][1] == 3 * 1800 + extra
+    # 5430s: no (5400, 5430) window, the previous one already covers it
+    assert all(end - start > 60 for start, end in windows)
+
+
+def test_download_mode_skips_the_fingerprint_requests(monkeypatch, tmp_path):
+    from s3_stream import quick_fingerprint, file_fingerprint
+
+    monkeypatch.setattr(decoupling, "INGEST_MODE", "download")
+    # No S3 and no database touched
+    assert decoupling.should_stream(None, "bucket", "uploads/a.mp4", 1) is False
+
+    # The downloaded copy gets the same fingerprint a streamed job computes remotely
+    body = bytes(range(256)) * 9000
+    path = tmp_path / "a.mp4"
+    path.write_bytes(body)
+    assert file_fingerprint(str(path)) == quick_fingerprint(FakeS3({"a.mp4": body}), "bucket", "a.mp4")
+
+
+def test_short_embedding_batches_fail_instead_of_hanging(monkeypatch):
+    import fakes
+    import embedding_service
+
+    class Client(fakes.FakeEmbeddings):
+        def embed_documents(self, texts, *args, **kwargs):
+            return super().embed_documents(texts, *args, **kwargs)[:-1] # One vector short
+
+    fakes.configure_embeddings(fakes.FakeConfig(latency_scale=0))
+    monkeypatch.setattr(embedding_service, "EMBED_TIMEOUT", 5)
+    service = embedding_service.EmbeddingService(client=Client())
+
+    with pytest.raises(RuntimeError, match="2 vectors for 3 texts"):
+        service.embed_texts(["a", "b", "c"])
+
+
+def test_resumed_jobs_reserve_scratch_for_the_proxy(monkeypatch):
+    s3 = FakeS3({"uploads/a.mp4": b"s" * 1000, "renditions/1/proxy.mp4": b"p" * 200})
+    monkeypatch.setattr(decoupling, "s3_client", s3)
+    monkeypatch.setattr(decoupling, "SCRATCH_OUTPUT_RATIO", 0.5)
+    state = {"proxy_key": "renditions/1/proxy.mp4"}
+
+    analyzed = IngestCheckpoint(1, stage="analyzed", state=dict(state))
+    transcoded = IngestCheckpoint(1, stage="transcoded", state=dict(state))
+    assert decoupling.scratch_need("bucket", "uploads/a.mp4", analyzed) == 200
+    assert decoupling.scratch_need("bucket", "uploads/a.mp4", transcoded) == 500 + 200
+    assert decoupling.scratch_need("bucket", "uploads/a.mp4", IngestCheckpoint(1)) == 1000 + 500
+
+
+def test_final_failure_deletes_the_checkpointed_files(database, monkeypatch):
+    import models
+    from database import SessionLocal
+
+    s3 = FakeS3({})
+    deleted_files = []
+    monkeypatch.setattr(decoupling, "s3_client", s3)
+    monkeypatch.setattr(decoupling.genai, "delete_file", deleted_files.append)
+
+    with SessionLocal() as db:
+        video = models.Video(
+            title="failed", s3_key="uploads/failed.mp4", user_id="cleanup", processed=False,
+            ingest_stage="transcoded", ingest_state={
+                "probe": {"duration": 60},
+                "artifacts": {"audio": "ingest-artifacts/9/audio.mp3"},
+                "gemini_files": {"full": ["files/a", "files/b"]}
+            }
+        )
+        db.add(video)
+        db.commit()
+
+        decoupling.discard_checkpoint(db, video.id, "bucket")
+
+        db.refresh(video)
+        assert s3.deleted == ["ingest-artifacts/9/audio.mp3"]
+        assert deleted_files == ["files/a", "files/b"]
+        assert video.ingest_stage == "new"
+        assert video.ingest_state == {"probe": {"duration": 60}}
+
+
+def test_a_reclaimed_job_can_neither_checkpoint_nor_complete(database):
+    import models
+    import job_queue
+    from database import SessionLocal
+
+    with SessionLocal() as db:
+        video = models.Video(title="leased", s3_key="uploads/leased.mp4", user_id="lease", processed=False)
+        db.add(video)
+        db.flush()
+        job = models.IngestionJob(video_id=video.id, s3_key=video.s3_key, status="running", attempts=1, locked_by="w1")
+        db.add(job)
+        db.commit()
+
+        checkpoint = IngestCheckpoint(video.id, lease=job_queue.Lease(job.id, "w1"))
+        checkpoint.save("transcoded", probe={"duration": 60})
+
+        # Lease expired and another worker claimed it
+        job.locked_by = "w2"
+        db.commit()
+
+        with pytest.raises(job_queue.LeaseLostError):
+            checkpoint.save("analyzed", analysis={})
+        assert checkpoint.lease.lost.is_set()
+        with pytest.raises(job_queue.LeaseLostError):
+            checkpoint.check_lease()
+        assert not job_queue.complete_job(db, job.id, "w1")
+
+        db.refresh(video)
+        db.refresh(job)
+        assert video.ingest_stage == "transcoded"
+        assert job.status == "running" and job.locked_by == "w2"
@@ -0,0 +1,22 @@
+"""
+Local repair of the AI's almost-valid JSON (json_repair.py).
+"""
+from json_repair import load_json
+
+
+def test_valid_json_is_strict():
+    assert load_json('{"tags": ["a"]}') == ({"tags": ["a"]}, "strict")
+
+
+def test_fences_and_trailing_commas_are_repaired():
+    assert load_json('```json\n{"a": 1, "b": [1, 2,],}\n```') == ({"a": 1, "b": [1, 2]}, "repaired")
+
+
+def test_inner_quotes_and_invalid_escapes_are_repaired():
+    data, method = load_json('{"label": "the "event loop" model", "path": "C:\\Users"}')
+    assert method == "repaired"
+    assert data == {"label": 'the "event loop" model', "path": "C:\\Users"}
+
+
+def test_truncated_answer_is_closed():
+    assert load_json('{"a": "x", "b": [1, 2') == ({"a": "x", "b": [1, 2]}, "partial")
@@ -0,0 +1,50 @@
+"""
+/search result cache keys (search_cache.py).
+"""
+import asyncio
+
+from search_cache import SearchResultCache
+
+
+def cache_key(tags):
+    cache = SearchResultCache()
+    cache.clock.versions.set("u1", 3) # Known version: no database read
+    return asyncio.run(cache.key(None, "u1", "React  Hooks", 10, tags))
+
+
+def test_tags_with_the_separator_do_not_collide():
+    assert cache_key(["a,b"]) != cache_key(["a", "b"])
+
+
+def test_tag_order_and_repeats_share_an_entry():
+    assert cache_key(["b", "a"]) == cache_key(["a", "b", "a"])
+    assert cache_key(None) == cache_key([])
+
+
+class FakeRedis:
+    def __init__(self, values):
+        self.values = values
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+
+def test_undecodable_redis_value_is_a_miss(monkeypatch):
+    from types import SimpleNamespace
+    import cache
+
+    client = FakeRedis({"codex:search_results:k": b"\x89not json"})
+    monkeypatch.setattr(cache, "redis", SimpleNamespace(Redis=SimpleNamespace(from_url=lambda url, **kwargs: client)))
+    shared = cache.RedisCache("search_results", "redis://unused")
+
+    assert shared.get("k") is None
+    assert shared.client.values == {} # Deleted: the next reader gets a clean miss
+    shared.set("k", [1])
+    shared.local = cache.TTLCache()
+    assert shared.get("k") == [1]
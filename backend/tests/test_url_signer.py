@@ -0,0 +1,52 @@
+import base64
+import json
+
+import pytest
+
+pytest.importorskip("cryptography") # CDN mode's optional dependency
+from cryptography.hazmat.primitives import hashes, serialization  # noqa: E402
+from cryptography.hazmat.primitives.asymmetric import padding, rsa  # noqa: E402
+
+import url_signer  # noqa: E402
+
+
+def cloudfront_b64decode(value):
+    return base64.b64decode(value.replace("-", "+").replace("_", "=").replace("~", "/"))
+
+
+def cdn_signer(tmp_path, monkeypatch):
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    path = tmp_path / "cloudfront.pem"
+    path.write_bytes(key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ))
+    monkeypatch.setattr(url_signer, "CDN_BASE_URL", "https://cdn.example.com")
+    monkeypatch.setattr(url_signer, "CLOUDFRONT_KEY_PAIR_ID", "K123")
+    monkeypatch.setattr(url_signer, "CLOUDFRONT_PRIVATE_KEY_PATH", str(path))
+    return url_signer.UrlSigner(None, "bucket"), key.public_key()
+
+
+def test_cdn_urls_are_signed_per_object(tmp_path, monkeypatch):
+    signer, public_key = cdn_signer(tmp_path, monkeypatch)
+
+    url = signer.sign("renditions/7/proxy.mp4")
+    base, query = url.split("?")
+    params = dict(p.split("=", 1) for p in query.split("&"))
+    assert base == "https://cdn.example.com/renditions/7/proxy.mp4"
+    assert params["Key-Pair-Id"] == "K123"
+    policy = (
+        '{"Statement":[{"Resource":"%s","Condition":{"DateLessThan":{"AWS:EpochTime":%s}}}]}'
+        % (base, params["Expires"])
+    )
+    public_key.verify(cloudfront_b64decode(params["Signature"]), policy.encode(), padding.PKCS1v15(), hashes.SHA1())
+    assert signer.sign("renditions/7/proxy.mp4") == url # Cached until close to expiry
+
+
+def test_cdn_cookies_only_cover_their_prefix(tmp_path, monkeypatch):
+    signer, public_key = cdn_signer(tmp_path, monkeypatch)
+
+    cookies = signer.signed_cookies("renditions/7/hls/")
+    policy = cloudfront_b64decode(cookies["CloudFront-Policy"])
+    public_key.verify(cloudfront_b64decode(cookies["CloudFront-Signature"]), policy, padding.PKCS1v15(), hashes.SHA1())
+    assert json.loads(policy)["Statement"][0]["Resource"] == "https://cdn.example.com/renditions/7/hls/*"
+    assert cookies["path"] == "/renditions/7/hls/"
@@ -0,0 +1,24 @@
+def parse_timestamp(time_str):
+    """
+    "MM:SS" or "HH:MM:SS" -> seconds (int). Returns None if unparseable.
+    """
+    try:
+        parts = list(map(int, str(time_str).strip().split(":")))
+    except (ValueError, AttributeError):
+        return None
+    if len(parts) == 2:
+        return parts[0] * 60 + parts[1]
+    if len(parts) == 3:
+        return parts[0] * 3600 + parts[1] * 60 + parts[2]
+    return None
+
+
+def format_timestamp(seconds):
+    """
+    seconds -> "MM:SS", or "HH:MM:SS" past the hour (same format as the chapters JSON).
+    """
+    m, s = divmod(int(seconds or 0), 60)
+    h, m = divmod(m, 60)
+    if h > 0:
+        return f"{h:02d}:{m:02d}:{s:02d}"
+    return f"{m:02d}:{s:02d}"
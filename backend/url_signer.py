@@ -0,0 +1,123 @@
+"""
+Playback URL signing for /search, /videos/urls and the listings.
+
+S3 mode (default): presigned GETs, cached per s3_key and re-issued only when
+they get close to expiry, so hover previews ask for the SAME URL again and
+the browser cache keeps working.
+
+CDN mode (CDN_BASE_URL + CLOUDFRONT_KEY_PAIR_ID + CLOUDFRONT_PRIVATE_KEY_PATH):
+CloudFront signed URLs (canned policy), cached the same way. HLS segments are
+fetched relative to their playlist and cannot carry a signature: they get
+signed cookies scoped to ONE video's HLS folder (see signed_cookies).
+"""
+import os
+import base64
+import time
+from datetime import datetime, timezone
+from urllib.parse import quote, urlparse
+from cache import TTLCache
+
+# Only needed for CDN mode (pip install cryptography)
+try:
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import padding
+except ImportError:
+    serialization = None
+
+# --- CONFIGURATION ---
+URL_EXPIRES_IN = int(os.getenv("PLAYBACK_URL_EXPIRES_IN", "3600"))
+URL_REFRESH_MARGIN = int(os.getenv("PLAYBACK_URL_REFRESH_MARGIN", "600")) # Re-sign when less than this is left
+CDN_BASE_URL = os.getenv("CDN_BASE_URL", "").rstrip("/")
+CLOUDFRONT_KEY_PAIR_ID = os.getenv("CLOUDFRONT_KEY_PAIR_ID")
+CLOUDFRONT_PRIVATE_KEY_PATH = os.getenv("CLOUDFRONT_PRIVATE_KEY_PATH")
+
+
+class UrlSigner:
+    def __init__(self, s3_client, bucket_name, expires_in=URL_EXPIRES_IN, refresh_margin=URL_REFRESH_MARGIN):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.expires_in = expires_in
+        # An entry is dropped 'refresh_margin' seconds BEFORE its URL expires
+        self.cache = TTLCache(maxsize=50000, ttl=max(expires_in - refresh_margin, 1))
+        self.cdn_private_key = None
+        if CDN_BASE_URL and CLOUDFRONT_KEY_PAIR_ID and CLOUDFRONT_PRIVATE_KEY_PATH:
+            if serialization is None:
+                print("⚠️ CDN mode needs 'cryptography'. Falling back to S3 presigned URLs.")
+            else:
+                with open(CLOUDFRONT_PRIVATE_KEY_PATH, "rb") as f:
+                    self.cdn_private_key = serialization.load_pem_private_key(f.read(), password=None)
+
+    @property
+    def cdn_mode(self):
+        return self.cdn_private_key is not None
+
+    def sign(self, s3_key):
+        """
+        Playback URL for one object, or "" if it could not be signed.
+        """
+        if not s3_key:
+            return ""
+        url = self.cache.get(s3_key)
+        if url is None:
+            try:
+                if self.cdn_mode:
+                    url = self.cdn_url(s3_key)
+                else:
+                    url = self.s3_client.generate_presigned_url(
+                        'get_object',
+                        Params={'Bucket': self.bucket_name, 'Key': s3_key},
+                        ExpiresIn=self.expires_in
+                    )
+            except Exception as e:
+                print(f"Error signing URL for {s3_key}: {e}")
+                return ""
+            self.cache.set(s3_key, url)
+        return url
+
+    def sign_many(self, s3_keys):
+        """
+        Batch path shared by every endpoint: {s3_key: url}, each key signed at most once.
+        """
+        return {key: self.sign(key) for key in set(s3_keys) if key}
+
+    def stats(self):
+        return {"mode": "cdn" if self.cdn_mode else "s3", **self.cache.stats()}
+
+    def _policy(self, resource, expires):
+        # Byte-exact: for a canned policy CloudFront rebuilds this JSON to check the signature
+        policy = (
+            '{"Statement":[{"Resource":"%s","Condition":{"DateLessThan":{"AWS:EpochTime":%d}}}]}'
+            % (resource, expires)
+        ).encode()
+        return policy, self.cdn_private_key.sign(policy, padding.PKCS1v15(), hashes.SHA1())
+
+    def cdn_url(self, s3_key):
+        """
+        CloudFront signed URL (canned policy) for one object.
+        """
+        url = f"{CDN_BASE_URL}/{quote(s3_key)}"
+        expires = int(time.time()) + self.expires_in
+        _, signature = self._policy(url, expires)
+        return f"{url}?Expires={expires}&Signature={_cloudfront_b64(signature)}&Key-Pair-Id={CLOUDFRONT_KEY_PAIR_ID}"
+
+    def signed_cookies(self, prefix, expires_in=None):
+        """
+        CloudFront custom-policy cookies granting access to the objects under 'prefix'
+        only, and sent by the browser only there ("path").
+        """
+        if not self.cdn_mode:
+            return None
+        expires = int(time.time()) + (expires_in or self.expires_in)
+        policy, signature = self._policy(f"{CDN_BASE_URL}/{quote(prefix)}*", expires)
+        return {
+            "CloudFront-Policy": _cloudfront_b64(policy),
+            "CloudFront-Signature": _cloudfront_b64(signature),
+            "CloudFront-Key-Pair-Id": CLOUDFRONT_KEY_PAIR_ID,
+            "path": f"{urlparse(CDN_BASE_URL).path}/{quote(prefix)}",
+            "expires_at": datetime.fromtimestamp(expires, tz=timezone.utc)
+        }
+
+
+def _cloudfront_b64(data):
+    # CloudFront's URL-safe base64 variant
+    return base64.b64encode(data).decode().replace("+", "-").replace("=", "_").replace("/", "~")
@@ -0,0 +1,148 @@
+"""
+Ingestion worker entry point.
+
+    python worker.py --concurrency 2
+
+Runs N ingestion slots on this node. Each slot claims a job from the
+'ingestion_jobs' table, keeps its lease alive with a heartbeat thread
+and runs process_video_task. Start as many workers on as many machines as needed.
+"""
+import os
+import signal
+import socket
+import threading
+import argparse
+from prometheus_client import start_http_server
+import models
+from database import engine, SessionLocal
+from decoupling import process_video_task, discard_checkpoint
+import job_queue
+import scratch
+
+# --- CONFIGURATION ---
+POLL_INTERVAL = float(os.getenv("WORKER_POLL_SECONDS", "5"))
+METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "9100")) # Prometheus scrape port, 0 = off
+HEARTBEAT_INTERVAL = max(job_queue.LEASE_SECONDS // 3, 1)
+
+stop_event = threading.Event()
+
+
+def heartbeat_loop(lease, done):
+    job_id, worker_id = lease.job_id, lease.worker_id
+    while not done.wait(HEARTBEAT_INTERVAL):
+        db = SessionLocal()
+        try:
+            if not job_queue.heartbeat(db, job_id, worker_id):
+                # Another worker reclaimed it: make the job stop at its next stage or write
+                print(f"⚠️ [{worker_id}] Lost lease on job {job_id}. Aborting it.")
+                lease.lost.set()
+                return
+        except Exception as e:
+            print(f"⚠️ [{worker_id}] Heartbeat failed for job {job_id}: {e}")
+        finally:
+            db.close()
+
+
+def run_one(worker_id):
+    """
+    Claims and runs a single job. Returns False if the queue was empty.
+    """
+    bucket_name = os.getenv("AWS_BUCKET_NAME")
+    db = SessionLocal()
+    try:
+        claimed = job_queue.claim_job(
+            db, worker_id, on_failed=lambda video_id: discard_checkpoint(db, video_id, bucket_name)
+        )
+    finally:
+        db.close()
+
+    if not claimed:
+        return False
+
+    job_id, video_id, s3_key, attempt = claimed
+    print(f"📥 [{worker_id}] Claimed job {job_id} (video {video_id}, attempt {attempt}).")
+
+    lease = job_queue.Lease(job_id, worker_id)
+    done = threading.Event()
+    beat = threading.Thread(target=heartbeat_loop, args=(lease, done), daemon=True)
+    beat.start()
+
+    error = None
+    retry = True
+    try:
+        process_video_task(video_id, s3_key, lease)
+    except job_queue.LeaseLostError as e:
+        # The job is someone else's now: neither fail nor complete it
+        print(f"🛑 [{worker_id}] {e}")
+        return True
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        retry = not isinstance(e, job_queue.PermanentJobError)
+    finally:
+        done.set()
+        beat.join()
+
+    db = SessionLocal()
+    try:
+        if error:
+            if job_queue.fail_job(db, job_id, worker_id, error, retry=retry):
+                # No attempt left to resume from the checkpoint
+                discard_checkpoint(db, video_id, bucket_name)
+        elif not job_queue.complete_job(db, job_id, worker_id):
+            print(f"⚠️ [{worker_id}] Job {job_id} was reclaimed before it could be completed.")
+    finally:
+        db.close()
+    return True
+
+
+def slot_loop(worker_id):
+    while not stop_event.is_set():
+        try:
+            if not run_one(worker_id):
+                stop_event.wait(POLL_INTERVAL)
+        except Exception as e:
+            # DB hiccups should not kill the slot
+            print(f"❌ [{worker_id}] Queue error: {e}")
+            stop_event.wait(POLL_INTERVAL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Codex ingestion worker")
+    parser.add_argument(
+        "--concurrency", type=int,
+        default=int(os.getenv("WORKER_CONCURRENCY", "1")),
+        help="Number of videos processed in parallel on this node"
+    )
+    args = parser.parse_args()
+    # FFmpeg sizes its thread pool from this (see decoupling.ffmpeg_threads)
+    os.environ["WORKER_CONCURRENCY"] = str(args.concurrency)
+
+    models.init_db(engine)
+    # Scratch dirs of jobs that died with a previous worker process
+    scratch.sweep()
+
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT)
+        print(f"📊 Metrics on :{METRICS_PORT}/metrics")
+
+    # Finish the current jobs on Ctrl+C / SIGTERM, then exit
+    def shutdown(signum, frame):
+        print("🛑 Shutdown requested. Finishing in-flight jobs...")
+        stop_event.set()
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    node = f"{socket.gethostname()}:{os.getpid()}"
+    print(f"👷 Worker {node} starting with {args.concurrency} slot(s).")
+
+    threads = []
+    for i in range(args.concurrency):
+        t = threading.Thread(target=slot_loop, args=(f"{node}/{i}",))
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join()
+
+
+if __name__ == "__main__":
+    main()
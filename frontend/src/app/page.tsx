@@ -36,7 +36,7 @@ export default function Home() {
 
   const fetchVideos = async () => {
     try {
-      const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/videos/`);
+      const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/videos/?view=compact`);
       const data = await res.json();
       const sortedData = data.sort((a: any, b: any) => new Date(b.created_at).getTime() - new Date(a.created_at).getTime());
       